@@ -0,0 +1,6 @@
+"""
+benchmarks - Herramientas de medición de rendimiento de la API de estadísticas
+
+Los scripts se ejecutan como módulos desde el directorio hospital_stats_api:
+    python -m benchmarks.carga_concurrente
+"""
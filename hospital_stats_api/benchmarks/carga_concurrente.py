@@ -0,0 +1,286 @@
+"""
+carga_concurrente.py - Prueba de carga que mide cómo escala el throughput de la API
+con el número de clientes concurrentes, con una mezcla de endpoints definida en un
+archivo de escenario
+
+Uso (con la API corriendo en otra terminal):
+    python -m benchmarks.carga_concurrente --niveles 1 2 4 8 16 --duracion 10
+    python -m benchmarks.carga_concurrente --escenario benchmarks/escenarios/dashboard.json --json carga.json
+
+Para medir contra una base sembrada con datos sintéticos:
+    python -m benchmarks.datos_sinteticos --url mysql+pymysql://root:@localhost/hospital_bench --escala 1m
+    STATS_DB_URL=mysql+pymysql://root:@localhost/hospital_bench uvicorn main:app --port 8000
+
+El escenario (JSON) define la mezcla de peticiones con su peso, los niveles de
+concurrencia, la duración y el calentamiento de cada nivel:
+
+    {
+      "nombre": "dashboard",
+      "niveles": [1, 4, 16, 32],
+      "duracion": 20,
+      "calentamiento": 2,
+      "peticiones": [
+        {"ruta": "/api/estadisticas", "peso": 30},
+        {"ruta": "/api/health", "peso": 10},
+        {"ruta": "/api/reporte/generar", "metodo": "POST", "params": {"perfil": "ligero"},
+         "peso": 1, "esperar_trabajo": true}
+      ]
+    }
+
+Con `esperar_trabajo`, una respuesta 202 se sigue consultando en su `status_url`
+hasta que el trabajo termina: la latencia informada es la del reporte completo, y
+el cliente no encola otro mientras tanto (si no, la cola de reportes se llena y la
+mezcla mide 503).
+
+Si las queries se ejecutan sin bloquear el event loop, las peticiones se solapan
+y las peticiones/segundo crecen con la concurrencia hasta saturar el pool de hilos
+(STATS_DB_WORKERS) o la base de datos: el informe marca el nivel a partir del cual
+más clientes ya no dan más throughput.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import httpx
+
+ENDPOINTS_DASHBOARD = [
+    "/api/estadisticas",
+    "/api/estadisticas/pacientes",
+    "/api/estadisticas/medicos",
+    "/api/estadisticas/sedes",
+    "/api/estadisticas/citas",
+]
+
+# Un nivel más que no sube el throughput al menos este factor se considera saturado
+GANANCIA_MINIMA = 1.10
+
+
+class Peticion(NamedTuple):
+    """Petición de la mezcla de un escenario"""
+    ruta: str
+    peso: float = 1.0
+    metodo: str = "GET"
+    params: Optional[dict] = None
+    nombre: Optional[str] = None  # etiqueta en el informe (default: método y ruta)
+    esperar_trabajo: bool = False  # seguir un 202 hasta que su trabajo termine
+
+    @property
+    def etiqueta(self) -> str:
+        return self.nombre or (self.ruta if self.metodo == "GET" else f"{self.metodo} {self.ruta}")
+
+
+class Escenario(NamedTuple):
+    """Mezcla de peticiones, niveles de concurrencia y duración de una prueba de carga"""
+    peticiones: Tuple[Peticion, ...]
+    niveles: Tuple[int, ...] = (1, 2, 4, 8, 16)
+    duracion: float = 10.0
+    calentamiento: float = 0.0  # segundos iniciales de cada nivel que no se miden
+    pausa_ms: float = 0.0       # espera de cada cliente entre peticiones
+    nombre: str = "dashboard"
+    semilla: int = 42
+
+
+ESCENARIO_DASHBOARD = Escenario(peticiones=tuple(Peticion(ruta) for ruta in ENDPOINTS_DASHBOARD))
+
+
+def cargar_escenario(ruta: str) -> Escenario:
+    """
+    Lee un escenario desde un archivo JSON
+
+    Args:
+        ruta: Ruta del archivo
+
+    Returns:
+        Escenario con los valores del archivo (y los por defecto para lo que falte)
+    """
+    with open(ruta, encoding="utf-8") as f:
+        datos = json.load(f)
+    peticiones = tuple(Peticion(**p) for p in datos.pop("peticiones"))
+    if not peticiones:
+        raise ValueError("El escenario no tiene peticiones")
+    if "niveles" in datos:
+        datos["niveles"] = tuple(datos["niveles"])
+    return Escenario(peticiones=peticiones, **datos)
+
+
+def percentil(ordenados: Sequence[float], p: float) -> float:
+    """Percentil `p` (0-100) por rango más cercano de una lista ya ordenada"""
+    if not ordenados:
+        return 0.0
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+
+def resumir(latencias: List[float], errores: int, transcurrido: float) -> Dict:
+    """Throughput, percentiles de latencia (ms) y tasa de error de un grupo de peticiones"""
+    latencias_ms = sorted(l * 1000 for l in latencias)
+    return {
+        "peticiones": len(latencias),
+        "errores": errores,
+        "tasa_error": round(errores / len(latencias), 4) if latencias else 0.0,
+        "throughput_rps": round(len(latencias) / transcurrido, 2) if transcurrido else 0.0,
+        "p50_ms": round(percentil(latencias_ms, 50), 2),
+        "p95_ms": round(percentil(latencias_ms, 95), 2),
+        "p99_ms": round(percentil(latencias_ms, 99), 2),
+        "max_ms": round(latencias_ms[-1], 2) if latencias_ms else 0.0,
+    }
+
+
+async def _esperar_trabajo(client: httpx.AsyncClient, status_url: str, intervalo: float = 0.1) -> str:
+    """
+    Consulta el estado de un trabajo encolado hasta que termina
+
+    Returns:
+        Código a informar: "200" si se completó, "error_trabajo" si falló, o el
+        código HTTP de la consulta de estado si no fue 200
+    """
+    while True:
+        await asyncio.sleep(intervalo)
+        response = await client.get(status_url)
+        if response.status_code != 200:
+            return str(response.status_code)
+        estado = response.json()["estado"]
+        if estado == "completado":
+            return "200"
+        if estado == "error":
+            return "error_trabajo"
+
+
+async def _cliente(client: httpx.AsyncClient, escenario: Escenario, desde: float, fin: float,
+                   latencias: Dict[str, List[float]], codigos: Dict[str, Counter], rng: random.Random):
+    """Un cliente que lanza peticiones de la mezcla hasta el instante `fin`; mide las iniciadas desde `desde`"""
+    pesos = [p.peso for p in escenario.peticiones]
+    while time.perf_counter() < fin:
+        peticion = rng.choices(escenario.peticiones, weights=pesos)[0]
+        inicio = time.perf_counter()
+        try:
+            response = await client.request(peticion.metodo, peticion.ruta, params=peticion.params)
+            codigo = str(response.status_code)
+            if peticion.esperar_trabajo and response.status_code == 202:
+                codigo = await _esperar_trabajo(client, response.json()["status_url"])
+        except httpx.TimeoutException:
+            codigo = "timeout"
+        except httpx.HTTPError:
+            codigo = "conexion"
+        if inicio >= desde:
+            latencias[peticion.etiqueta].append(time.perf_counter() - inicio)
+            codigos[peticion.etiqueta][codigo] += 1
+        if escenario.pausa_ms:
+            await asyncio.sleep(escenario.pausa_ms / 1000)
+
+
+def _es_error(codigo: str) -> bool:
+    return not codigo.isdigit() or int(codigo) >= 400
+
+
+async def medir_nivel(url: str, escenario: Escenario, concurrencia: int) -> Dict:
+    """
+    Ejecuta la mezcla del escenario con un nivel de concurrencia
+
+    Args:
+        url: URL base de la API
+        escenario: Mezcla de peticiones, duración y calentamiento
+        concurrencia: Número de clientes simultáneos
+
+    Returns:
+        Diccionario con throughput, percentiles y errores del nivel, en total y por endpoint
+    """
+    etiquetas = [p.etiqueta for p in escenario.peticiones]
+    latencias: Dict[str, List[float]] = {e: [] for e in etiquetas}
+    codigos: Dict[str, Counter] = {e: Counter() for e in etiquetas}
+    limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=120) as client:
+        inicio = time.perf_counter()
+        desde = inicio + escenario.calentamiento
+        fin = desde + escenario.duracion
+        await asyncio.gather(*[
+            # Cada cliente con su propia semilla: la secuencia de peticiones es reproducible
+            _cliente(client, escenario, desde, fin, latencias, codigos,
+                     random.Random(escenario.semilla * 1000 + i))
+            for i in range(concurrencia)
+        ])
+        transcurrido = time.perf_counter() - desde
+
+    por_endpoint = {}
+    for etiqueta in etiquetas:
+        errores = sum(n for codigo, n in codigos[etiqueta].items() if _es_error(codigo))
+        por_endpoint[etiqueta] = {**resumir(latencias[etiqueta], errores, transcurrido),
+                                  "codigos": dict(codigos[etiqueta])}
+    todas = [l for lista in latencias.values() for l in lista]
+    errores = sum(r["errores"] for r in por_endpoint.values())
+    return {"concurrencia": concurrencia, **resumir(todas, errores, transcurrido), "endpoints": por_endpoint}
+
+
+def punto_saturacion(resultados: List[Dict], ganancia_minima: float = GANANCIA_MINIMA) -> Optional[int]:
+    """Último nivel de concurrencia antes de que más clientes dejen de subir el throughput"""
+    for anterior, actual in zip(resultados, resultados[1:]):
+        if anterior["throughput_rps"] and actual["throughput_rps"] < anterior["throughput_rps"] * ganancia_minima:
+            return anterior["concurrencia"]
+    return None
+
+
+async def ejecutar(url: str, escenario: Escenario) -> List[Dict]:
+    """Mide cada nivel de concurrencia de forma secuencial e imprime la tabla de resultados"""
+    resultados = []
+    encabezado = f"{'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'error %':>8}"
+    print(f"Escenario '{escenario.nombre}': {len(escenario.peticiones)} peticiones, "
+          f"{escenario.duracion:g} s por nivel (+{escenario.calentamiento:g} s de calentamiento)\n")
+    for nivel in escenario.niveles:
+        r = await medir_nivel(url, escenario, nivel)
+        resultados.append(r)
+        print(f"▶ {nivel} clientes: {r['peticiones']} peticiones")
+        print(f"  {'':<44} {encabezado}")
+        for etiqueta, e in list(r["endpoints"].items()) + [("TOTAL", r)]:
+            print(f"  {etiqueta:<44} {e['throughput_rps']:>9.1f} {e['p50_ms']:>9.1f} {e['p95_ms']:>9.1f} "
+                  f"{e['p99_ms']:>9.1f} {e['max_ms']:>9.1f} {e['tasa_error'] * 100:>7.1f}%")
+
+    base = resultados[0]["throughput_rps"] if resultados else 0
+    if base:
+        print("\nEscalado respecto al primer nivel:")
+        for r in resultados:
+            print(f"  {r['concurrencia']:>3} clientes: x{r['throughput_rps'] / base:.2f}  "
+                  f"(p99 {r['p99_ms']:.1f} ms, errores {r['tasa_error'] * 100:.1f}%)")
+    saturacion = punto_saturacion(resultados)
+    if saturacion is not None:
+        print(f"\n⚠️ Saturación: más de {saturacion} clientes no aumenta el throughput "
+              f"(menos de x{GANANCIA_MINIMA:.2f} por nivel)")
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga concurrente de la API de estadísticas")
+    parser.add_argument("--url", default="http://localhost:8000", help="URL base de la API")
+    parser.add_argument("--escenario", help="Archivo JSON con la mezcla de peticiones, niveles y duración")
+    parser.add_argument("--niveles", type=int, nargs="+", help="Niveles de concurrencia (reemplaza los del escenario)")
+    parser.add_argument("--duracion", type=float, help="Segundos por nivel (reemplaza la del escenario)")
+    parser.add_argument("--endpoint", action="append", dest="endpoints",
+                        help="Endpoint GET a consultar con igual peso (repetible; reemplaza la mezcla)")
+    parser.add_argument("--json", dest="salida_json", help="Ruta donde guardar los resultados en JSON")
+    args = parser.parse_args()
+
+    escenario = cargar_escenario(args.escenario) if args.escenario else ESCENARIO_DASHBOARD
+    if args.endpoints:
+        escenario = escenario._replace(peticiones=tuple(Peticion(ruta) for ruta in args.endpoints))
+    if args.niveles:
+        escenario = escenario._replace(niveles=tuple(args.niveles))
+    if args.duracion:
+        escenario = escenario._replace(duracion=args.duracion)
+
+    resultados = asyncio.run(ejecutar(args.url, escenario))
+
+    if args.salida_json:
+        with open(args.salida_json, "w", encoding="utf-8") as f:
+            json.dump({
+                "escenario": {**escenario._asdict(), "peticiones": [p._asdict() for p in escenario.peticiones]},
+                "url": args.url,
+                "saturacion": punto_saturacion(resultados),
+                "niveles": resultados,
+            }, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
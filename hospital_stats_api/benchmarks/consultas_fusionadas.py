@@ -0,0 +1,116 @@
+"""
+consultas_fusionadas.py - Compara el tiempo de base de datos del dashboard con
+queries individuales frente a la agregación fusionada (un solo recorrido)
+
+Uso (contra la base configurada en database.py, idealmente con millones de citas):
+    python -m benchmarks.consultas_fusionadas --repeticiones 5
+
+La caché y los rollups se desactivan para medir solo el recorrido de appointments.
+"""
+import argparse
+import json
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from cache import cache_estadisticas
+from database import db
+from queries import EstadisticasQueries
+from rollups import rollups
+
+AGREGADOS_CITAS = [
+    "citas_por_estado",
+    "distribucion_citas_por_hora",
+    "horarios_pico",
+    "especialidades_mas_demandadas",
+    "total_citas_por_sede",
+    "especialidades_por_sede",
+]
+
+OTRAS_QUERIES = {
+    "total_pacientes_registrados": lambda: EstadisticasQueries.total_pacientes_registrados(),
+    "total_pacientes_activos": lambda: EstadisticasQueries.total_pacientes_activos(meses=6),
+    "promedio_citas_por_paciente": lambda: EstadisticasQueries.promedio_citas_por_paciente(),
+    "distribucion_tipo_documento": lambda: EstadisticasQueries.distribucion_tipo_documento(),
+    "pacientes_bloqueados_vs_activos": lambda: EstadisticasQueries.pacientes_bloqueados_vs_activos(),
+    "total_medicos_por_especialidad": lambda: EstadisticasQueries.total_medicos_por_especialidad(),
+    "medicos_mas_solicitados": lambda: EstadisticasQueries.medicos_mas_solicitados(limit=10),
+    "tasa_cancelacion_por_medico": lambda: EstadisticasQueries.tasa_cancelacion_por_medico(),
+    "medicos_bloqueados_vs_activos": lambda: EstadisticasQueries.medicos_bloqueados_vs_activos(),
+}
+
+
+def _agregados_individuales():
+    """Las 7 queries de agregados de citas, una tras otra"""
+    for nombre in AGREGADOS_CITAS:
+        getattr(EstadisticasQueries, nombre)()
+    EstadisticasQueries.tendencia_citas_por_mes(meses=12)
+
+
+def _agregados_fusionados():
+    """Los mismos agregados en un solo recorrido de appointments"""
+    EstadisticasQueries.estadisticas_citas_fusionadas(meses=12)
+
+
+def _dashboard(agregados: Callable[[], None]) -> Callable[[], None]:
+    """Dashboard completo (16 estadísticas) con la estrategia de agregados indicada"""
+    def ejecutar():
+        for query in OTRAS_QUERIES.values():
+            query()
+        agregados()
+    return ejecutar
+
+
+def medir(func: Callable[[], None], repeticiones: int) -> Dict[str, float]:
+    """Ejecuta `func` varias veces y retorna mediana y mínimo en milisegundos"""
+    tiempos: List[float] = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        func()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return {
+        "mediana_ms": round(statistics.median(tiempos), 2),
+        "min_ms": round(min(tiempos), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queries individuales vs agregación fusionada")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--json", dest="salida_json", help="Ruta donde guardar los resultados en JSON")
+    args = parser.parse_args()
+
+    if not db.connect():
+        raise SystemExit(1)
+    cache_estadisticas.activa = False
+    rollups.activo = False
+
+    total_citas = int(db.fetch_scalar("SELECT COUNT(*) as total FROM appointments", default=0))
+    print(f"📊 appointments: {total_citas:,} filas, {args.repeticiones} repeticiones\n")
+
+    casos = {
+        "agregados_individuales (7 queries)": _agregados_individuales,
+        "agregados_fusionados (1 recorrido)": _agregados_fusionados,
+        "dashboard_individual (16 queries)": _dashboard(_agregados_individuales),
+        "dashboard_fusionado (9 + fusionada)": _dashboard(_agregados_fusionados),
+    }
+    resultados = {}
+    for nombre, func in casos.items():
+        resultados[nombre] = medir(func, args.repeticiones)
+        print(f"  {nombre:<38} mediana {resultados[nombre]['mediana_ms']:>10.1f} ms"
+              f"   min {resultados[nombre]['min_ms']:>10.1f} ms")
+
+    individual = resultados["agregados_individuales (7 queries)"]["mediana_ms"]
+    fusionado = resultados["agregados_fusionados (1 recorrido)"]["mediana_ms"]
+    if fusionado:
+        print(f"\n⚡ Aceleración de los agregados: x{individual / fusionado:.2f}")
+
+    if args.salida_json:
+        with open(args.salida_json, "w", encoding="utf-8") as f:
+            json.dump({"filas_appointments": total_citas, "resultados": resultados}, f, indent=2)
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+datos_sinteticos.py - Generador determinista de datos hospitalarios sintéticos
+(sedes, medicos, users, appointments, user_blocks) y cargador a una base local
+
+Uso:
+    python -m benchmarks.datos_sinteticos --url mysql+pymysql://root:@localhost/hospital_bench --escala 1m
+    python -m benchmarks.datos_sinteticos --url sqlite:////tmp/hospital_bench.db --escala 10k --reemplazar
+
+Los datos tienen el sesgo de una agenda real: pocos médicos y pacientes concentran
+buena parte de las citas (distribución de Zipf), las horas pico son a media mañana
+y a media tarde, casi no hay citas en fin de semana, el volumen crece con el tiempo
+y la tasa de cancelación varía por médico. Con la misma semilla, fecha de referencia
+(default: hoy) y tamaño de lote se generan exactamente las mismas filas.
+
+La carga crea las tablas si no existen. Si ya tienen filas, no se toca nada salvo
+con --reemplazar, que las borra (junto con los rollups): no usar contra la base real.
+"""
+import argparse
+import time
+from datetime import date, datetime, time as hora_dia, timedelta
+from typing import Dict, Iterator, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import (
+    BigInteger, Boolean, Column, Date, DateTime, Integer, MetaData, String, Table, Time,
+    create_engine, func, inspect, select
+)
+from sqlalchemy.engine import Engine
+
+from rollups import TABLA_CAMBIOS, TABLA_ESTADO, TABLA_ROLLUP
+
+
+class Escala(NamedTuple):
+    """Tamaño de cada tabla en un nivel de escala"""
+    pacientes: int
+    medicos: int
+    sedes: int
+    citas: int
+
+
+ESCALAS = {
+    "10k": Escala(pacientes=2_000, medicos=40, sedes=5, citas=10_000),
+    "100k": Escala(pacientes=20_000, medicos=150, sedes=10, citas=100_000),
+    "1m": Escala(pacientes=200_000, medicos=600, sedes=20, citas=1_000_000),
+    "10m": Escala(pacientes=2_000_000, medicos=2_500, sedes=40, citas=10_000_000),
+}
+
+# Especialidades y su peso en la plantilla de médicos
+ESPECIALIDADES = {
+    "Medicina General": 0.34, "Pediatría": 0.12, "Ginecología": 0.10, "Odontología": 0.10,
+    "Cardiología": 0.07, "Dermatología": 0.06, "Ortopedia": 0.06, "Psiquiatría": 0.05,
+    "Oftalmología": 0.05, "Neurología": 0.05,
+}
+TIPOS_DOCUMENTO = {"CC": 0.70, "TI": 0.15, "RC": 0.05, "CE": 0.06, "PA": 0.04}
+# Franjas de la agenda (08:00 a 17:00) y su peso: picos a media mañana y media tarde
+HORAS = {8: 0.08, 9: 0.14, 10: 0.15, 11: 0.12, 12: 0.06, 13: 0.04, 14: 0.11, 15: 0.12, 16: 0.10, 17: 0.08}
+# Peso de cada día de la semana (lunes = 0)
+DIAS_SEMANA = np.array([1.0, 1.0, 1.0, 1.0, 0.9, 0.35, 0.05])
+CIUDADES = ["Bogotá", "Medellín", "Cali", "Barranquilla", "Cartagena", "Bucaramanga", "Pereira",
+            "Manizales", "Cúcuta", "Ibagué", "Santa Marta", "Villavicencio", "Pasto", "Neiva"]
+NOMBRES = ["Ana", "Luis", "María", "Carlos", "Laura", "Jorge", "Sofía", "Andrés", "Valentina",
+           "Juan", "Camila", "Diego", "Daniela", "Felipe", "Paula", "Santiago", "Natalia", "Mateo"]
+APELLIDOS = ["García", "Rodríguez", "Martínez", "López", "González", "Pérez", "Sánchez", "Ramírez",
+             "Torres", "Flores", "Rivera", "Gómez", "Díaz", "Moreno", "Rojas", "Vargas", "Castro"]
+
+DIAS_HISTORIA = 730     # citas desde dos años atrás...
+DIAS_AGENDADOS = 30     # ...hasta un mes adelante (pendientes)
+CANCELACION_BASE = 0.17
+PENDIENTES_PASADAS = 0.03
+TAMANO_LOTE = 200_000
+ID_MEDICO_BASE = 10_000_000
+
+metadata = MetaData()
+
+sedes = Table(
+    "sedes", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String(100)),
+    Column("address", String(200)),
+)
+medicos = Table(
+    "medicos", metadata,
+    Column("identificacion", String(20), primary_key=True),
+    Column("nombre", String(100)),
+    Column("apellido", String(100)),
+    Column("especialidad", String(100)),
+    Column("sede_id", Integer),
+)
+users = Table(
+    "users", metadata,
+    Column("user_id", Integer, primary_key=True),
+    Column("nombre", String(100)),
+    Column("apellido", String(100)),
+    Column("tipo_documento", String(10)),
+)
+appointments = Table(
+    "appointments", metadata,
+    Column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True),
+    Column("user_id", Integer),
+    Column("professional_identificacion", String(20)),
+    Column("fecha", Date),
+    Column("hora", Time),
+    Column("estado", String(20)),
+)
+user_blocks = Table(
+    "user_blocks", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_type", String(20)),
+    Column("user_identifier", String(20)),
+    Column("is_active", Boolean),
+    Column("blocked_until", DateTime, nullable=True),
+)
+
+
+def _zipf(n: int, exponente: float, rng: np.random.Generator) -> np.ndarray:
+    """Pesos de Zipf para n elementos, asignados en orden aleatorio"""
+    pesos = 1.0 / np.arange(1, n + 1) ** exponente
+    rng.shuffle(pesos)
+    return pesos / pesos.sum()
+
+
+def _elegir(opciones: Dict, n: int, rng: np.random.Generator) -> np.ndarray:
+    """n valores de `opciones` según sus pesos"""
+    claves = list(opciones)
+    pesos = np.array([opciones[c] for c in claves], dtype=float)
+    return np.array(claves, dtype=object)[rng.choice(len(claves), n, p=pesos / pesos.sum())]
+
+
+def _nombres(n: int, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+    """Columnas nombre y apellido al azar"""
+    return {
+        "nombre": np.array(NOMBRES, dtype=object)[rng.integers(0, len(NOMBRES), n)],
+        "apellido": np.array(APELLIDOS, dtype=object)[rng.integers(0, len(APELLIDOS), n)],
+    }
+
+
+def identificacion_medico(indice: np.ndarray) -> np.ndarray:
+    """Identificación (VARCHAR) del médico en la posición `indice`"""
+    return (ID_MEDICO_BASE + indice).astype(str).astype(object)
+
+
+class GeneradorHospital:
+    """Genera las tablas de un nivel de escala; todo sale de la semilla y la fecha de referencia"""
+
+    def __init__(self, escala: Escala, semilla: int = 42, referencia: Optional[date] = None):
+        """
+        Inicializa el generador
+
+        Args:
+            escala: Número de filas de cada tabla
+            semilla: Semilla de todos los generadores aleatorios
+            referencia: "Hoy" de los datos: las citas anteriores ya ocurrieron
+                y las posteriores están pendientes (default: hoy)
+        """
+        self.escala = escala
+        self.semilla = semilla
+        self.referencia = referencia or date.today()
+        rng = self._rng(0)
+        # Popularidad de médicos y actividad de pacientes; sesgo de cancelación por médico
+        self.peso_medicos = _zipf(escala.medicos, 1.1, rng)
+        self.peso_pacientes = _zipf(escala.pacientes, 0.8, rng)
+        self.factor_cancelacion = rng.lognormal(0.0, 0.5, escala.medicos)
+        # Peso de cada día del rango: día de la semana y crecimiento de la demanda
+        inicio = self.referencia - timedelta(days=DIAS_HISTORIA)
+        self.dias = pd.date_range(inicio, periods=DIAS_HISTORIA + DIAS_AGENDADOS + 1, freq="D")
+        tendencia = 1.0 + 0.6 * np.linspace(0.0, 1.0, len(self.dias))
+        pesos = DIAS_SEMANA[self.dias.dayofweek] * tendencia
+        self.peso_dias = pesos / pesos.sum()
+
+    def _rng(self, flujo: int) -> np.random.Generator:
+        """Generador independiente por tabla/lote: el resultado no depende del orden de generación"""
+        return np.random.default_rng([self.semilla, flujo])
+
+    def generar_sedes(self) -> pd.DataFrame:
+        """Sedes con nombre de ciudad y dirección"""
+        n = self.escala.sedes
+        rng = self._rng(1)
+        ciudades = [CIUDADES[i % len(CIUDADES)] + (f" {i // len(CIUDADES) + 1}" if i >= len(CIUDADES) else "")
+                    for i in range(n)]
+        return pd.DataFrame({
+            "id": np.arange(1, n + 1),
+            "name": [f"Sede {c}" for c in ciudades],
+            "address": [f"Calle {rng.integers(1, 200)} # {rng.integers(1, 100)}-{rng.integers(1, 99)}"
+                        for _ in range(n)],
+        })
+
+    def generar_medicos(self) -> pd.DataFrame:
+        """Médicos con especialidad y sede según sus pesos"""
+        n = self.escala.medicos
+        rng = self._rng(2)
+        # Las sedes también son desiguales: la principal concentra más médicos
+        sede = rng.choice(self.escala.sedes, n, p=_zipf(self.escala.sedes, 0.7, rng)) + 1
+        return pd.DataFrame({
+            "identificacion": identificacion_medico(np.arange(n)),
+            **_nombres(n, rng),
+            "especialidad": _elegir(ESPECIALIDADES, n, rng),
+            "sede_id": sede,
+        })
+
+    def generar_pacientes(self) -> pd.DataFrame:
+        """Pacientes con tipo de documento según su peso"""
+        n = self.escala.pacientes
+        rng = self._rng(3)
+        return pd.DataFrame({
+            "user_id": np.arange(1, n + 1),
+            **_nombres(n, rng),
+            "tipo_documento": _elegir(TIPOS_DOCUMENTO, n, rng),
+        })
+
+    def generar_bloqueos(self) -> pd.DataFrame:
+        """~2 % de pacientes y ~3 % de médicos bloqueados; parte inactivos o vencidos"""
+        rng = self._rng(4)
+        pacientes = rng.choice(self.escala.pacientes, max(1, self.escala.pacientes // 50), replace=False) + 1
+        medicos_ = rng.choice(self.escala.medicos, max(1, self.escala.medicos * 3 // 100), replace=False)
+        tipos = np.array(["paciente"] * len(pacientes) + ["medico"] * len(medicos_), dtype=object)
+        identificadores = np.concatenate([pacientes.astype(str).astype(object), identificacion_medico(medicos_)])
+        n = len(tipos)
+        # 40 % indefinidos, 40 % hasta una fecha futura, 20 % ya vencidos
+        ahora = datetime.combine(self.referencia, hora_dia(12))
+        dias = rng.integers(1, 180, n)
+        caso = rng.choice(3, n, p=[0.4, 0.4, 0.2])
+        hasta = [None if c == 0 else ahora + timedelta(days=int(d)) if c == 1 else ahora - timedelta(days=int(d))
+                 for c, d in zip(caso, dias)]
+        return pd.DataFrame({
+            "id": np.arange(1, n + 1),
+            "user_type": tipos,
+            "user_identifier": identificadores,
+            "is_active": rng.random(n) < 0.8,
+            "blocked_until": pd.Series(hasta, dtype=object),
+        })
+
+    def generar_citas(self, tamano_lote: int = TAMANO_LOTE) -> Iterator[pd.DataFrame]:
+        """
+        Genera las citas por lotes para no tener la tabla completa en memoria
+
+        Args:
+            tamano_lote: Citas por lote
+
+        Yields:
+            DataFrames de hasta `tamano_lote` citas con las columnas de appointments
+        """
+        horas = np.array([hora_dia(h) for h in HORAS], dtype=object)
+        peso_horas = np.array(list(HORAS.values()))
+        referencia = np.datetime64(self.referencia)
+        for numero, inicio in enumerate(range(0, self.escala.citas, tamano_lote)):
+            n = min(tamano_lote, self.escala.citas - inicio)
+            # Cada lote tiene su propio generador: misma semilla y tamaño de lote, mismas citas
+            rng = self._rng(1000 + numero)
+            medico = rng.choice(self.escala.medicos, n, p=self.peso_medicos)
+            dias = self.dias.values[rng.choice(len(self.dias), n, p=self.peso_dias)]
+            pasada = dias < referencia
+            # Pasadas: atendidas, canceladas (según el médico) o pendientes sin cerrar; futuras: pendientes
+            p_cancelacion = np.minimum(CANCELACION_BASE * self.factor_cancelacion[medico], 0.6)
+            sorteo = rng.random(n)
+            estado = np.where(
+                pasada,
+                np.where(sorteo < p_cancelacion, "cancelada",
+                         np.where(sorteo < p_cancelacion + PENDIENTES_PASADAS, "pendiente", "atendida")),
+                np.where(sorteo < 0.12, "cancelada", "pendiente"),
+            ).astype(object)
+            yield pd.DataFrame({
+                "id": np.arange(inicio + 1, inicio + n + 1),
+                "user_id": rng.choice(self.escala.pacientes, n, p=self.peso_pacientes) + 1,
+                "professional_identificacion": identificacion_medico(medico),
+                "fecha": pd.DatetimeIndex(dias).date,
+                "hora": horas[rng.choice(len(horas), n, p=peso_horas)],
+                "estado": estado,
+            })
+
+    def tablas(self, tamano_lote: int = TAMANO_LOTE) -> Iterator[tuple]:
+        """(tabla, lote) en orden de carga"""
+        yield sedes, self.generar_sedes()
+        yield medicos, self.generar_medicos()
+        yield users, self.generar_pacientes()
+        yield user_blocks, self.generar_bloqueos()
+        for lote in self.generar_citas(tamano_lote):
+            yield appointments, lote
+
+
+def filas_existentes(engine: Engine) -> Dict[str, int]:
+    """Filas de cada tabla del esquema que ya existe en la base"""
+    existentes = set(inspect(engine).get_table_names())
+    with engine.connect() as conn:
+        return {
+            tabla.name: conn.execute(select(func.count()).select_from(tabla)).scalar()
+            for tabla in metadata.sorted_tables if tabla.name in existentes
+        }
+
+
+def cargar(url: str, escala: Escala, semilla: int = 42, referencia: Optional[date] = None,
+           reemplazar: bool = False, tamano_lote: int = TAMANO_LOTE) -> Dict[str, object]:
+    """
+    Genera y carga un nivel de escala en la base de `url`
+
+    Args:
+        url: URL de SQLAlchemy de una base local de pruebas
+        escala: Número de filas de cada tabla
+        semilla: Semilla del generador
+        referencia: Fecha de referencia de los datos (default: hoy)
+        reemplazar: Borrar las tablas (y los rollups) si ya tienen datos
+        tamano_lote: Citas generadas e insertadas por lote
+
+    Returns:
+        Filas por tabla, segundos de carga, semilla y fecha de referencia
+    """
+    engine = create_engine(url)
+    try:
+        actuales = filas_existentes(engine)
+        if any(actuales.values()):
+            if not reemplazar:
+                raise RuntimeError(
+                    f"La base ya tiene datos ({actuales}); usar reemplazar=True (--reemplazar) para borrarlos"
+                )
+            # Los rollups de otra carga darían resultados incorrectos
+            with engine.begin() as conn:
+                for tabla in (TABLA_ROLLUP, TABLA_CAMBIOS, TABLA_ESTADO):
+                    conn.exec_driver_sql(f"DROP TABLE IF EXISTS {tabla}")
+            metadata.drop_all(engine)
+        metadata.create_all(engine)
+
+        generador = GeneradorHospital(escala, semilla, referencia)
+        inicio = time.perf_counter()
+        filas: Dict[str, int] = {}
+        for tabla, df in generador.tablas(tamano_lote):
+            with engine.begin() as conn:
+                conn.execute(tabla.insert(), df.to_dict("records"))
+            filas[tabla.name] = filas.get(tabla.name, 0) + len(df)
+        return {
+            "filas": filas,
+            "carga_s": round(time.perf_counter() - inicio, 2),
+            "semilla": semilla,
+            "referencia": generador.referencia.isoformat(),
+        }
+    finally:
+        engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera y carga datos hospitalarios sintéticos")
+    parser.add_argument("--url", required=True, help="URL de SQLAlchemy de la base local de pruebas")
+    parser.add_argument("--escala", choices=list(ESCALAS), default="10k")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--referencia", type=date.fromisoformat, help="Fecha de referencia AAAA-MM-DD (default: hoy)")
+    parser.add_argument("--reemplazar", action="store_true", help="Borrar los datos que ya tenga la base")
+    parser.add_argument("--tamano-lote", type=int, default=TAMANO_LOTE)
+    args = parser.parse_args()
+
+    print(f"🏗️  Cargando escala {args.escala} ({ESCALAS[args.escala].citas:,} citas)...")
+    try:
+        resultado = cargar(args.url, ESCALAS[args.escala], args.semilla, args.referencia,
+                           args.reemplazar, args.tamano_lote)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    for tabla, n in resultado["filas"].items():
+        print(f"  {tabla:<14} {n:>12,} filas")
+    print(f"✅ Carga completa en {resultado['carga_s']} s (semilla {resultado['semilla']}, "
+          f"referencia {resultado['referencia']})")
+
+
+if __name__ == "__main__":
+    main()
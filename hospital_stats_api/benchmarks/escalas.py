@@ -0,0 +1,285 @@
+"""
+escalas.py - Mide cada método de EstadisticasQueries, cada endpoint de estadísticas
+y la generación completa del reporte sobre datos sintéticos de distintos tamaños
+
+Uso (la base de --url se BORRA y se recarga en cada escala: usar una base de pruebas):
+    python -m benchmarks.escalas --url mysql+pymysql://root:@localhost/hospital_bench \\
+        --escalas 10k 100k 1m --json escalas.json
+
+    # comparar contra una corrida anterior (sale con código 1 si algo empeora)
+    python -m benchmarks.escalas --url ... --json nuevo.json --comparar escalas.json
+
+Para cada escala se generan y cargan los datos (benchmarks/datos_sinteticos.py), se
+crean los índices (y con --rollups, los rollups) y se mide con la caché de consultas
+y la de gráficos desactivadas. Los endpoints se llaman en el mismo proceso con el
+TestClient de FastAPI, sin red. El JSON incluye el commit, la semilla y la fecha de
+referencia de los datos para poder comparar corridas entre commits.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from benchmarks.datos_sinteticos import ESCALAS, cargar
+from benchmarks.planes_consulta import metodos_consulta
+from cache import cache_estadisticas
+from cache_graficos import cache_graficos
+from database import db
+from indices import indices
+from metricas import metricas
+from rollups import rollups
+
+ENDPOINTS = [
+    "/api/estadisticas",
+    "/api/estadisticas/pacientes",
+    "/api/estadisticas/medicos",
+    "/api/estadisticas/sedes",
+    "/api/estadisticas/citas",
+    "/api/estadisticas/citas?sede_id=1",
+    "/api/estadisticas/pacientes/activos?limit=100",
+    "/api/estadisticas/pacientes/activos?format=ndjson",
+    "/api/estadisticas/medicos/tasa_cancelacion?limit=100",
+]
+
+
+def cronometrar(func: Callable[[], Any], repeticiones: int) -> Tuple[Dict[str, float], Any]:
+    """Mediana y mínimo en ms de `repeticiones` llamadas, y el resultado de la última"""
+    tiempos: List[float] = []
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = func()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return {"mediana_ms": round(statistics.median(tiempos), 2), "min_ms": round(min(tiempos), 2)}, resultado
+
+
+def _filas(resultado: Any) -> Optional[int]:
+    """Tamaño de un resultado de EstadisticasQueries (filas, elementos o 1 si es escalar)"""
+    if isinstance(resultado, pd.DataFrame):
+        return len(resultado)
+    if isinstance(resultado, dict) and "filas" in resultado:
+        return len(resultado["filas"])
+    if isinstance(resultado, (list, dict)):
+        return len(resultado)
+    return None if resultado is None else 1
+
+
+def medir_consultas(repeticiones: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Llama cada método público de EstadisticasQueries con sus valores por defecto
+
+    Returns:
+        método -> tiempos, filas y lecturas fallidas (según las métricas de la base)
+    """
+    resultados = {}
+    for nombre, metodo in metodos_consulta().items():
+        # Los iterar_* retornan un generador: se consume para medir la lectura completa
+        consumir = nombre.startswith("iterar_")
+
+        def llamar(metodo=metodo, consumir=consumir):
+            resultado = metodo()
+            return list(resultado) if consumir else resultado
+
+        errores_antes = metricas.consulta_errores.valor((nombre,))
+        try:
+            tiempos, resultado = cronometrar(llamar, repeticiones)
+        except Exception as e:
+            resultados[nombre] = {"error": str(e)}
+            continue
+        resultados[nombre] = {
+            **tiempos,
+            "filas": _filas(resultado),
+            "lecturas_fallidas": int(metricas.consulta_errores.valor((nombre,)) - errores_antes),
+        }
+    return resultados
+
+
+def medir_endpoints(cliente, repeticiones: int) -> Dict[str, Dict[str, Any]]:
+    """Tiempo, código de estado y tamaño del cuerpo de cada endpoint de ENDPOINTS"""
+    resultados = {}
+    for ruta in ENDPOINTS:
+        try:
+            tiempos, respuesta = cronometrar(lambda: cliente.get(ruta), repeticiones)
+        except Exception as e:
+            # Un error a mitad de una respuesta en streaming no tiene código de estado
+            resultados[ruta] = {"error": str(e)}
+            continue
+        resultados[ruta] = {**tiempos, "status": respuesta.status_code, "bytes": len(respuesta.content)}
+    return resultados
+
+
+def medir_reporte(cliente, perfil: str, limite_s: float = 1800) -> Dict[str, Any]:
+    """
+    Encola un reporte completo, espera a que termine y retorna su duración
+    y el tiempo de cada etapa según las métricas
+    """
+    etapas_antes = metricas.etapa_segundos.resumen()
+    inicio = time.perf_counter()
+    respuesta = cliente.post("/api/reporte/generar", params={"perfil": perfil})
+    if respuesta.status_code != 202:
+        return {"error": respuesta.text, "status": respuesta.status_code}
+    url_estado = respuesta.json()["status_url"]
+    while True:
+        estado = cliente.get(url_estado).json()
+        if estado["estado"] in ("completado", "error") or time.perf_counter() - inicio > limite_s:
+            break
+        time.sleep(0.05)
+    total = time.perf_counter() - inicio
+
+    etapas = {}
+    for (componente, etapa), (n, suma) in metricas.etapa_segundos.resumen().items():
+        n_antes, suma_antes = etapas_antes.get((componente, etapa), (0, 0.0))
+        if n > n_antes:
+            etapas[f"{componente}/{etapa}"] = round((suma - suma_antes) * 1000, 2)
+    resultado = estado.get("resultado") or {}
+    return {
+        "estado": estado["estado"],
+        "total_ms": round(total * 1000, 2),
+        "trabajo_ms": round((estado.get("duracion_s") or 0) * 1000, 2),
+        "perfil": resultado.get("perfil"),
+        "tamano_bytes": resultado.get("tamano_bytes"),
+        "etapas_ms": etapas,
+        "error": estado.get("error"),
+    }
+
+
+def _tiempo(medicion: Dict[str, Any]) -> Optional[float]:
+    """Tiempo representativo de una medición (mediana o total)"""
+    return medicion.get("mediana_ms", medicion.get("total_ms"))
+
+
+def comparar(actual: dict, anterior: dict, umbral: float) -> List[str]:
+    """
+    Compara dos corridas y lista las mediciones que empeoraron más que `umbral`
+    (p. ej. 1.2 = 20 % más lentas)
+    """
+    regresiones = []
+    for escala, secciones in actual["escalas"].items():
+        previas = anterior.get("escalas", {}).get(escala)
+        if not previas:
+            continue
+        for seccion in ("consultas", "endpoints"):
+            for nombre, medicion in secciones.get(seccion, {}).items():
+                previa = previas.get(seccion, {}).get(nombre)
+                if not previa or not _tiempo(previa) or _tiempo(medicion) is None:
+                    continue
+                razon = _tiempo(medicion) / _tiempo(previa)
+                if razon > umbral:
+                    regresiones.append(f"{escala} {seccion} {nombre}: "
+                                       f"{_tiempo(previa):.1f} -> {_tiempo(medicion):.1f} ms (x{razon:.2f})")
+        reporte, reporte_previo = secciones.get("reporte"), previas.get("reporte")
+        if reporte and reporte_previo and _tiempo(reporte_previo) and _tiempo(reporte):
+            razon = _tiempo(reporte) / _tiempo(reporte_previo)
+            if razon > umbral:
+                regresiones.append(f"{escala} reporte: {_tiempo(reporte_previo):.1f} -> "
+                                   f"{_tiempo(reporte):.1f} ms (x{razon:.2f})")
+    return regresiones
+
+
+def _commit() -> Optional[str]:
+    """Commit actual del repositorio, si se puede leer"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consultas, endpoints y reporte en varias escalas de datos")
+    parser.add_argument("--url", required=True, help="URL de SQLAlchemy de la base de pruebas (se borra)")
+    parser.add_argument("--escalas", nargs="+", choices=list(ESCALAS), default=["10k", "100k"])
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--referencia", type=date.fromisoformat, help="Fecha de referencia AAAA-MM-DD (default: hoy)")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--rollups", action="store_true", help="Instalar y refrescar los rollups de citas")
+    parser.add_argument("--sin-indices", action="store_true", help="No crear los índices de indices.py")
+    parser.add_argument("--sin-reporte", action="store_true", help="No medir la generación del reporte")
+    parser.add_argument("--perfil", default="estandar", help="Perfil de imágenes del reporte")
+    parser.add_argument("--json", dest="salida_json", help="Ruta donde guardar los resultados en JSON")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--umbral", type=float, default=1.2, help="Razón de tiempo que cuenta como regresión")
+    args = parser.parse_args()
+
+    # La API usa la base de pruebas y mide el trabajo real, sin cachés
+    db.connection_string = args.url
+    cache_estadisticas.activa = False
+    cache_graficos.activa = False
+    metricas.activa = True
+    rollups.activo = args.rollups
+
+    from fastapi.testclient import TestClient
+    import main as api
+
+    informe = {
+        "meta": {
+            "commit": _commit(),
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "dialecto": args.url.split(":", 1)[0],
+            "semilla": args.semilla,
+            "repeticiones": args.repeticiones,
+            "rollups": args.rollups,
+            "indices": not args.sin_indices,
+            "perfil": args.perfil,
+        },
+        "escalas": {},
+    }
+    with TestClient(api.app, raise_server_exceptions=False) as cliente:
+        for nombre in args.escalas:
+            print(f"\n📦 Escala {nombre} ({ESCALAS[nombre].citas:,} citas)")
+            carga = cargar(args.url, ESCALAS[nombre], args.semilla, args.referencia, reemplazar=True)
+            informe["meta"]["referencia"] = carga["referencia"]
+            print(f"  carga: {carga['carga_s']} s")
+
+            preparacion = {}
+            if not args.sin_indices:
+                inicio = time.perf_counter()
+                indices.instalar()
+                preparacion["indices_s"] = round(time.perf_counter() - inicio, 2)
+            if rollups.activo and rollups.instalar():
+                inicio = time.perf_counter()
+                rollups.refrescar()
+                preparacion["rollups_s"] = round(time.perf_counter() - inicio, 2)
+
+            consultas = medir_consultas(args.repeticiones)
+            for metodo, r in consultas.items():
+                aviso = f"  ⚠️ {r.get('error') or str(r['lecturas_fallidas']) + ' lecturas fallidas'}" \
+                    if r.get("error") or r.get("lecturas_fallidas") else ""
+                print(f"  {metodo:<42} {r.get('mediana_ms', float('nan')):>10.1f} ms{aviso}")
+            endpoints = medir_endpoints(cliente, args.repeticiones)
+            for ruta, r in endpoints.items():
+                if "error" in r:
+                    print(f"  {ruta:<52} ⚠️ {r['error']}")
+                else:
+                    print(f"  {ruta:<52} {r['mediana_ms']:>10.1f} ms  {r['status']}  {r['bytes'] / 1024:,.0f} KB")
+            escala = {"filas": carga["filas"], "carga_s": carga["carga_s"], **preparacion,
+                      "consultas": consultas, "endpoints": endpoints}
+            if not args.sin_reporte:
+                escala["reporte"] = medir_reporte(cliente, args.perfil)
+                r = escala["reporte"]
+                print(f"  reporte ({r.get('perfil')}): {r.get('estado')} en {r.get('total_ms', 0) / 1000:.1f} s")
+            informe["escalas"][nombre] = escala
+
+    if args.salida_json:
+        with open(args.salida_json, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False, default=str)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regresiones = comparar(informe, json.load(f), args.umbral)
+        print(f"\n{len(regresiones)} regresiones (umbral x{args.umbral})")
+        for linea in regresiones:
+            print(f"  🐢 {linea}")
+        if regresiones:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
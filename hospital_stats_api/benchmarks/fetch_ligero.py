@@ -0,0 +1,93 @@
+"""
+fetch_ligero.py - Microbenchmark del costo fijo por query: execute_query
+(pd.read_sql_query + DataFrame) frente a fetch_scalar / fetch_rows / fetch_columns
+
+Uso (contra la base configurada en database.py):
+    python -m benchmarks.fetch_ligero --iteraciones 2000
+
+    # o contra cualquier URL de SQLAlchemy con una tabla users
+    python -m benchmarks.fetch_ligero --url sqlite:////tmp/hospital.db
+
+Las queries son diminutas a propósito: lo que se mide es la sobrecarga de cada
+camino, no el trabajo del motor. La caché de consultas no interviene.
+"""
+import argparse
+import json
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from database import db
+
+CONSULTAS = {
+    "select_1": "SELECT 1 as test",
+    "total_pacientes": "SELECT COUNT(*) as total FROM users",
+    "distribucion_documento": (
+        "SELECT tipo_documento, COUNT(*) as cantidad FROM users GROUP BY tipo_documento"
+    ),
+}
+
+
+def medir(func: Callable[[], object], iteraciones: int, rondas: int = 5) -> Dict[str, float]:
+    """Microsegundos por llamada: mediana y mínimo de `rondas` rondas de `iteraciones`"""
+    func()  # calentamiento: conexión del pool y sentencia cacheada
+    por_llamada: List[float] = []
+    for _ in range(rondas):
+        inicio = time.perf_counter()
+        for _ in range(iteraciones):
+            func()
+        por_llamada.append((time.perf_counter() - inicio) / iteraciones * 1e6)
+    return {"mediana_us": round(statistics.median(por_llamada), 1), "min_us": round(min(por_llamada), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Costo por query: DataFrame vs fetch ligero")
+    parser.add_argument("--iteraciones", type=int, default=1000)
+    parser.add_argument("--url", help="URL de SQLAlchemy alternativa a la de database.py")
+    parser.add_argument("--json", dest="salida_json", help="Ruta donde guardar los resultados en JSON")
+    args = parser.parse_args()
+
+    if args.url:
+        db.connection_string = args.url
+    if not db.connect():
+        raise SystemExit(1)
+
+    casos = {
+        "select_1": {
+            "execute_query": lambda: db.execute_query(CONSULTAS["select_1"]),
+            "fetch_scalar": lambda: db.fetch_scalar(CONSULTAS["select_1"]),
+        },
+        "total_pacientes": {
+            "execute_query": lambda: int(db.execute_query(CONSULTAS["total_pacientes"])['total'].iloc[0]),
+            "fetch_scalar": lambda: int(db.fetch_scalar(CONSULTAS["total_pacientes"], default=0)),
+        },
+        "distribucion_documento": {
+            "execute_query": lambda: db.execute_query(CONSULTAS["distribucion_documento"]),
+            "fetch_rows": lambda: db.fetch_rows(CONSULTAS["distribucion_documento"]),
+            "fetch_columns": lambda: db.fetch_columns(CONSULTAS["distribucion_documento"]),
+        },
+    }
+
+    print(f"⏱️  {args.iteraciones} iteraciones por ronda\n")
+    resultados = {}
+    for consulta, caminos in casos.items():
+        resultados[consulta] = {}
+        print(consulta)
+        for camino, func in caminos.items():
+            r = medir(func, args.iteraciones)
+            resultados[consulta][camino] = r
+            print(f"  {camino:<16} mediana {r['mediana_us']:>9.1f} µs   min {r['min_us']:>9.1f} µs")
+        base = resultados[consulta]["execute_query"]["mediana_us"]
+        mejor = min(r["mediana_us"] for c, r in resultados[consulta].items() if c != "execute_query")
+        if mejor:
+            print(f"  ⚡ x{base / mejor:.1f} menos costo por query\n")
+
+    if args.salida_json:
+        with open(args.salida_json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
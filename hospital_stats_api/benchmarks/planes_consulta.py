@@ -0,0 +1,232 @@
+"""
+planes_consulta.py - Ejecuta EXPLAIN sobre el SQL de cada método de
+EstadisticasQueries y falla si alguna tabla grande se recorre completa (type = ALL)
+
+Uso (contra la base configurada en database.py, con los índices de indices.py):
+    python -m benchmarks.planes_consulta
+    python -m benchmarks.planes_consulta --rollups --json planes.json
+
+Cada método se ejecuta sin tocar la base para capturar su SQL (con sus parámetros
+por defecto y, si acepta `filtros`, también con un alcance de ejemplo); después se
+pide el plan de cada sentencia distinta. Sale con código 1 si hay recorridos
+completos no permitidos, para usarlo en CI. Los recorridos completos de un índice
+(type = index) se informan como aviso.
+"""
+import argparse
+import inspect
+import json
+import re
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import text
+
+from cache import cache_estadisticas
+from database import db
+from queries import EstadisticasQueries, Filtros
+from rollups import rollups
+
+# Catálogos pequeños: recorrerlos completos es lo más barato
+TABLAS_PEQUENAS = {"sedes", "medicos"}
+
+# Recorridos completos esperados cuando la query no tiene filtros
+ESCANEOS_SIN_FILTROS = {
+    "appointments_rollup": "sin filtros el rollup se lee completo: ya es un agregado",
+    ("estadisticas_citas_fusionadas", "appointments"): "la agregación fusionada recorre appointments una vez por diseño",
+}
+
+# Argumentos extra por método (además de la llamada con los valores por defecto)
+VARIANTES = {
+    "pagina_pacientes_activos": [{"cursor": (5, 1)}],
+    "pagina_tasa_cancelacion": [{"cursor": (10, "0")}],
+    "iterar_pacientes_activos": [{"cursor": (5, 1)}],
+    "iterar_tasa_cancelacion": [{"cursor": (10, "0")}],
+}
+
+_PALABRAS_CLAVE = {"where", "left", "right", "inner", "join", "on", "group", "order", "having", "limit"}
+_TABLA_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_]\w*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?", re.IGNORECASE)
+
+
+def filtros_ejemplo() -> Filtros:
+    """Alcance de ejemplo: último trimestre de una sede y una especialidad"""
+    hoy = date.today()
+    return Filtros(desde=hoy - timedelta(days=90), hasta=hoy, sede_id=1, especialidad="Medicina General")
+
+
+@contextmanager
+def capturar_sql() -> Iterator[List[Tuple[str, dict]]]:
+    """
+    Sustituye temporalmente las lecturas de `db` por funciones que solo anotan
+    el SQL y sus parámetros y retornan resultados vacíos
+    """
+    capturadas: List[Tuple[str, dict]] = []
+
+    def anotar(query: str, params: Optional[dict] = None):
+        capturadas.append((query, dict(params or {})))
+
+    originales = {nombre: getattr(db, nombre) for nombre in
+                  ("execute_query", "fetch_scalar", "fetch_rows", "fetch_columns", "stream_rows")}
+    db.execute_query = lambda query, params=None: anotar(query, params) or pd.DataFrame()
+    db.fetch_scalar = lambda query, params=None, default=None: anotar(query, params) or default
+    db.fetch_rows = lambda query, params=None: anotar(query, params) or []
+    db.fetch_columns = lambda query, params=None: anotar(query, params) or {}
+    db.stream_rows = lambda query, params=None, tamano_lote=1000: anotar(query, params) or iter(())
+    try:
+        yield capturadas
+    finally:
+        for nombre, funcion in originales.items():
+            setattr(db, nombre, funcion)
+
+
+def metodos_consulta() -> Dict[str, Any]:
+    """Métodos públicos de EstadisticasQueries"""
+    return {
+        nombre: getattr(EstadisticasQueries, nombre)
+        for nombre, valor in vars(EstadisticasQueries).items()
+        if isinstance(valor, staticmethod) and not nombre.startswith("_")
+    }
+
+
+def sentencias(con_rollups: bool = False) -> List[Dict[str, Any]]:
+    """
+    Captura el SQL de cada método en cada variante de argumentos
+
+    Returns:
+        Lista de {metodo, variante, filtrada, sql, params} sin sentencias repetidas
+    """
+    casos = []
+    vistos = set()
+    caminos = [False, True] if con_rollups else [False]
+    frescos_original = rollups.frescos
+    for nombre, metodo in metodos_consulta().items():
+        # Sin la caché: el método siempre llega a ejecutar su SQL
+        funcion = getattr(metodo, "__wrapped__", metodo)
+        variantes = [{}] + VARIANTES.get(nombre, [])
+        if "filtros" in inspect.signature(funcion).parameters:
+            variantes += [{**v, "filtros": filtros_ejemplo()} for v in variantes]
+        for rollup in caminos:
+            rollups.frescos = (lambda: True) if rollup else (lambda: False)
+            for kwargs in variantes:
+                with capturar_sql() as capturadas:
+                    try:
+                        funcion(**kwargs)
+                    except Exception:
+                        # Con resultados vacíos el post-proceso puede fallar; el SQL ya está capturado
+                        pass
+                for sql, params in capturadas:
+                    clave = (sql, tuple(sorted(params)))
+                    if clave in vistos:
+                        continue
+                    vistos.add(clave)
+                    casos.append({
+                        "metodo": nombre,
+                        "variante": ", ".join(f"{k}={v}" for k, v in kwargs.items()) or "por defecto",
+                        "filtrada": "filtros" in kwargs,
+                        "sql": sql,
+                        "params": params,
+                    })
+    rollups.frescos = frescos_original
+    return casos
+
+
+def alias_de_tablas(sql: str) -> Dict[str, str]:
+    """Alias (o nombre) -> tabla real, a partir de las cláusulas FROM/JOIN"""
+    alias = {}
+    for tabla, nombre in _TABLA_ALIAS.findall(sql):
+        if nombre and nombre.lower() not in _PALABRAS_CLAVE:
+            alias[nombre] = tabla
+        alias[tabla] = tabla
+    return alias
+
+
+def explain(sql: str, params: dict) -> List[dict]:
+    """Filas de EXPLAIN (formato tradicional de MySQL)"""
+    with db.engine.connect() as conn:
+        return [dict(fila) for fila in conn.execute(text("EXPLAIN " + sql), params).mappings()]
+
+
+def clasificar(caso: Dict[str, Any], plan: List[dict], permitidas: set) -> List[Dict[str, Any]]:
+    """
+    Evalúa cada tabla del plan
+
+    Returns:
+        Una entrada por fila del plan con su veredicto: "ok", "aviso" o "falla"
+    """
+    alias = alias_de_tablas(caso["sql"])
+    resultado = []
+    for fila in plan:
+        fila = {k.lower(): v for k, v in fila.items()}
+        nombre = fila.get("table") or ""
+        if nombre.startswith("<"):  # tablas derivadas y subconsultas materializadas
+            continue
+        tabla = alias.get(nombre, nombre)
+        tipo = (fila.get("type") or "").upper()
+        veredicto, motivo = "ok", None
+        if tipo == "ALL":
+            if tabla in permitidas:
+                motivo = "tabla pequeña"
+            elif not caso["filtrada"] and (tabla in ESCANEOS_SIN_FILTROS
+                                           or (caso["metodo"], tabla) in ESCANEOS_SIN_FILTROS):
+                motivo = ESCANEOS_SIN_FILTROS.get(tabla) or ESCANEOS_SIN_FILTROS[(caso["metodo"], tabla)]
+            else:
+                veredicto, motivo = "falla", "recorrido completo de la tabla"
+        elif tipo == "INDEX" and tabla not in permitidas:
+            veredicto, motivo = "aviso", "recorrido completo del índice"
+        resultado.append({
+            "tabla": tabla,
+            "type": tipo,
+            "key": fila.get("key"),
+            "rows": fila.get("rows"),
+            "veredicto": veredicto,
+            "motivo": motivo,
+        })
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN de todas las consultas de estadísticas")
+    parser.add_argument("--rollups", action="store_true",
+                        help="Revisar también las variantes que leen de appointments_rollup")
+    parser.add_argument("--permitir", nargs="*", default=[],
+                        help="Tablas adicionales que pueden recorrerse completas")
+    parser.add_argument("--json", dest="salida_json", help="Ruta donde guardar los planes en JSON")
+    args = parser.parse_args()
+
+    if not db.connect():
+        raise SystemExit(1)
+    cache_estadisticas.activa = False
+    permitidas = TABLAS_PEQUENAS | set(args.permitir)
+
+    simbolos = {"ok": "✅", "aviso": "⚠️ ", "falla": "❌"}
+    informe = []
+    fallas = avisos = 0
+    for caso in sentencias(args.rollups):
+        try:
+            tablas = clasificar(caso, explain(caso["sql"], caso["params"]), permitidas)
+        except Exception as e:
+            tablas = [{"tabla": None, "type": None, "key": None, "rows": None,
+                       "veredicto": "falla", "motivo": f"EXPLAIN falló: {e}"}]
+        fallas += sum(t["veredicto"] == "falla" for t in tablas)
+        avisos += sum(t["veredicto"] == "aviso" for t in tablas)
+        peor = "falla" if any(t["veredicto"] == "falla" for t in tablas) else \
+            "aviso" if any(t["veredicto"] == "aviso" for t in tablas) else "ok"
+        print(f"{simbolos[peor]} {caso['metodo']} ({caso['variante']})")
+        for t in tablas:
+            if t["veredicto"] != "ok" or t["motivo"]:
+                print(f"     {t['tabla']}: type={t['type']} key={t['key']} rows={t['rows']} - {t['motivo']}")
+        informe.append({**caso, "params": {k: str(v) for k, v in caso["params"].items()}, "plan": tablas})
+
+    print(f"\n{len(informe)} sentencias, {fallas} recorridos completos, {avisos} avisos")
+    if args.salida_json:
+        with open(args.salida_json, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False, default=str)
+
+    db.close()
+    if fallas:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+render_paralelo.py - Mide el tiempo de renderizado de los 7 gráficos del reporte
+en secuencia y con pools de 1..N procesos
+
+Uso:
+    python -m benchmarks.render_paralelo --procesos 1 2 4 8 --repeticiones 3
+
+No necesita base de datos: usa DataFrames sintéticos con la forma de los que
+devuelve EstadisticasQueries.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from visualizacion import VisualizadorEstadisticas, TareaGrafico
+
+ESPECIALIDADES = ["Medicina General", "Pediatría", "Cardiología", "Dermatología",
+                  "Ginecología", "Ortopedia", "Neurología", "Oftalmología"]
+SEDES = ["Sede Norte", "Sede Sur", "Sede Centro", "Sede Oriente", "Sede Occidente"]
+
+
+def tareas_sinteticas(semilla: int = 42) -> Dict[str, TareaGrafico]:
+    """Construye las 7 tareas de gráfico del reporte con datos aleatorios reproducibles"""
+    rng = np.random.default_rng(semilla)
+
+    especialidades = pd.DataFrame({
+        "especialidad": ESPECIALIDADES,
+        "total_citas": rng.integers(50, 2000, len(ESPECIALIDADES)),
+    })
+    meses = pd.period_range(end=pd.Timestamp.today(), periods=12, freq="M").astype(str)
+    atendidas, canceladas, pendientes = (rng.integers(100, 900, 12) for _ in range(3))
+    tendencia = pd.DataFrame({
+        "mes": meses, "atendidas": atendidas, "canceladas": canceladas, "pendientes": pendientes,
+        "total_citas": atendidas + canceladas + pendientes,
+    })
+    medicos = pd.DataFrame({
+        "nombre": [f"Nombre{i}" for i in range(10)],
+        "apellido": [f"Apellido{i}" for i in range(10)],
+        "especialidad": rng.choice(ESPECIALIDADES, 10),
+        "total_citas": np.sort(rng.integers(20, 500, 10))[::-1],
+    })
+    horarios = pd.DataFrame({
+        "hora": [f"{h:02d}:{m:02d}" for h in range(7, 18) for m in (0, 30)],
+        "total_citas": rng.integers(10, 400, 22),
+    })
+    tipo_doc = pd.DataFrame({
+        "tipo_documento": ["CC", "TI", "CE", "PA"],
+        "cantidad": rng.integers(10, 5000, 4),
+    })
+    sedes = pd.DataFrame({
+        "sede_nombre": SEDES,
+        "citas_atendidas": rng.integers(100, 3000, len(SEDES)),
+        "citas_canceladas": rng.integers(10, 500, len(SEDES)),
+        "citas_pendientes": rng.integers(10, 800, len(SEDES)),
+    })
+    heatmap = pd.DataFrame(
+        [(s, e, int(rng.integers(0, 300))) for s in SEDES for e in ESPECIALIDADES],
+        columns=["sede_nombre", "especialidad", "total_citas"],
+    )
+
+    return {
+        "especialidad": ("graficar_citas_por_especialidad", especialidades, {"filename": "citas_especialidad.png"}),
+        "temporal": ("graficar_citas_temporales", tendencia, {"filename": "citas_temporales.png"}),
+        "top_medicos": ("graficar_medicos_top", medicos, {"filename": "top_medicos.png", "top_n": 10}),
+        "horarios": ("graficar_distribucion_horarios", horarios, {"filename": "distribucion_horarios.png"}),
+        "tipo_doc": ("graficar_pacientes_por_tipo_doc", tipo_doc, {"filename": "tipo_documento.png"}),
+        "sedes": ("graficar_comparativa_sedes", sedes, {"filename": "comparativa_sedes.png"}),
+        "heatmap": ("graficar_heatmap_especialidades_sedes", heatmap, {"filename": "heatmap_especialidades.png"}),
+    }
+
+
+def medir_secuencial(output_dir: str, tareas: Dict[str, TareaGrafico], repeticiones: int) -> List[float]:
+    """Renderiza los gráficos uno tras otro en el proceso actual (camino anterior)"""
+    visualizador = VisualizadorEstadisticas(output_dir)
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for metodo, df, kwargs in tareas.values():
+            getattr(visualizador, metodo)(df.copy(), **kwargs)
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+
+def medir_pool(output_dir: str, tareas: Dict[str, TareaGrafico], procesos: int,
+               repeticiones: int) -> Dict[str, float]:
+    """Renderiza con un pool de `procesos` procesos; el arranque se mide aparte"""
+    visualizador = VisualizadorEstadisticas(output_dir, max_procesos=procesos)
+    inicio = time.perf_counter()
+    visualizador.renderizar_en_paralelo(tareas)  # calentamiento: arranca los procesos
+    arranque = time.perf_counter() - inicio
+
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        visualizador.renderizar_en_paralelo(tareas)
+        tiempos.append(time.perf_counter() - inicio)
+    visualizador.cerrar()
+    return {"arranque_s": arranque, "mediana_s": statistics.median(tiempos)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de renderizado paralelo de gráficos")
+    parser.add_argument("--procesos", type=int, nargs="+",
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--json", dest="salida_json", help="Ruta donde guardar los resultados en JSON")
+    args = parser.parse_args()
+
+    tareas = tareas_sinteticas()
+    resultados = {"cpus": os.cpu_count(), "niveles": []}
+    with tempfile.TemporaryDirectory() as output_dir:
+        secuencial = statistics.median(medir_secuencial(output_dir, tareas, args.repeticiones))
+        resultados["secuencial_s"] = secuencial
+        print(f"🖼️  {len(tareas)} gráficos, {os.cpu_count()} CPUs\n")
+        print(f"{'Modo':<14} {'Mediana s':>10} {'Aceleración':>12} {'Arranque s':>11}")
+        print(f"{'secuencial':<14} {secuencial:>10.2f} {'x1.00':>12} {'-':>11}")
+
+        for procesos in args.procesos:
+            r = medir_pool(output_dir, tareas, procesos, args.repeticiones)
+            r["procesos"] = procesos
+            r["aceleracion"] = secuencial / r["mediana_s"] if r["mediana_s"] else 0.0
+            resultados["niveles"].append(r)
+            print(f"{f'{procesos} procesos':<14} {r['mediana_s']:>10.2f} "
+                  f"{'x' + format(r['aceleracion'], '.2f'):>12} {r['arranque_s']:>11.2f}")
+
+    if args.salida_json:
+        with open(args.salida_json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
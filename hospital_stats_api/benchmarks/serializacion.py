@@ -0,0 +1,83 @@
+"""
+serializacion.py - Compara tiempo y tamaño de la serialización JSON de un
+DataFrame grande (forma de `pacientes_activos`) en formato records con el
+JSONResponse de la biblioteca estándar frente al formato columnar con orjson
+
+Uso:
+    python -m benchmarks.serializacion --filas 10000 100000 500000
+
+No necesita base de datos: usa DataFrames sintéticos.
+"""
+import argparse
+import json
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+from fastapi.responses import JSONResponse
+
+from respuestas import columnar, serializar_json
+
+TIPOS_DOCUMENTO = ["CC", "TI", "CE", "PA"]
+
+
+def pacientes_sinteticos(filas: int, semilla: int = 42) -> pd.DataFrame:
+    """DataFrame con las columnas de EstadisticasQueries.pacientes_activos"""
+    rng = np.random.default_rng(semilla)
+    return pd.DataFrame({
+        "user_id": np.arange(1, filas + 1),
+        "nombre": [f"Nombre{i % 997}" for i in range(filas)],
+        "apellido": [f"Apellido{i % 991}" for i in range(filas)],
+        "tipo_documento": rng.choice(TIPOS_DOCUMENTO, filas),
+        "total_citas": rng.integers(1, 40, filas),
+    })
+
+
+CASOS: Dict[str, Callable[[pd.DataFrame], bytes]] = {
+    "records + json": lambda df: JSONResponse({"activos": df.to_dict('records')}).body,
+    "records + orjson": lambda df: serializar_json({"activos": df.to_dict('records')}),
+    "columnar + orjson": lambda df: serializar_json({"activos": columnar(df)}),
+}
+
+
+def medir(func: Callable[[pd.DataFrame], bytes], df: pd.DataFrame, repeticiones: int) -> Dict[str, float]:
+    """Mediana del tiempo de serialización (ms) y tamaño del cuerpo (bytes)"""
+    tiempos: List[float] = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        cuerpo = func(df)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return {"mediana_ms": round(statistics.median(tiempos), 2), "bytes": len(cuerpo)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serialización records/json vs columnar/orjson")
+    parser.add_argument("--filas", type=int, nargs="+", default=[10_000, 100_000, 500_000])
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--json", dest="salida_json", help="Ruta donde guardar los resultados en JSON")
+    args = parser.parse_args()
+
+    resultados = {}
+    for filas in args.filas:
+        df = pacientes_sinteticos(filas)
+        print(f"\n📦 {filas:,} filas")
+        resultados[filas] = {}
+        for nombre, func in CASOS.items():
+            r = medir(func, df, args.repeticiones)
+            resultados[filas][nombre] = r
+            print(f"  {nombre:<20} {r['mediana_ms']:>10.1f} ms {r['bytes'] / 1024:>12,.0f} KB")
+        base = resultados[filas]["records + json"]
+        rapido = resultados[filas]["columnar + orjson"]
+        if rapido["mediana_ms"]:
+            print(f"  ⚡ x{base['mediana_ms'] / rapido['mediana_ms']:.1f} más rápido, "
+                  f"x{base['bytes'] / rapido['bytes']:.1f} más pequeño")
+
+    if args.salida_json:
+        with open(args.salida_json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
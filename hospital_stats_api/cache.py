@@ -0,0 +1,231 @@
+"""
+cache.py - Caché en memoria con TTL, LRU por tamaño y single-flight para las
+consultas de EstadisticasQueries
+"""
+import copy
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import pandas as pd
+
+from database import LecturaFallida, vigilar_lecturas
+from metricas import nombrar_consulta
+from trazas import tramo
+
+
+def _tamano_bytes(valor: Any) -> int:
+    """Estima la memoria ocupada por un resultado cacheado"""
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(index=True, deep=True).sum())
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(
+            sys.getsizeof(k) + _tamano_bytes(v) for k, v in valor.items()
+        )
+    return sys.getsizeof(valor)
+
+
+def _copiar(valor: Any) -> Any:
+    """
+    Devuelve una copia del valor cacheado: los gráficos y endpoints modifican
+    los DataFrames que reciben (p. ej. añaden columnas) y no deben alterar la caché
+    """
+    if isinstance(valor, pd.DataFrame):
+        return valor.copy()
+    if isinstance(valor, dict):
+        return {k: _copiar(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return copy.copy(valor)
+    return valor
+
+
+class _Entrada:
+    """Valor cacheado junto con su instante de expiración y su tamaño"""
+    __slots__ = ("valor", "expira", "tamano")
+
+    def __init__(self, valor: Any, expira: float, tamano: int):
+        self.valor = valor
+        self.expira = expira
+        self.tamano = tamano
+
+
+class CacheResultados:
+    """Caché de resultados de queries con TTL por consulta y expulsión LRU por memoria"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_default: float = 60.0,
+                 activa: bool = True):
+        """
+        Inicializa la caché
+
+        Args:
+            max_bytes: Memoria máxima estimada de los resultados guardados
+            ttl_default: Segundos de vida si la consulta no define su propio TTL
+            activa: Si es False, todas las llamadas van directo a la base de datos
+        """
+        self.max_bytes = max_bytes
+        self.ttl_default = ttl_default
+        self.activa = activa
+        self._entradas: "OrderedDict[Hashable, _Entrada]" = OrderedDict()
+        self._en_vuelo: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.bytes_usados = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalescidas = 0
+        self.expulsiones = 0
+
+    def obtener(self, clave: Hashable, calcular: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """
+        Retorna el valor cacheado para `clave` o lo calcula una sola vez.
+        Si otra llamada ya está calculando la misma clave, espera su resultado
+        en lugar de lanzar otra query (single-flight).
+
+        Args:
+            clave: Clave de la consulta (método + parámetros)
+            calcular: Función que ejecuta la consulta real
+            ttl: Segundos de vida del resultado (default: ttl_default)
+
+        Returns:
+            Copia del resultado
+        """
+        if not self.activa:
+            return calcular()
+
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                if entrada.expira > time.monotonic():
+                    self._entradas.move_to_end(clave)
+                    self.hits += 1
+                    return _copiar(entrada.valor)
+                self._eliminar(clave)
+
+            futuro = self._en_vuelo.get(clave)
+            lider = futuro is None
+            if lider:
+                futuro = Future()
+                self._en_vuelo[clave] = futuro
+                self.misses += 1
+            else:
+                self.coalescidas += 1
+
+        if not lider:
+            return _copiar(futuro.result())
+
+        try:
+            valor = calcular()
+        except BaseException as e:
+            with self._lock:
+                del self._en_vuelo[clave]
+            futuro.set_exception(e)
+            raise
+
+        with self._lock:
+            self._guardar(clave, valor, ttl if ttl is not None else self.ttl_default)
+            del self._en_vuelo[clave]
+        futuro.set_result(valor)
+        return _copiar(valor)
+
+    def _guardar(self, clave: Hashable, valor: Any, ttl: float):
+        """Guarda un valor y expulsa los menos usados si se supera max_bytes (con lock)"""
+        tamano = _tamano_bytes(valor)
+        if tamano > self.max_bytes:
+            return
+        if clave in self._entradas:
+            self._eliminar(clave)
+        self._entradas[clave] = _Entrada(valor, time.monotonic() + ttl, tamano)
+        self.bytes_usados += tamano
+        while self.bytes_usados > self.max_bytes:
+            clave_lru = next(iter(self._entradas))
+            self._eliminar(clave_lru)
+            self.expulsiones += 1
+
+    def _eliminar(self, clave: Hashable):
+        """Elimina una entrada y descuenta su tamaño (con lock)"""
+        entrada = self._entradas.pop(clave)
+        self.bytes_usados -= entrada.tamano
+
+    def invalidar(self, metodo: Optional[str] = None) -> int:
+        """
+        Elimina entradas de la caché
+
+        Args:
+            metodo: Nombre del método a invalidar; si es None se vacía toda la caché
+
+        Returns:
+            Número de entradas eliminadas
+        """
+        with self._lock:
+            claves = [c for c in self._entradas
+                      if metodo is None or c[0].rsplit('.', 1)[-1] == metodo]
+            for clave in claves:
+                self._eliminar(clave)
+            return len(claves)
+
+    def estadisticas(self) -> dict:
+        """Retorna los contadores de uso de la caché"""
+        with self._lock:
+            consultas = self.hits + self.misses + self.coalescidas
+            return {
+                "activa": self.activa,
+                "entradas": len(self._entradas),
+                "bytes_usados": self.bytes_usados,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalescidas": self.coalescidas,
+                "expulsiones": self.expulsiones,
+                "en_vuelo": len(self._en_vuelo),
+                "hit_ratio": round((self.hits + self.coalescidas) / consultas, 4) if consultas else 0.0
+            }
+
+    def cacheado(self, ttl: Optional[float] = None):
+        """
+        Decorador que cachea el resultado de una función según sus parámetros.
+        Al calcular, las lecturas de la base se etiquetan en las métricas con
+        el nombre de la función. Cada llamada es un tramo "consulta.<función>" de
+        la traza en curso (con calculada=True si no se sirvió desde la caché).
+        Si alguna lectura de la base falla, se lanza LecturaFallida en lugar de
+        cachear el resultado vacío que retornó el lector.
+
+        Args:
+            ttl: Segundos de vida de los resultados de esta función
+        """
+        def decorador(func: Callable) -> Callable:
+            firma = inspect.signature(func)
+            nombre = func.__qualname__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                argumentos = firma.bind(*args, **kwargs)
+                argumentos.apply_defaults()
+                clave = (nombre, tuple(sorted(argumentos.arguments.items())))
+
+                with tramo(f"consulta.{func.__name__}") as actual:
+                    def calcular():
+                        if actual is not None:
+                            actual.atributos["calculada"] = True
+                        with nombrar_consulta(func.__name__), vigilar_lecturas() as fallos:
+                            valor = func(*args, **kwargs)
+                        if fallos:
+                            raise LecturaFallida(f"{func.__name__}: {fallos[0]}")
+                        return valor
+
+                    return self.obtener(clave, calcular, ttl)
+
+            return wrapper
+        return decorador
+
+
+# Instancia global para las consultas de estadísticas
+cache_estadisticas = CacheResultados(
+    max_bytes=int(float(os.getenv("STATS_CACHE_MAX_MB", "64")) * 1024 * 1024),
+    ttl_default=float(os.getenv("STATS_CACHE_TTL", "60")),
+    activa=os.getenv("STATS_CACHE_ACTIVA", "1") != "0"
+)
@@ -0,0 +1,140 @@
+"""
+cache_graficos.py - Caché en disco de gráficos renderizados, indexada por el hash
+del contenido del DataFrame, la función de gráfico y sus opciones de renderizado
+"""
+import hashlib
+import inspect
+import os
+import tempfile
+import threading
+from typing import Callable, Optional
+
+import pandas as pd
+
+
+class CacheGraficos:
+    """Guarda las imágenes ya renderizadas y las reutiliza si los datos no cambian"""
+
+    def __init__(self, directorio: str = "output/cache_graficos",
+                 max_bytes: int = 200 * 1024 * 1024, activa: bool = True):
+        """
+        Inicializa la caché de gráficos
+
+        Args:
+            directorio: Carpeta donde se guardan las imágenes cacheadas
+            max_bytes: Tamaño máximo en disco; al superarlo se borran las menos usadas
+            activa: Si es False, siempre se renderiza
+        """
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.activa = activa
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expulsiones = 0
+
+    @staticmethod
+    def clave(funcion: Callable, df: pd.DataFrame, opciones: dict) -> str:
+        """
+        Calcula la clave de un gráfico
+
+        Args:
+            funcion: Función o método graficar_* (su código fuente forma parte de la clave,
+                así un cambio en el gráfico invalida las imágenes anteriores)
+            df: DataFrame de entrada
+            opciones: Parámetros de renderizado (top_n, dpi, formato...)
+
+        Returns:
+            Hash hexadecimal SHA-256
+        """
+        h = hashlib.sha256()
+        h.update(funcion.__qualname__.encode())
+        h.update(inspect.getsource(funcion).encode())
+        h.update(repr(sorted(opciones.items())).encode())
+        h.update(repr(list(df.columns)).encode())
+        h.update(repr([str(t) for t in df.dtypes]).encode())
+        h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+        return h.hexdigest()
+
+    def _ruta(self, clave: str, extension: str) -> str:
+        """Ruta en disco de una entrada"""
+        return os.path.join(self.directorio, f"{clave}.{extension}")
+
+    def obtener(self, clave: str, extension: str = "png") -> Optional[bytes]:
+        """
+        Busca una imagen cacheada
+
+        Returns:
+            Contenido de la imagen o None si no está en caché
+        """
+        if not self.activa:
+            return None
+        ruta = self._ruta(clave, extension)
+        try:
+            with open(ruta, "rb") as f:
+                contenido = f.read()
+            os.utime(ruta)  # marca de uso para la expulsión LRU
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return contenido
+
+    def guardar(self, clave: str, contenido: bytes, extension: str = "png"):
+        """
+        Guarda una imagen recién renderizada en la caché
+
+        Args:
+            clave: Clave calculada con `clave()`
+            contenido: Bytes de la imagen
+            extension: Extensión del formato de la imagen
+        """
+        if not self.activa:
+            return
+        os.makedirs(self.directorio, exist_ok=True)
+        # Escritura atómica: otro proceso nunca ve un archivo a medio escribir
+        fd, temporal = tempfile.mkstemp(dir=self.directorio, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(contenido)
+        os.replace(temporal, self._ruta(clave, extension))
+        self._expulsar()
+
+    def _expulsar(self):
+        """Borra las imágenes usadas hace más tiempo hasta quedar bajo max_bytes"""
+        with self._lock:
+            entradas = []
+            for entrada in os.scandir(self.directorio):
+                if entrada.is_file() and not entrada.name.endswith(".tmp"):
+                    info = entrada.stat()
+                    entradas.append((info.st_mtime, info.st_size, entrada.path))
+            total = sum(tamano for _, tamano, _ in entradas)
+            for _, tamano, ruta in sorted(entradas):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(ruta)
+                    total -= tamano
+                    self.expulsiones += 1
+                except FileNotFoundError:
+                    pass
+
+    def estadisticas(self) -> dict:
+        """Retorna los contadores de uso de la caché de gráficos"""
+        with self._lock:
+            return {
+                "activa": self.activa,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expulsiones": self.expulsiones,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# Instancia global para los gráficos del reporte
+cache_graficos = CacheGraficos(
+    directorio=os.getenv("STATS_CACHE_GRAFICOS_DIR", os.path.join("output", "cache_graficos")),
+    max_bytes=int(float(os.getenv("STATS_CACHE_GRAFICOS_MB", "200")) * 1024 * 1024),
+    activa=os.getenv("STATS_CACHE_GRAFICOS_ACTIVA", "1") != "0"
+)
@@ -0,0 +1,184 @@
+"""
+consultas_lentas.py - Registro de consultas lentas (y fallidas) de DatabaseConnection
+con el plan de EXPLAIN capturado en el momento
+
+Cada lectura que supera el umbral queda registrada con su SQL, los tipos de sus
+parámetros (no sus valores), duración, filas y el nombre de la consulta de
+EstadisticasQueries. El EXPLAIN se ejecuta en un
+hilo aparte, justo después, para no alargar más la petición que ya fue lenta; el
+mismo SQL no se vuelve a explicar antes de `intervalo_explain` segundos.
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+# Solo se pide el plan de sentencias de lectura
+_EXPLICABLES = ("SELECT", "WITH")
+
+
+def _redactar(params: Optional[dict]) -> dict:
+    """
+    Parámetros sin sus valores (pueden ser ids de pacientes): solo el tipo, y
+    el largo de las listas. El EXPLAIN se ejecuta con los valores reales, que
+    no se guardan.
+    """
+    redactados = {}
+    for nombre, valor in (params or {}).items():
+        tipo = type(valor).__name__
+        redactados[nombre] = f"<{tipo}[{len(valor)}]>" if isinstance(valor, (list, tuple, set)) else f"<{tipo}>"
+    return redactados
+
+
+class RegistroConsultasLentas:
+    """Peores N consultas lentas, las N más recientes y las últimas fallidas"""
+
+    def __init__(self, umbral_ms: float = 500.0, capacidad: int = 50,
+                 explicar: bool = True, intervalo_explain: float = 60.0):
+        """
+        Inicializa el registro
+
+        Args:
+            umbral_ms: Duración a partir de la cual una lectura es lenta (0 desactiva el registro)
+            capacidad: Entradas que se conservan en cada lista
+            explicar: Capturar el EXPLAIN de cada consulta lenta
+            intervalo_explain: Segundos durante los que se reutiliza el plan de un mismo SQL
+        """
+        self.umbral_ms = umbral_ms
+        self.capacidad = capacidad
+        self.explicar = explicar
+        self.intervalo_explain = intervalo_explain
+        self.registradas = 0
+        self._peores: List[Tuple[float, int, dict]] = []  # min-heap por duración
+        self._recientes: deque = deque(maxlen=capacidad)
+        self._fallidas: deque = deque(maxlen=capacidad)
+        self._planes: Dict[str, Tuple[float, Any]] = {}
+        self._secuencia = itertools.count()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def activo(self) -> bool:
+        return self.umbral_ms > 0
+
+    def registrar(self, obtener_engine: Callable[[], Any], lectura: str, query: str,
+                  params: Optional[dict], segundos: float, filas: int,
+                  consulta: Optional[str] = None, error: Optional[str] = None) -> None:
+        """
+        Registra una lectura si fue lenta o falló
+
+        Args:
+            obtener_engine: Retorna el engine con el que ejecutar el EXPLAIN
+            lectura: Método de DatabaseConnection que la ejecutó
+            query: SQL ejecutado
+            params: Parámetros del SQL
+            segundos: Duración
+            filas: Filas retornadas
+            consulta: Método de EstadisticasQueries que la pidió
+            error: Mensaje de error si la lectura falló
+        """
+        duracion_ms = segundos * 1000
+        if not self.activo or (error is None and duracion_ms < self.umbral_ms):
+            return
+        entrada = {
+            "consulta": consulta,
+            "lectura": lectura,
+            "duracion_ms": round(duracion_ms, 2),
+            "filas": filas,
+            "sql": " ".join(query.split()),
+            "params": _redactar(params),
+            "cuando": datetime.now().isoformat(timespec="seconds"),
+            "plan": None,
+        }
+        if error is not None:
+            # Los errores de SQLAlchemy repiten el SQL y los valores de los parámetros
+            entrada["error"] = error.split("\n[SQL:", 1)[0]
+            with self._lock:
+                self._fallidas.append(entrada)
+            return
+
+        with self._lock:
+            self.registradas += 1
+            self._recientes.append(entrada)
+            elemento = (duracion_ms, next(self._secuencia), entrada)
+            if len(self._peores) < self.capacidad:
+                heapq.heappush(self._peores, elemento)
+            elif duracion_ms > self._peores[0][0]:
+                heapq.heapreplace(self._peores, elemento)
+        print(f"🐢 Consulta lenta ({entrada['duracion_ms']:.0f} ms): {consulta or lectura}")
+
+        if self.explicar and query.lstrip().upper().startswith(_EXPLICABLES):
+            self._obtener_executor().submit(self._explicar, obtener_engine, entrada, query, params)
+
+    def _obtener_executor(self) -> ThreadPoolExecutor:
+        """Hilo único donde corren los EXPLAIN"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+        return self._executor
+
+    def _explicar(self, obtener_engine: Callable[[], Any], entrada: dict,
+                  query: str, params: Optional[dict]) -> None:
+        """Ejecuta el EXPLAIN de la consulta (o reutiliza uno reciente del mismo SQL)"""
+        ahora = time.monotonic()
+        with self._lock:
+            reciente = self._planes.get(query)
+        if reciente is not None and ahora - reciente[0] < self.intervalo_explain:
+            entrada["plan"] = reciente[1]
+            return
+        try:
+            with obtener_engine().connect() as conn:
+                plan = [dict(fila) for fila in conn.execute(text("EXPLAIN " + query), params or {}).mappings()]
+        except Exception as e:
+            entrada["plan_error"] = str(e)
+            return
+        entrada["plan"] = plan
+        with self._lock:
+            self._planes[query] = (ahora, plan)
+            # Los planes viejos no sirven para nada: se descartan al pasar el intervalo
+            self._planes = {q: p for q, p in self._planes.items() if ahora - p[0] < self.intervalo_explain}
+
+    def peores(self) -> List[dict]:
+        """Consultas lentas de mayor a menor duración"""
+        with self._lock:
+            return [entrada for _, _, entrada in sorted(self._peores, reverse=True)]
+
+    def recientes(self) -> List[dict]:
+        """Consultas lentas de la más reciente a la más antigua"""
+        with self._lock:
+            return list(reversed(self._recientes))
+
+    def fallidas(self) -> List[dict]:
+        """Lecturas fallidas de la más reciente a la más antigua"""
+        with self._lock:
+            return list(reversed(self._fallidas))
+
+    def limpiar(self) -> None:
+        """Vacía el registro"""
+        with self._lock:
+            self._peores.clear()
+            self._recientes.clear()
+            self._fallidas.clear()
+            self._planes.clear()
+            self.registradas = 0
+
+    def estado(self) -> dict:
+        """Configuración y contadores del registro"""
+        return {
+            "activo": self.activo,
+            "umbral_ms": self.umbral_ms,
+            "capacidad": self.capacidad,
+            "explicar": self.explicar,
+            "registradas": self.registradas,
+        }
+
+    def cerrar(self) -> None:
+        """Detiene el hilo de los EXPLAIN"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -2,8 +2,67 @@
 database.py - Configuración de conexión a MySQL para el sistema de estadísticas
 """
 from sqlalchemy import create_engine, text
+from sqlalchemy.sql.elements import TextClause
+import numpy as np
 import pandas as pd
-from typing import Optional
+from typing import Optional, Callable, Any, Dict, Iterator, List
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial, lru_cache
+from contextlib import ExitStack, contextmanager
+import asyncio
+import contextvars
+import itertools
+import os
+import sys
+import threading
+import time
+
+from metricas import metricas, consulta_actual, SIN_NOMBRE
+from trazas import registrar_tramo
+from perfilador import en_hilo
+from consultas_lentas import RegistroConsultasLentas
+
+@lru_cache(maxsize=256)
+def _sentencia(query: str) -> TextClause:
+    """
+    Sentencia text() cacheada por su SQL: se parsea una sola vez y SQLAlchemy
+    reutiliza su forma compilada en cada ejecución (pymysql no tiene
+    sentencias preparadas del lado del servidor)
+    """
+    return text(query)
+
+class LecturaFallida(RuntimeError):
+    """Una lectura de la base falló y retornó un resultado vacío en lugar del error"""
+
+class StreamsAgotados(RuntimeError):
+    """Ya están abiertas todas las lecturas en streaming permitidas"""
+
+# Lista donde vigilar_lecturas anota los errores de las lecturas del bloque
+_fallos_lectura: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar(
+    "fallos_lectura", default=None
+)
+
+@contextmanager
+def vigilar_lecturas() -> Iterator[List[str]]:
+    """
+    Anota en la lista que entrega los errores de las lecturas hechas dentro del
+    bloque (también en los hilos de run_async, que reciben una copia del contexto
+    con la misma lista): execute_query y compañía los tragan y retornan vacío
+    """
+    fallos: List[str] = []
+    token = _fallos_lectura.set(fallos)
+    try:
+        yield fallos
+    finally:
+        _fallos_lectura.reset(token)
+
+def _bytes_filas(filas) -> int:
+    """Tamaño estimado en memoria de una lista de filas (tuplas o diccionarios)"""
+    return sum(
+        sys.getsizeof(valor)
+        for fila in filas
+        for valor in (fila.values() if isinstance(fila, dict) else fila)
+    )
 
 class DatabaseConnection:
     def __init__(
@@ -12,10 +71,15 @@ class DatabaseConnection:
         user: str = "root",
         password: str = "",
         database: str = "hospital_db",
-        port: int = 3306
+        port: int = 3306,
+        max_workers: Optional[int] = None,
+        max_concurrencia: Optional[int] = None,
+        max_streams: Optional[int] = None
     ):
         """
-        Inicializa la conexión a la base de datos MySQL
+        Inicializa la conexión a la base de datos MySQL. La variable STATS_DB_URL
+        (URL de SQLAlchemy) reemplaza host, usuario, contraseña, base y puerto,
+        p. ej. para apuntar la API a una base de pruebas con datos sintéticos
         
         Args:
             host: Host de MySQL (default: localhost)
@@ -23,14 +87,70 @@ class DatabaseConnection:
             password: Contraseña de MySQL (default: '')
             database: Nombre de la base de datos (default: hospital_db)
             port: Puerto de MySQL (default: 3306)
+            max_workers: Hilos del pool de ejecución de queries
+                (default: variable STATS_DB_WORKERS o 8)
+            max_concurrencia: Máximo de queries simultáneas por petición en gather
+                (default: variable STATS_MAX_CONCURRENCIA o max_workers)
+            max_streams: Lecturas en streaming abiertas a la vez, cada una con su
+                conexión de un pool aparte (default: variable STATS_MAX_STREAMS o 4)
+        
+        El health check usa una conexión y un hilo propios (fuera del pool de queries y
+        de gather) y se rinde tras STATS_SALUD_ESPERA segundos (default 5).
+        
+        Las lecturas que tardan más de STATS_CONSULTA_LENTA_MS (default 500; 0 lo
+        desactiva) quedan en `consultas_lentas` con su EXPLAIN; STATS_CONSULTAS_LENTAS
+        fija cuántas se conservan (default 50) y STATS_EXPLAIN_LENTAS=0 omite el plan.
         """
-        self.connection_string = f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}"
+        self.connection_string = (
+            os.getenv("STATS_DB_URL") or f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}"
+        )
+        self.max_workers = max_workers or int(os.getenv("STATS_DB_WORKERS", "8"))
+        self.max_concurrencia = max_concurrencia or int(
+            os.getenv("STATS_MAX_CONCURRENCIA", str(self.max_workers))
+        )
+        self.max_streams = max_streams or int(os.getenv("STATS_MAX_STREAMS", "4"))
         self.engine = None
+        self.engine_streams = None
+        self.engine_salud = None
+        self.executor = None
+        self.espera_salud = float(os.getenv("STATS_SALUD_ESPERA", "5"))
+        self._executor_salud: Optional[ThreadPoolExecutor] = None
+        self._salud_en_curso: Optional[Future] = None
+        self._streams = threading.BoundedSemaphore(self.max_streams)
+        self.consultas_lentas = RegistroConsultasLentas(
+            umbral_ms=float(os.getenv("STATS_CONSULTA_LENTA_MS", "500")),
+            capacidad=int(os.getenv("STATS_CONSULTAS_LENTAS", "50")),
+            explicar=os.getenv("STATS_EXPLAIN_LENTAS", "1") != "0"
+        )
         
     def connect(self):
         """Establece la conexión con la base de datos"""
         try:
-            self.engine = create_engine(self.connection_string, pool_pre_ping=True)
+            # El pool de conexiones se dimensiona igual que el pool de hilos,
+            # así cada hilo puede tener su propia conexión sin esperar
+            self.engine = create_engine(
+                self.connection_string,
+                pool_pre_ping=True,
+                pool_size=self.max_workers,
+                max_overflow=0
+            )
+            # Las lecturas en streaming retienen su conexión mientras el cliente
+            # consume: salen de otro pool para no dejar sin conexiones a las queries
+            self.engine_streams = create_engine(
+                self.connection_string,
+                pool_pre_ping=True,
+                pool_size=self.max_streams,
+                max_overflow=0
+            )
+            # El health check tiene su propia conexión: responde aunque las queries
+            # del dashboard tengan ocupado todo el pool
+            self.engine_salud = create_engine(
+                self.connection_string,
+                pool_pre_ping=True,
+                pool_size=1,
+                max_overflow=0,
+                pool_timeout=self.espera_salud
+            )
             # Test connection
             with self.engine.connect() as conn:
                 conn.execute(text("SELECT 1"))
@@ -40,6 +160,22 @@ class DatabaseConnection:
             print(f"❌ Error conectando a la base de datos: {e}")
             return False
     
+    def _registrar_lectura(self, lectura: str, query: str, params: Optional[dict], segundos: float,
+                           filas: int = 0, bytes_: int = 0, error: Optional[Exception] = None,
+                           consulta: Optional[str] = None) -> None:
+        """Registra una lectura en las métricas, en la traza en curso y, si fue lenta o falló, en consultas_lentas"""
+        consulta = consulta or consulta_actual.get()
+        if error is not None:
+            fallos = _fallos_lectura.get()
+            if fallos is not None:
+                fallos.append(str(error))
+        metricas.registrar_consulta(lectura, segundos, filas, bytes_, error is not None, consulta)
+        registrar_tramo(f"sql.{consulta or SIN_NOMBRE}", segundos, lectura=lectura, filas=filas)
+        self.consultas_lentas.registrar(
+            lambda: self.engine, lectura, query, params, segundos, filas,
+            consulta, None if error is None else str(error)
+        )
+    
     def execute_query(self, query: str, params: Optional[dict] = None) -> pd.DataFrame:
         """
         Ejecuta una query SQL y retorna un DataFrame de pandas
@@ -51,18 +187,295 @@ class DatabaseConnection:
         Returns:
             DataFrame con los resultados
         """
+        inicio = time.perf_counter()
         try:
+            # text() hace que los parámetros :nombre funcionen con pymysql
             if params:
-                df = pd.read_sql_query(query, self.engine, params=params)
+                df = pd.read_sql_query(_sentencia(query), self.engine, params=params)
             else:
-                df = pd.read_sql_query(query, self.engine)
-            return df
+                df = pd.read_sql_query(_sentencia(query), self.engine)
         except Exception as e:
             print(f"❌ Error ejecutando query: {e}")
+            self._registrar_lectura("execute_query", query, params, time.perf_counter() - inicio, error=e)
             return pd.DataFrame()
+        segundos = time.perf_counter() - inicio
+        bytes_ = int(df.memory_usage(index=True, deep=True).sum()) if metricas.activa else 0
+        self._registrar_lectura("execute_query", query, params, segundos, len(df), bytes_)
+        return df
+    
+    # ----- Lecturas ligeras (sin DataFrame) -----
+    
+    def fetch_scalar(self, query: str, params: Optional[dict] = None, default: Any = None) -> Any:
+        """
+        Ejecuta una query y retorna la primera columna de la primera fila,
+        sin construir un DataFrame (conteos, promedios, SELECT 1)
+        
+        Args:
+            query: Query SQL a ejecutar
+            params: Parámetros para la query (opcional)
+            default: Valor si la query no retorna filas, el valor es NULL o falla
+            
+        Returns:
+            El valor escalar
+        """
+        inicio = time.perf_counter()
+        try:
+            with self.engine.connect() as conn:
+                valor = conn.execute(_sentencia(query), params or {}).scalar()
+        except Exception as e:
+            print(f"❌ Error ejecutando query: {e}")
+            self._registrar_lectura("fetch_scalar", query, params, time.perf_counter() - inicio, error=e)
+            return default
+        self._registrar_lectura(
+            "fetch_scalar", query, params, time.perf_counter() - inicio, int(valor is not None), sys.getsizeof(valor)
+        )
+        return default if valor is None else valor
+    
+    def fetch_rows(self, query: str, params: Optional[dict] = None) -> List[tuple]:
+        """
+        Ejecuta una query y retorna sus filas como tuplas
+        
+        Args:
+            query: Query SQL a ejecutar
+            params: Parámetros para la query (opcional)
+            
+        Returns:
+            Lista de tuplas (vacía si la query falla)
+        """
+        inicio = time.perf_counter()
+        try:
+            with self.engine.connect() as conn:
+                filas = [tuple(fila) for fila in conn.execute(_sentencia(query), params or {})]
+        except Exception as e:
+            print(f"❌ Error ejecutando query: {e}")
+            self._registrar_lectura("fetch_rows", query, params, time.perf_counter() - inicio, error=e)
+            return []
+        segundos = time.perf_counter() - inicio
+        bytes_ = _bytes_filas(filas) if metricas.activa else 0
+        self._registrar_lectura("fetch_rows", query, params, segundos, len(filas), bytes_)
+        return filas
+    
+    def fetch_columns(self, query: str, params: Optional[dict] = None) -> Dict[str, np.ndarray]:
+        """
+        Ejecuta una query y retorna un array de NumPy por columna
+        
+        Args:
+            query: Query SQL a ejecutar
+            params: Parámetros para la query (opcional)
+            
+        Returns:
+            Diccionario columna -> array (vacío si la query falla)
+        """
+        inicio = time.perf_counter()
+        try:
+            with self.engine.connect() as conn:
+                resultado = conn.execute(_sentencia(query), params or {})
+                columnas = list(resultado.keys())
+                filas = resultado.fetchall()
+        except Exception as e:
+            print(f"❌ Error ejecutando query: {e}")
+            self._registrar_lectura("fetch_columns", query, params, time.perf_counter() - inicio, error=e)
+            return {}
+        if not filas:
+            arrays = {columna: np.array([]) for columna in columnas}
+        else:
+            arrays = {columna: np.array(valores) for columna, valores in zip(columnas, zip(*filas))}
+        self._registrar_lectura(
+            "fetch_columns", query, params, time.perf_counter() - inicio, len(filas),
+            sum(a.nbytes for a in arrays.values())
+        )
+        return arrays
+    
+    def stream_rows(self, query: str, params: Optional[dict] = None,
+                    tamano_lote: int = 1000) -> Iterator[dict]:
+        """
+        Ejecuta una query con un cursor del lado del servidor y entrega las
+        filas una a una como diccionarios, leyéndolas de `tamano_lote` en
+        `tamano_lote`: la memoria no depende del tamaño del resultado
+        
+        La query se ejecuta y el primer lote se lee antes de retornar (llamar
+        desde un hilo, p. ej. con run_async). Si el resultado cabe en ese lote,
+        la conexión se suelta enseguida y las filas salen de memoria; si no, queda
+        tomada (de `engine_streams`) hasta que se agota o se cierra el iterador.
+        Como mucho hay `max_streams` lecturas abiertas: la siguiente lanza
+        StreamsAgotados. A diferencia de execute_query, los errores se propagan:
+        un resultado cortado a medias no debe parecer completo.
+        
+        Args:
+            query: Query SQL a ejecutar
+            params: Parámetros para la query (opcional)
+            tamano_lote: Filas que se piden al servidor en cada lectura
+            
+        Returns:
+            Iterador de filas (columna -> valor)
+        """
+        # El nombre de la consulta se toma al llamar: el iterador puede consumirse en otro contexto
+        filas = self._stream_rows(query, params, tamano_lote, consulta_actual.get())
+        # Hasta la primera marca: ejecuta la query, lee el primer lote y propaga sus
+        # errores aquí, antes de que se envíe nada. Un generador ya iniciado que se
+        # descarta sin consumir se cierra al recolectarse y suelta su conexión.
+        next(filas)
+        return filas
+    
+    @contextmanager
+    def _cupo_stream(self) -> Iterator[None]:
+        """Reserva una de las `max_streams` lecturas en streaming; StreamsAgotados si no quedan"""
+        if not self._streams.acquire(blocking=False):
+            raise StreamsAgotados(f"Ya hay {self.max_streams} lecturas en streaming abiertas")
+        try:
+            yield
+        finally:
+            self._streams.release()
+    
+    def _stream_rows(self, query: str, params: Optional[dict], tamano_lote: int,
+                     consulta: Optional[str]) -> Iterator[Optional[dict]]:
+        """
+        Generador de stream_rows: entrega primero una marca (None) y luego las filas;
+        mide el tiempo hasta agotar (o cerrar) el iterador
+        """
+        inicio = time.perf_counter()
+        filas = bytes_ = 0
+        error = None
+        with ExitStack() as recursos:
+            recursos.enter_context(self._cupo_stream())
+            try:
+                conn = recursos.enter_context(self.engine_streams.connect())
+                resultado = conn.execution_options(
+                    stream_results=True, max_row_buffer=tamano_lote
+                ).execute(_sentencia(query), params or {})
+                lotes = ([dict(fila) for fila in lote] for lote in resultado.mappings().partitions(tamano_lote))
+                primero = next(lotes, [])
+                if len(primero) < tamano_lote:
+                    # Todo el resultado cupo en un lote: conexión y cupo se sueltan ya
+                    recursos.close()
+                    lotes = iter(())
+                yield None
+                for lote in itertools.chain([primero], lotes):
+                    filas += len(lote)
+                    if metricas.activa:
+                        bytes_ += _bytes_filas(lote)
+                    yield from lote
+            except Exception as e:
+                print(f"❌ Error leyendo query en streaming: {e}")
+                error = e
+                raise
+            finally:
+                # Incluye el tiempo del consumidor entre lotes: en consultas_lentas cuenta
+                # como lenta también una lectura que el cliente consumió despacio
+                self._registrar_lectura(
+                    "stream_rows", query, params, time.perf_counter() - inicio, filas, bytes_, error, consulta
+                )
+    
+    def _obtener_executor(self) -> ThreadPoolExecutor:
+        """Crea (si no existe) el pool de hilos donde corren las queries bloqueantes"""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="db-query"
+            )
+        return self.executor
+    
+    async def run_async(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Ejecuta una función bloqueante (query, método de EstadisticasQueries)
+        en el pool de hilos sin bloquear el event loop de FastAPI
+        
+        Args:
+            func: Función a ejecutar
+            *args, **kwargs: Argumentos para la función
+            
+        Returns:
+            El resultado de la función
+        """
+        loop = asyncio.get_running_loop()
+        # Se copia el contexto para que las contextvars lleguen al hilo (y, si la
+        # petición se está perfilando, el hilo entra en el perfil)
+        contexto = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._obtener_executor(),
+            partial(contexto.run, en_hilo, func, *args, **kwargs)
+        )
+    
+    async def gather(
+        self,
+        tareas: Dict[str, Callable[[], Any]],
+        max_concurrencia: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Ejecuta varias queries independientes de forma concurrente, cada una en
+        su propio hilo y con su propia conexión del pool
+        
+        Args:
+            tareas: Diccionario nombre -> función sin argumentos (usar functools.partial)
+            max_concurrencia: Límite de queries simultáneas (default: self.max_concurrencia)
+            
+        Returns:
+            Diccionario nombre -> resultado, con las mismas claves que `tareas`
+        """
+        semaforo = asyncio.Semaphore(max_concurrencia or self.max_concurrencia)
+        
+        async def _ejecutar(func: Callable[[], Any]) -> Any:
+            async with semaforo:
+                return await self.run_async(func)
+        
+        resultados = await asyncio.gather(*[_ejecutar(func) for func in tareas.values()])
+        return dict(zip(tareas.keys(), resultados))
+    
+    def verificar_conexion(self) -> bool:
+        """SELECT 1 por la conexión reservada para el health check"""
+        if self.engine_salud is None:
+            raise RuntimeError("Sin conexión a la base de datos")
+        with self.engine_salud.connect() as conn:
+            return conn.execute(text("SELECT 1")).scalar() == 1
+    
+    async def verificar_conexion_async(self) -> bool:
+        """
+        Health check: verificar_conexion en un hilo propio, sin pasar por el pool de
+        hilos de las queries ni por el semáforo de gather. Los chequeos simultáneos
+        comparten el que está en curso (si la base no responde no se apilan hilos)
+        
+        Returns:
+            True si la base respondió al SELECT 1
+            
+        Raises:
+            asyncio.TimeoutError: Si no respondió en `espera_salud` segundos
+        """
+        if self._executor_salud is None:
+            self._executor_salud = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-salud")
+        if self._salud_en_curso is None or self._salud_en_curso.done():
+            self._salud_en_curso = self._executor_salud.submit(self.verificar_conexion)
+        # shield: rendirse no cancela el chequeo que comparten otras peticiones
+        return await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(self._salud_en_curso)), self.espera_salud
+        )
+    
+    async def execute_query_async(self, query: str, params: Optional[dict] = None) -> pd.DataFrame:
+        """
+        Versión asíncrona de execute_query, ejecutada en el pool de hilos
+        
+        Args:
+            query: Query SQL a ejecutar
+            params: Parámetros para la query (opcional)
+            
+        Returns:
+            DataFrame con los resultados
+        """
+        return await self.run_async(self.execute_query, query, params)
     
     def close(self):
         """Cierra la conexión con la base de datos"""
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        if self._executor_salud:
+            self._executor_salud.shutdown(wait=False)
+            self._executor_salud = None
+            self._salud_en_curso = None
+        self.consultas_lentas.cerrar()
+        if self.engine_streams:
+            self.engine_streams.dispose()
+        if self.engine_salud:
+            self.engine_salud.dispose()
         if self.engine:
             self.engine.dispose()
             print("✅ Conexión cerrada")
@@ -1,88 +1,24 @@
 
 import os
+import time
 from datetime import datetime
 from jinja2 import Template
 import base64
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
 import pandas as pd
 
-class GeneradorReporte:
-    """Genera reportes HTML completos con estadísticas, gráficos y tablas"""
-    
-    def __init__(self, output_dir: str = "output"):
-        """
-        Inicializa el generador de reportes
-        
-        Args:
-            output_dir: Directorio donde se guardará el reporte
-        """
-        self.output_dir = output_dir
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-    
-    def imagen_a_base64(self, ruta_imagen: str) -> str:
-        """
-        Convierte una imagen a base64 para embeber en HTML
-        
-        Args:
-            ruta_imagen: Ruta de la imagen
-            
-        Returns:
-            String en formato base64
-        """
-        with open(ruta_imagen, 'rb') as img_file:
-            return base64.b64encode(img_file.read()).decode('utf-8')
-    
-    def dataframe_a_html(self, df: pd.DataFrame, table_id: str = "dataTable") -> str:
-        """
-        Convierte un DataFrame a tabla HTML con ID para DataTables
-        
-        Args:
-            df: DataFrame a convertir
-            table_id: ID de la tabla HTML
-            
-        Returns:
-            String con HTML de la tabla
-        """
-        return df.to_html(
-            index=False, 
-            classes='display compact',
-            table_id=table_id,
-            border=0
-        )
-    
-    def generar_reporte_completo(
-        self, 
-        graficos: Dict[str, str],
-        tablas: Dict[str, pd.DataFrame],
-        estadisticas_resumen: Dict[str, any],
-        titulo: str = "Reporte de Estadísticas Hospitalarias"
-    ) -> str:
-        """
-        Genera el reporte HTML completo con todos los elementos
-        
-        Args:
-            graficos: Diccionario con nombres y rutas de gráficos
-            tablas: Diccionario con nombres y DataFrames
-            estadisticas_resumen: Diccionario con estadísticas clave
-            titulo: Título principal del reporte
-            
-        Returns:
-            Ruta del archivo HTML generado
-        """
-        # Convertir gráficos a base64
-        graficos_base64 = {}
-        for nombre, ruta in graficos.items():
-            if os.path.exists(ruta):
-                graficos_base64[nombre] = self.imagen_a_base64(ruta)
-        
-        # Convertir tablas a HTML
-        tablas_html = {}
-        for nombre, df in tablas.items():
-            tablas_html[nombre] = self.dataframe_a_html(df, f"table_{nombre}")
-        
-        # Template HTML
-        html_template = """
+from metricas import metricas
+from trazas import registrar_tramo, tramo
+
+# Tamaño mínimo de cada trozo escrito al archivo o a la respuesta en modo streaming
+TAMANO_TROZO = 64 * 1024
+
+# Filas de cada DataFrame que se convierten a HTML de una vez en modo streaming
+FILAS_POR_PARTE = 2000
+
+# Template HTML del reporte. `graficos` y `tablas` son iterables perezosos: cada
+# imagen se pasa a base64 y cada tabla a HTML solo cuando el template llega a ella
+HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="es">
 <head>
@@ -320,10 +256,10 @@ class GeneradorReporte:
             <section class="seccion">
                 <h2 class="seccion-titulo">📈 Visualizaciones Gráficas</h2>
                 
-                {% for nombre, imagen_base64 in graficos.items() %}
+                {% for nombre, tipo_mime, imagen_base64 in graficos %}
                 <div class="grafico-contenedor">
                     <h3 class="grafico-titulo">{{ nombre }}</h3>
-                    <img src="data:image/png;base64,{{ imagen_base64 }}" alt="{{ nombre }}">
+                    <img src="data:{{ tipo_mime }};base64,{{ imagen_base64 }}" alt="{{ nombre }}">
                 </div>
                 {% endfor %}
             </section>
@@ -332,10 +268,10 @@ class GeneradorReporte:
             <section class="seccion">
                 <h2 class="seccion-titulo">📋 Datos Detallados</h2>
                 
-                {% for nombre, tabla_html in tablas.items() %}
+                {% for nombre, tabla_html in tablas %}
                 <div class="tabla-contenedor">
                     <h3 class="tabla-titulo">{{ nombre }}</h3>
-                    {{ tabla_html | safe }}
+                    {% for parte in tabla_html %}{{ parte | safe }}{% endfor %}
                 </div>
                 {% endfor %}
             </section>
@@ -372,22 +308,275 @@ class GeneradorReporte:
     </script>
 </body>
 </html>
+"""
+
+_plantilla = Template(HTML_TEMPLATE)
+
+class GeneradorReporte:
+    """Genera reportes HTML completos con estadísticas, gráficos y tablas"""
+    
+    def __init__(self, output_dir: str = "output"):
         """
+        Inicializa el generador de reportes
         
-        # Renderizar template
-        template = Template(html_template)
-        html_content = template.render(
-            titulo=titulo,
-            fecha_generacion=datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-            resumen=estadisticas_resumen,
-            graficos=graficos_base64,
-            tablas=tablas_html
+        Args:
+            output_dir: Directorio donde se guardará el reporte
+        """
+        self.output_dir = output_dir
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+    
+    def imagen_a_base64(self, ruta_imagen: str) -> str:
+        """
+        Convierte una imagen a base64 para embeber en HTML
+        
+        Args:
+            ruta_imagen: Ruta de la imagen
+            
+        Returns:
+            String en formato base64
+        """
+        with open(ruta_imagen, 'rb') as img_file:
+            return base64.b64encode(img_file.read()).decode('utf-8')
+    
+    def bytes_a_base64(self, contenido: bytes) -> str:
+        """
+        Convierte una imagen ya cargada en memoria a base64 para embeber en HTML
+        
+        Args:
+            contenido: Bytes de la imagen
+            
+        Returns:
+            String en formato base64
+        """
+        return base64.b64encode(contenido).decode('utf-8')
+    
+    def tipo_mime(self, imagen: Union[str, bytes]) -> str:
+        """
+        Detecta el tipo MIME de una imagen por su cabecera
+        
+        Args:
+            imagen: Ruta de la imagen o sus bytes
+            
+        Returns:
+            Tipo MIME para la URL data: del <img>
+        """
+        if isinstance(imagen, bytes):
+            cabecera = imagen[:256]
+        else:
+            with open(imagen, 'rb') as img_file:
+                cabecera = img_file.read(256)
+        
+        if cabecera.startswith(b'RIFF') and cabecera[8:12] == b'WEBP':
+            return "image/webp"
+        if cabecera.lstrip().startswith((b'<?xml', b'<svg')):
+            return "image/svg+xml"
+        return "image/png"
+    
+    def dataframe_a_html(self, df: pd.DataFrame, table_id: str = "dataTable") -> str:
+        """
+        Convierte un DataFrame a tabla HTML con ID para DataTables
+        
+        Args:
+            df: DataFrame a convertir
+            table_id: ID de la tabla HTML
+            
+        Returns:
+            String con HTML de la tabla
+        """
+        return df.to_html(
+            index=False, 
+            classes='display compact',
+            table_id=table_id,
+            border=0
         )
+    
+    def dataframe_a_html_por_partes(
+        self,
+        df: pd.DataFrame,
+        table_id: str = "dataTable",
+        filas_por_parte: int = FILAS_POR_PARTE
+    ) -> Iterator[str]:
+        """
+        Convierte un DataFrame a tabla HTML por bloques de filas, para no tener
+        en memoria el HTML de una tabla grande completa
         
-        # Guardar archivo HTML
-        output_path = os.path.join(self.output_dir, "reporte.html")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+        Args:
+            df: DataFrame a convertir
+            table_id: ID de la tabla HTML
+            filas_por_parte: Filas convertidas en cada bloque
+            
+        Yields:
+            Trozos consecutivos del HTML de la tabla
+        """
+        if len(df) <= filas_por_parte:
+            with tramo("reporte.tabla_html", filas=len(df)):
+                html = self.dataframe_a_html(df, table_id)
+            yield html
+            return
+        
+        # Cabecera con la misma forma que dataframe_a_html; las filas se insertan en <tbody>
+        apertura, cierre = self.dataframe_a_html(df.iloc[:0], table_id).split("<tbody>\n")
+        yield apertura + "<tbody>\n"
+        for inicio in range(0, len(df), filas_por_parte):
+            with tramo("reporte.tabla_html", filas=min(filas_por_parte, len(df) - inicio)):
+                bloque = df.iloc[inicio:inicio + filas_por_parte].to_html(index=False, header=False, border=0)
+            yield bloque[bloque.index("<tbody>\n") + len("<tbody>\n"):bloque.rindex("  </tbody>")]
+        yield cierre
+    
+    def generar_reporte_completo(
+        self, 
+        graficos: Dict[str, Union[str, bytes]],
+        tablas: Dict[str, pd.DataFrame],
+        estadisticas_resumen: Dict[str, any],
+        titulo: str = "Reporte de Estadísticas Hospitalarias",
+        nombre_archivo: str = "reporte.html"
+    ) -> str:
+        """
+        Genera el reporte HTML completo con todos los elementos
+        
+        Args:
+            graficos: Diccionario con nombres y rutas de gráficos (o sus bytes en memoria)
+            tablas: Diccionario con nombres y DataFrames
+            estadisticas_resumen: Diccionario con estadísticas clave
+            titulo: Título principal del reporte
+            nombre_archivo: Nombre del archivo (único por trabajo para no pisar otros reportes)
+            
+        Returns:
+            Ruta del archivo HTML generado
+        """
+        partes = self.generar_html_por_partes(graficos, tablas, estadisticas_resumen, titulo)
+        return self.guardar_html(partes, nombre_archivo)
+    
+    def guardar_html(self, html_content: Union[str, Iterable[str]], nombre_archivo: str = "reporte.html") -> str:
+        """
+        Escribe el HTML del reporte en output_dir
+        
+        Args:
+            html_content: HTML completo, o los trozos de generar_html_por_partes
+                (se escriben a medida que se producen, sin juntarlos en memoria)
+            nombre_archivo: Nombre del archivo (único por trabajo para no pisar otros reportes)
+            
+        Returns:
+            Ruta del archivo HTML generado
+        """
+        if isinstance(html_content, str):
+            html_content = [html_content]
+        
+        output_path = os.path.join(self.output_dir, nombre_archivo)
+        # Escritura atómica: una descarga nunca ve el archivo a medio escribir
+        temporal = output_path + ".tmp"
+        with metricas.medir_etapa("reporte", "guardar_html") as medicion:
+            try:
+                with open(temporal, 'w', encoding='utf-8') as f:
+                    for trozo in html_content:
+                        f.write(trozo)
+                os.replace(temporal, output_path)
+            except BaseException:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+                raise
+            medicion.bytes = os.path.getsize(output_path)
         
         print(f"✅ Reporte generado exitosamente: {output_path}")
         return output_path
+    
+    def construir_html(
+        self,
+        graficos: Dict[str, Union[str, bytes]],
+        tablas: Dict[str, pd.DataFrame],
+        estadisticas_resumen: Dict[str, any],
+        titulo: str = "Reporte de Estadísticas Hospitalarias"
+    ) -> str:
+        """
+        Construye el HTML del reporte en un solo string (para reportes grandes
+        es preferible generar_html_por_partes)
+        
+        Returns:
+            HTML completo del reporte
+        """
+        return "".join(self.generar_html_por_partes(graficos, tablas, estadisticas_resumen, titulo))
+    
+    def generar_html_por_partes(
+        self,
+        graficos: Dict[str, Union[str, bytes]],
+        tablas: Dict[str, pd.DataFrame],
+        estadisticas_resumen: Dict[str, any],
+        titulo: str = "Reporte de Estadísticas Hospitalarias"
+    ) -> Iterator[str]:
+        """
+        Renderiza el reporte en streaming con `Template.generate()`: produce
+        trozos de al menos TAMANO_TROZO caracteres, y cada imagen y tabla se
+        convierte justo cuando el template la necesita, así la memoria no
+        crece con el tamaño total del reporte
+        
+        Args:
+            graficos: Diccionario con nombres y rutas de gráficos (o sus bytes en memoria)
+            tablas: Diccionario con nombres y DataFrames
+            estadisticas_resumen: Diccionario con estadísticas clave
+            titulo: Título principal del reporte
+            
+        Yields:
+            Trozos consecutivos del HTML
+        
+        En las métricas, la etapa "html" cuenta solo el tiempo de producir los
+        trozos, no el que el consumidor tarda en escribirlos o enviarlos; en la
+        traza es un tramo "reporte.html" con esa duración desde el primer trozo.
+        """
+        inicio = primer_inicio = time.perf_counter()
+        ocupado = 0.0
+        total = 0
+        eventos = _plantilla.generate(
+            titulo=titulo,
+            fecha_generacion=datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+            resumen=estadisticas_resumen,
+            graficos=self._graficos_base64(graficos),
+            tablas=self._tablas_html(tablas)
+        )
+        
+        buffer: List[str] = []
+        acumulado = 0
+        error = False
+        try:
+            for evento in eventos:
+                buffer.append(evento)
+                acumulado += len(evento)
+                if acumulado >= TAMANO_TROZO:
+                    total += acumulado
+                    # El tiempo detenido en el yield es del consumidor
+                    ocupado += time.perf_counter() - inicio
+                    inicio = None
+                    yield "".join(buffer)
+                    inicio = time.perf_counter()
+                    buffer, acumulado = [], 0
+            if buffer:
+                total += acumulado
+                ocupado += time.perf_counter() - inicio
+                inicio = None
+                yield "".join(buffer)
+        except Exception:
+            error = True
+            raise
+        finally:
+            if inicio is not None:
+                ocupado += time.perf_counter() - inicio
+            # Caracteres del HTML: el reporte es casi todo ASCII (base64), así que ≈ bytes
+            metricas.registrar_etapa("reporte", "html", ocupado, total, error)
+            registrar_tramo("reporte.html", ocupado, inicio=primer_inicio, caracteres=total)
+    
+    def _graficos_base64(self, graficos: Dict[str, Union[str, bytes]]) -> Iterator[Tuple[str, str, str]]:
+        """Convierte cada gráfico a (nombre, tipo MIME, base64) a medida que se pide"""
+        for nombre, imagen in graficos.items():
+            if not isinstance(imagen, bytes) and not os.path.exists(imagen):
+                continue
+            with tramo("reporte.base64", grafico=nombre):
+                if isinstance(imagen, bytes):
+                    codificada = self.bytes_a_base64(imagen)
+                else:
+                    codificada = self.imagen_a_base64(imagen)
+            yield nombre, self.tipo_mime(imagen), codificada
+    
+    def _tablas_html(self, tablas: Dict[str, pd.DataFrame]) -> Iterator[Tuple[str, Iterator[str]]]:
+        """Convierte cada DataFrame a tabla HTML, por bloques de filas, a medida que se pide"""
+        for nombre, df in tablas.items():
+            yield nombre, self.dataframe_a_html_por_partes(df, f"table_{nombre}")
@@ -0,0 +1,194 @@
+"""
+indices.py - Migración de los índices que necesitan las consultas de estadísticas
+
+Cada índice se declara con la tabla, sus columnas y las queries de queries.py que
+lo usan. La migración solo crea los que faltan: si ya existe un índice con el mismo
+nombre, o cualquier otro cuyas primeras columnas coinciden, se da por cubierto.
+
+Es un paso de migración explícito: la API no toca el esquema al iniciar salvo
+con STATS_INDICES_AL_INICIAR=1.
+
+Uso:
+    python -m indices            # crea los índices que falten
+    python -m indices --dry-run  # solo muestra el DDL pendiente
+"""
+import argparse
+import os
+from typing import Dict, List, NamedTuple, Tuple
+
+from sqlalchemy import bindparam, text
+
+from database import db
+
+
+class Indice(NamedTuple):
+    """Índice requerido por las consultas"""
+    tabla: str
+    columnas: Tuple[str, ...]
+    motivo: str
+
+
+INDICES: Dict[str, Indice] = {
+    "idx_appointments_fecha_estado": Indice(
+        "appointments", ("fecha", "estado"),
+        "rangos de fecha (meses, desde/hasta, tendencia mensual) y conteos por estado"
+    ),
+    "idx_appointments_profesional_estado": Indice(
+        "appointments", ("professional_identificacion", "estado"),
+        "JOIN con medicos, semi-join de sede/especialidad y tasa de cancelación"
+    ),
+    "idx_appointments_usuario": Indice(
+        "appointments", ("user_id",),
+        "JOIN con users en pacientes activos, top de pacientes y promedio por paciente"
+    ),
+    "idx_appointments_hora": Indice(
+        "appointments", ("hora",),
+        "distribución de citas por hora y horarios pico sin recorrer la tabla"
+    ),
+    "idx_user_blocks_tipo_identificador": Indice(
+        "user_blocks", ("user_type", "user_identifier"),
+        "LEFT JOIN de bloqueos de pacientes y médicos"
+    ),
+    "idx_users_tipo_documento": Indice(
+        "users", ("tipo_documento",),
+        "distribución de pacientes por tipo de documento"
+    ),
+    "idx_medicos_sede_especialidad": Indice(
+        "medicos", ("sede_id", "especialidad"),
+        "JOIN de sedes con médicos y filtros de sede/especialidad"
+    ),
+    "idx_medicos_especialidad": Indice(
+        "medicos", ("especialidad",),
+        "agrupaciones y filtros por especialidad"
+    ),
+}
+
+
+def ddl_indice(nombre: str, indice: Indice) -> str:
+    """ALTER TABLE que crea el índice sin bloquear escrituras (InnoDB online DDL)"""
+    columnas = ", ".join(indice.columnas)
+    return f"ALTER TABLE {indice.tabla} ADD INDEX {nombre} ({columnas}), ALGORITHM=INPLACE, LOCK=NONE"
+
+
+class MigracionIndices:
+    """Crea los índices de INDICES que no existan todavía"""
+
+    def __init__(self, indices: Dict[str, Indice] = None, al_iniciar: bool = False):
+        """
+        Inicializa la migración
+
+        Args:
+            indices: Índices requeridos (default: INDICES)
+            al_iniciar: Si la API ejecuta instalar() al arrancar (ALTER TABLE en
+                cada inicio; por defecto la migración se corre a mano)
+        """
+        self.indices = indices if indices is not None else INDICES
+        self.al_iniciar = al_iniciar
+        self.creados: List[str] = []
+        self.cubiertos: Dict[str, str] = {}
+
+    def existentes(self) -> Dict[str, Dict[str, Tuple[str, ...]]]:
+        """
+        Lee de information_schema los índices actuales de las tablas involucradas
+
+        Returns:
+            tabla -> {nombre del índice -> columnas en orden}
+        """
+        tablas = sorted({indice.tabla for indice in self.indices.values()})
+        existentes: Dict[str, Dict[str, List[str]]] = {tabla: {} for tabla in tablas}
+        consulta = text(
+            "SELECT table_name, index_name, column_name FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE() AND table_name IN :tablas "
+            "ORDER BY table_name, index_name, seq_in_index"
+        ).bindparams(bindparam("tablas", expanding=True))
+        with db.engine.connect() as conn:
+            for tabla, nombre, columna in conn.execute(consulta, {"tablas": tablas}):
+                existentes[tabla].setdefault(nombre, []).append((columna or "").lower())
+        return {tabla: {n: tuple(c) for n, c in indices.items()} for tabla, indices in existentes.items()}
+
+    def pendientes(self) -> Dict[str, Indice]:
+        """
+        Índices requeridos que faltan (ni por nombre ni por un índice existente
+        que empiece por las mismas columnas)
+        """
+        existentes = self.existentes()
+        self.cubiertos = {}
+        pendientes = {}
+        for nombre, indice in self.indices.items():
+            actuales = existentes.get(indice.tabla, {})
+            if nombre in actuales:
+                continue
+            columnas = tuple(c.lower() for c in indice.columnas)
+            equivalente = next(
+                (n for n, cols in actuales.items() if cols[:len(columnas)] == columnas), None
+            )
+            if equivalente:
+                self.cubiertos[nombre] = equivalente
+                continue
+            pendientes[nombre] = indice
+        return pendientes
+
+    def instalar(self) -> List[str]:
+        """
+        Crea los índices pendientes
+
+        Returns:
+            Nombres de los índices creados
+        """
+        self.creados = []
+        try:
+            pendientes = self.pendientes()
+        except Exception as e:
+            print(f"⚠️ No se pudieron leer los índices existentes: {e}")
+            return self.creados
+        for nombre, indice in pendientes.items():
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(text(ddl_indice(nombre, indice)))
+                self.creados.append(nombre)
+                print(f"✅ Índice {nombre} creado en {indice.tabla}({', '.join(indice.columnas)})")
+            except Exception as e:
+                print(f"⚠️ No se pudo crear el índice {nombre}: {e}")
+        return self.creados
+
+    def estado(self) -> dict:
+        """Retorna el estado de los índices requeridos para diagnóstico"""
+        pendientes = self.pendientes()
+        return {
+            "al_iniciar": self.al_iniciar,
+            "requeridos": {
+                nombre: {"tabla": i.tabla, "columnas": list(i.columnas), "motivo": i.motivo}
+                for nombre, i in self.indices.items()
+            },
+            "pendientes": sorted(pendientes),
+            "cubiertos_por": self.cubiertos,
+            "creados": self.creados,
+        }
+
+
+# Instancia global para usar en toda la aplicación
+indices = MigracionIndices(al_iniciar=os.getenv("STATS_INDICES_AL_INICIAR", "0") == "1")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crea los índices que usan las consultas de estadísticas")
+    parser.add_argument("--dry-run", action="store_true", help="Solo muestra el DDL pendiente")
+    args = parser.parse_args()
+
+    if not db.connect():
+        raise SystemExit(1)
+    if args.dry_run:
+        pendientes = indices.pendientes()
+        for nombre, equivalente in indices.cubiertos.items():
+            print(f"-- {nombre}: cubierto por {equivalente}")
+        for nombre, indice in pendientes.items():
+            print(f"{ddl_indice(nombre, indice)};  -- {indice.motivo}")
+        if not pendientes:
+            print("-- No hay índices pendientes")
+    else:
+        indices.instalar()
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
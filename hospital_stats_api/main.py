@@ -1,16 +1,36 @@
 """
 main.py - API FastAPI para el sistema de estadísticas hospitalarias
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 import os
-from datetime import datetime
+import asyncio
+import hmac
+import time
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from functools import partial
+from typing import Callable, Optional, Dict, Tuple
 
-from database import db
-from queries import EstadisticasQueries
-from visualizacion import VisualizadorEstadisticas
+from database import db, StreamsAgotados
+from cache import cache_estadisticas
+from cache_graficos import cache_graficos
+from queries import EstadisticasQueries, Filtros, SIN_FILTROS
+from rollups import rollups
+from indices import indices
+from metricas import metricas
+from trazas import trazador, tramo, MiddlewareTrazas
+from perfilador import perfilador, perfilando, MiddlewarePerfilador
+from visualizacion import VisualizadorEstadisticas, PERFILES_RENDER, PERFILES_AUTO
 from generador_reporte import GeneradorReporte
+from trabajos import cola_reportes, ColaLlena, Trabajo, COMPLETADO
+from respuestas import (
+    elegir_codificacion, etag_variante, coincide_etag, hash_archivo,
+    precomprimir_archivo, parsear_rango, leer_rango, responder_json, columnar,
+    codificar_cursor, decodificar_cursor, lineas_ndjson
+)
 
 # Inicializar FastAPI
 app = FastAPI(
@@ -28,9 +48,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Server-Timing (y archivo de traza opcional) en las peticiones de estadísticas y reportes
+app.add_middleware(MiddlewareTrazas, trazador=trazador)
+# ?profile=1 con X-Admin-Token: responde el perfil de la petición en lugar de los datos
+app.add_middleware(MiddlewarePerfilador, perfilador=perfilador)
+
 # Instanciar clases
-visualizador = VisualizadorEstadisticas(output_dir="output")
+visualizador = VisualizadorEstadisticas(
+    output_dir="output",
+    cache=cache_graficos,
+    en_memoria=True,
+    copia_en_disco=os.getenv("STATS_GRAFICOS_EN_DISCO", "0") == "1"
+)
 generador = GeneradorReporte(output_dir="output")
+
+# Perfil de imágenes del reporte ("auto" elige el primero que cabe en el presupuesto)
+PERFIL_RENDER = os.getenv("STATS_PERFIL_RENDER", "alta")
+PRESUPUESTO_REPORTE_KB = int(os.getenv("STATS_PRESUPUESTO_REPORTE_KB", "0")) or None
+PATRON_PERFIL = "^(auto|" + "|".join(PERFILES_RENDER) + ")$"
+# El streaming no puede medir el reporte antes de enviarlo: usa un perfil fijo
+PERFIL_STREAMING = PERFIL_RENDER if PERFIL_RENDER != "auto" else PERFILES_AUTO[0]
+PATRON_PERFIL_FIJO = "^(" + "|".join(PERFILES_RENDER) + ")$"
+TITULO_REPORTE = "Reporte de Estadísticas Hospitalarias"
+# Token que exigen los endpoints de administración en X-Admin-Token (sin él, quedan deshabilitados)
+ADMIN_TOKEN = os.getenv("STATS_ADMIN_TOKEN")
 queries = EstadisticasQueries()
 
 @app.on_event("startup")
@@ -38,14 +79,45 @@ async def startup():
     """Conectar a la base de datos al iniciar"""
     if not db.connect():
         raise Exception("No se pudo conectar a la base de datos")
+    if indices.al_iniciar:
+        await db.run_async(indices.instalar)
+    # El esquema del rollup se crea con `python -m rollups`; aquí solo se detecta
+    instalar_rollups = rollups.instalar if rollups.al_iniciar else rollups.detectar
+    if rollups.activo and await db.run_async(instalar_rollups):
+        app.state.tarea_rollups = asyncio.create_task(_refrescar_rollups_periodicamente())
     print("🚀 API de estadísticas iniciada correctamente")
 
 @app.on_event("shutdown")
 async def shutdown():
     """Cerrar conexión a la base de datos"""
+    tarea_rollups = getattr(app.state, "tarea_rollups", None)
+    if tarea_rollups:
+        tarea_rollups.cancel()
+    cola_reportes.cerrar()
+    visualizador.cerrar()
     db.close()
     print("👋 API de estadísticas detenida")
 
+async def _refrescar_rollups_periodicamente():
+    """Refresca los rollups de citas cada `rollups.intervalo` segundos"""
+    while True:
+        try:
+            cortes = await db.run_async(rollups.refrescar)
+            if cortes:
+                print(f"🔄 Rollups de citas refrescados ({'completo' if cortes < 0 else f'{cortes} cortes'})")
+        except Exception as e:
+            print(f"⚠️ Error refrescando rollups: {e}")
+        await asyncio.sleep(rollups.intervalo)
+
+def _verificar_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Exige X-Admin-Token igual a STATS_ADMIN_TOKEN; sin la variable, responde 403"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=403, detail="Endpoints de administración deshabilitados (definir STATS_ADMIN_TOKEN)"
+        )
+    if not hmac.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Token de administración inválido")
+
 # ==================== ENDPOINTS DE ESTADÍSTICAS ====================
 
 @app.get("/")
@@ -57,256 +129,755 @@ async def root():
         "endpoints": {
             "estadisticas": "/api/estadisticas",
             "pacientes": "/api/estadisticas/pacientes",
+            "pacientes_activos": "/api/estadisticas/pacientes/activos",
             "medicos": "/api/estadisticas/medicos",
+            "tasa_cancelacion": "/api/estadisticas/medicos/tasa_cancelacion",
             "sedes": "/api/estadisticas/sedes",
             "citas": "/api/estadisticas/citas",
-            "generar_reporte": "/api/reporte/generar"
+            "generar_reporte": "/api/reporte/generar",
+            "estado_reporte": "/api/reporte/{job_id}",
+            "cache": "/api/cache/estadisticas"
         }
     }
 
-@app.get("/api/estadisticas")
-async def obtener_estadisticas_completas():
+# Modo de cálculo de los agregados de citas: 'individual' (una query por
+# estadística) o 'fusionado' (un solo recorrido de appointments)
+MODO_AGREGACION = os.getenv("STATS_MODO_AGREGACION", "individual")
+
+def _tareas_agregados_citas(nombres: Dict[str, str], modo: str, meses: int = 12,
+                            filtros: Filtros = SIN_FILTROS) -> dict:
     """
-    Retorna todas las estadísticas en formato JSON
+    Arma las tareas de db.gather para los agregados de citas
+    
+    Args:
+        nombres: Clave en el resultado -> método de EstadisticasQueries
+        modo: 'individual' o 'fusionado'
+        meses: Meses de la tendencia mensual
+        filtros: Alcance de las citas
+    """
+    if modo == "fusionado":
+        return {"_fusionadas": partial(queries.estadisticas_citas_fusionadas, meses=meses, filtros=filtros)}
+    return {
+        clave: partial(getattr(queries, metodo), meses=meses, filtros=filtros)
+        if metodo == "tendencia_citas_por_mes" else partial(getattr(queries, metodo), filtros=filtros)
+        for clave, metodo in nombres.items()
+    }
+
+def _repartir_fusionadas(resultados: dict, nombres: Dict[str, str]) -> dict:
+    """Reparte el resultado de la query fusionada en las claves esperadas por el endpoint"""
+    fusionadas = resultados.pop("_fusionadas", None)
+    if fusionadas is not None:
+        for clave, metodo in nombres.items():
+            resultados[clave] = fusionadas[metodo]
+    return resultados
+
+def _tabla(df, formato: str):
+    """Convierte un DataFrame al formato de respuesta pedido ('records' o 'columnar')"""
+    return columnar(df) if formato == "columnar" else df.to_dict('records')
+
+# Parámetro ?format= de los endpoints de estadísticas
+FORMATO_RESPUESTA = Query("records", alias="format", pattern="^(records|columnar)$")
+
+def _filtros(
+    desde: Optional[date] = Query(None, description="Citas desde esta fecha (inclusive)"),
+    hasta: Optional[date] = Query(None, description="Citas hasta esta fecha (inclusive)"),
+    sede_id: Optional[int] = Query(None, description="Solo médicos y citas de esta sede"),
+    especialidad: Optional[str] = Query(None, max_length=100, description="Solo esta especialidad")
+) -> Filtros:
+    """Parámetros de alcance comunes a las estadísticas y al reporte"""
+    if desde and hasta and desde > hasta:
+        raise HTTPException(status_code=400, detail="`desde` no puede ser posterior a `hasta`")
+    return Filtros(desde, hasta, sede_id, especialidad)
+
+# Paginación por keyset de los listados (?limit=&cursor=)
+LIMITE_PAGINA = int(os.getenv("STATS_LIMITE_PAGINA", "100"))
+MAX_LIMITE_PAGINA = 10000
+LIMITE_LISTADO = Query(LIMITE_PAGINA, ge=1, le=MAX_LIMITE_PAGINA)
+# Los listados aceptan además ndjson: todas las filas desde el cursor, en streaming
+FORMATO_LISTADO = Query("records", alias="format", pattern="^(records|columnar|ndjson)$")
+
+def _armar_pagina(r: dict, formato: str = "records") -> dict:
+    """Construye el JSON de una página de un listado"""
+    return {
+        "items": _tabla(r["filas"], formato),
+        "siguiente_cursor": codificar_cursor(r["siguiente_cursor"])
+    }
+
+def _cursor_pacientes(cursor: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Decodifica el cursor (total_citas, user_id) de pacientes activos; 400 si no es válido"""
+    try:
+        valores = decodificar_cursor(cursor)
+        return None if valores is None else (int(valores[0]), valores[1])
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Cursor inválido: {cursor}") from e
+
+def _cursor_medicos(cursor: Optional[str]) -> Optional[Tuple[Decimal, str]]:
+    """Decodifica el cursor (tasa_cancelacion, identificacion) de médicos; 400 si no es válido"""
+    try:
+        valores = decodificar_cursor(cursor)
+        return None if valores is None else (Decimal(str(valores[0])), valores[1])
+    except (ValueError, TypeError, InvalidOperation) as e:
+        raise HTTPException(status_code=400, detail=f"Cursor inválido: {cursor}") from e
+
+async def _ndjson(iterar: Callable, **kwargs) -> StreamingResponse:
+    """
+    Respuesta NDJSON en streaming; la memoria no depende del número de filas.
+    `iterar` ejecuta la query en un hilo antes de responder; 503 si ya están
+    abiertas todas las lecturas en streaming.
     """
     try:
-        # Pacientes
-        total_pacientes = queries.total_pacientes_registrados()
-        pacientes_activos_df = queries.pacientes_activos(meses=6)
-        promedio_citas_paciente = queries.promedio_citas_por_paciente()
-        distribucion_doc = queries.distribucion_tipo_documento()
-        pacientes_blocks = queries.pacientes_bloqueados_vs_activos()
+        filas = await db.run_async(iterar, **kwargs)
+    except StreamsAgotados as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    return StreamingResponse(lineas_ndjson(filas), media_type="application/x-ndjson")
+
+AGREGADOS_COMPLETAS = {
+    "distribucion_horarios": "distribucion_citas_por_hora",
+    "citas_sedes": "total_citas_por_sede",
+    "especialidades_sedes": "especialidades_por_sede",
+    "citas_estado": "citas_por_estado",
+    "tendencia_citas": "tendencia_citas_por_mes",
+    "especialidades_demandadas": "especialidades_mas_demandadas",
+    "horarios_pico": "horarios_pico",
+}
+
+async def _resultados_completas(modo: str = MODO_AGREGACION, filtros: Filtros = SIN_FILTROS) -> dict:
+    """Lanza en paralelo las 16 queries independientes del dashboard completo"""
+    r = await db.gather({
+        # Pacientes (el registro y los bloqueos de pacientes no dependen del alcance)
+        "total_pacientes": queries.total_pacientes_registrados,
+        "pacientes_activos": partial(queries.total_pacientes_activos, meses=6, filtros=filtros),
+        "promedio_citas_paciente": partial(queries.promedio_citas_por_paciente, filtros=filtros),
+        "distribucion_doc": queries.distribucion_tipo_documento,
+        "pacientes_blocks": queries.pacientes_bloqueados_vs_activos,
         
         # Médicos
-        medicos_especialidad = queries.total_medicos_por_especialidad()
-        medicos_top = queries.medicos_mas_solicitados(limit=10)
-        tasa_cancelacion = queries.tasa_cancelacion_por_medico()
-        distribucion_horarios = queries.distribucion_citas_por_hora()
-        medicos_blocks = queries.medicos_bloqueados_vs_activos()
+        "medicos_especialidad": partial(queries.total_medicos_por_especialidad, filtros=filtros),
+        "medicos_top": partial(queries.medicos_mas_solicitados, limit=10, filtros=filtros),
+        "tasa_cancelacion": partial(queries.tasa_cancelacion_por_medico, filtros=filtros),
+        "medicos_blocks": partial(queries.medicos_bloqueados_vs_activos, filtros=filtros),
         
-        # Sedes
-        citas_sedes = queries.total_citas_por_sede()
-        especialidades_sedes = queries.especialidades_por_sede()
-        
-        # Citas
-        citas_estado = queries.citas_por_estado()
-        tendencia_citas = queries.tendencia_citas_por_mes(meses=12)
-        especialidades_demandadas = queries.especialidades_mas_demandadas()
-        horarios_pico = queries.horarios_pico()
-        
-        return JSONResponse({
-            "pacientes": {
-                "total": total_pacientes,
-                "activos": len(pacientes_activos_df),
-                "promedio_citas": round(promedio_citas_paciente, 2),
-                "distribucion_documento": distribucion_doc.to_dict('records'),
-                "bloqueados": pacientes_blocks['bloqueados'],
-                "activos_count": pacientes_blocks['activos']
-            },
-            "medicos": {
-                "por_especialidad": medicos_especialidad.to_dict('records'),
-                "top_10": medicos_top.to_dict('records'),
-                "tasa_cancelacion": tasa_cancelacion.to_dict('records'),
-                "distribucion_horarios": distribucion_horarios.to_dict('records'),
-                "bloqueados": medicos_blocks['bloqueados'],
-                "activos": medicos_blocks['activos']
-            },
-            "sedes": {
-                "citas_por_sede": citas_sedes.to_dict('records'),
-                "especialidades_por_sede": especialidades_sedes.to_dict('records')
-            },
-            "citas": {
-                "por_estado": citas_estado.to_dict('records'),
-                "tendencia_mensual": tendencia_citas.to_dict('records'),
-                "especialidades_demandadas": especialidades_demandadas.to_dict('records'),
-                "horarios_pico": horarios_pico.to_dict('records')
-            },
-            "timestamp": datetime.now().isoformat()
-        })
+        # Sedes y citas (agregados sobre appointments)
+        **_tareas_agregados_citas(AGREGADOS_COMPLETAS, modo, filtros=filtros),
+    })
+    return _repartir_fusionadas(r, AGREGADOS_COMPLETAS)
+
+def _armar_completas(r: dict, formato: str = "records") -> dict:
+    """Construye el JSON del dashboard completo a partir de los resultados"""
+    return {
+        "pacientes": {
+            "total": r["total_pacientes"],
+            "activos": r["pacientes_activos"],
+            "promedio_citas": round(r["promedio_citas_paciente"], 2),
+            "distribucion_documento": _tabla(r["distribucion_doc"], formato),
+            "bloqueados": r["pacientes_blocks"]['bloqueados'],
+            "activos_count": r["pacientes_blocks"]['activos']
+        },
+        "medicos": {
+            "por_especialidad": _tabla(r["medicos_especialidad"], formato),
+            "top_10": _tabla(r["medicos_top"], formato),
+            "tasa_cancelacion": _tabla(r["tasa_cancelacion"], formato),
+            "distribucion_horarios": _tabla(r["distribucion_horarios"], formato),
+            "bloqueados": r["medicos_blocks"]['bloqueados'],
+            "activos": r["medicos_blocks"]['activos']
+        },
+        "sedes": {
+            "citas_por_sede": _tabla(r["citas_sedes"], formato),
+            "especialidades_por_sede": _tabla(r["especialidades_sedes"], formato)
+        },
+        "citas": {
+            "por_estado": _tabla(r["citas_estado"], formato),
+            "tendencia_mensual": _tabla(r["tendencia_citas"], formato),
+            "especialidades_demandadas": _tabla(r["especialidades_demandadas"], formato),
+            "horarios_pico": _tabla(r["horarios_pico"], formato)
+        }
+    }
+
+@app.get("/api/estadisticas")
+async def obtener_estadisticas_completas(
+    request: Request,
+    modo: str = Query(MODO_AGREGACION, pattern="^(individual|fusionado)$"),
+    formato: str = FORMATO_RESPUESTA,
+    filtros: Filtros = Depends(_filtros)
+):
+    """
+    Retorna todas las estadísticas en formato JSON
+    """
+    try:
+        return responder_json(
+            request, await _resultados_completas(modo, filtros), partial(_armar_completas, formato=formato)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo estadísticas: {str(e)}")
 
+async def _resultados_pacientes(filtros: Filtros = SIN_FILTROS) -> dict:
+    """Lanza en paralelo las queries de estadísticas de pacientes"""
+    return await db.gather({
+        "total": queries.total_pacientes_registrados,
+        "activos": partial(queries.pagina_pacientes_activos, meses=6, limit=LIMITE_PAGINA, filtros=filtros),
+        "promedio_citas": partial(queries.promedio_citas_por_paciente, filtros=filtros),
+        "distribucion_documento": queries.distribucion_tipo_documento,
+        "bloqueados_vs_activos": queries.pacientes_bloqueados_vs_activos,
+        "top_10_mas_citas": partial(queries.top_pacientes_mas_citas, limit=10, filtros=filtros),
+    })
+
+def _armar_pacientes(r: dict, formato: str = "records") -> dict:
+    """Construye el JSON de estadísticas de pacientes"""
+    return {
+        "total": r["total"],
+        "activos": _tabla(r["activos"]["filas"], formato),
+        "activos_siguiente_cursor": codificar_cursor(r["activos"]["siguiente_cursor"]),
+        "promedio_citas": round(r["promedio_citas"], 2),
+        "distribucion_documento": _tabla(r["distribucion_documento"], formato),
+        "bloqueados_vs_activos": r["bloqueados_vs_activos"],
+        "top_10_mas_citas": _tabla(r["top_10_mas_citas"], formato)
+    }
+
 @app.get("/api/estadisticas/pacientes")
-async def obtener_estadisticas_pacientes():
+async def obtener_estadisticas_pacientes(
+    request: Request,
+    formato: str = FORMATO_RESPUESTA,
+    filtros: Filtros = Depends(_filtros)
+):
     """Retorna estadísticas específicas de pacientes"""
     try:
-        return JSONResponse({
-            "total": queries.total_pacientes_registrados(),
-            "activos": queries.pacientes_activos(meses=6).to_dict('records'),
-            "promedio_citas": round(queries.promedio_citas_por_paciente(), 2),
-            "distribucion_documento": queries.distribucion_tipo_documento().to_dict('records'),
-            "bloqueados_vs_activos": queries.pacientes_bloqueados_vs_activos(),
-            "top_10_mas_citas": queries.top_pacientes_mas_citas(limit=10).to_dict('records')
-        })
+        return responder_json(
+            request, await _resultados_pacientes(filtros), partial(_armar_pacientes, formato=formato)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+@app.get("/api/estadisticas/pacientes/activos")
+async def listar_pacientes_activos(
+    request: Request,
+    meses: int = Query(6, ge=1, le=120),
+    limit: int = LIMITE_LISTADO,
+    cursor: Optional[str] = None,
+    formato: str = FORMATO_LISTADO,
+    filtros: Filtros = Depends(_filtros)
+):
+    """
+    Lista los pacientes con citas en los últimos `meses`, de más a menos citas,
+    por páginas de `limit` (el cursor de la siguiente viene en `siguiente_cursor`).
+    Con format=ndjson envía todas las filas desde el cursor en streaming.
+    """
+    clave = _cursor_pacientes(cursor)
+    if formato == "ndjson":
+        return await _ndjson(queries.iterar_pacientes_activos, meses=meses, cursor=clave, filtros=filtros)
+    try:
+        pagina = await db.run_async(
+            queries.pagina_pacientes_activos, meses=meses, limit=limit, cursor=clave, filtros=filtros
+        )
+        return responder_json(request, pagina, partial(_armar_pagina, formato=formato))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+async def _resultados_medicos(filtros: Filtros = SIN_FILTROS) -> dict:
+    """Lanza en paralelo las queries de estadísticas de médicos"""
+    return await db.gather({
+        "por_especialidad": partial(queries.total_medicos_por_especialidad, filtros=filtros),
+        "promedio_citas_mensual": partial(queries.promedio_citas_medico, periodo='mensual', filtros=filtros),
+        "mas_solicitados": partial(queries.medicos_mas_solicitados, limit=10, filtros=filtros),
+        "tasa_cancelacion": partial(queries.pagina_tasa_cancelacion, limit=LIMITE_PAGINA, filtros=filtros),
+        "distribucion_horarios": partial(queries.distribucion_citas_por_hora, filtros=filtros),
+        "bloqueados_vs_activos": partial(queries.medicos_bloqueados_vs_activos, filtros=filtros),
+    })
+
+def _armar_medicos(r: dict, formato: str = "records") -> dict:
+    """Construye el JSON de estadísticas de médicos"""
+    return {
+        "por_especialidad": _tabla(r["por_especialidad"], formato),
+        "promedio_citas_mensual": _tabla(r["promedio_citas_mensual"], formato),
+        "mas_solicitados": _tabla(r["mas_solicitados"], formato),
+        "tasa_cancelacion": _tabla(r["tasa_cancelacion"]["filas"], formato),
+        "tasa_cancelacion_siguiente_cursor": codificar_cursor(r["tasa_cancelacion"]["siguiente_cursor"]),
+        "distribucion_horarios": _tabla(r["distribucion_horarios"], formato),
+        "bloqueados_vs_activos": r["bloqueados_vs_activos"]
+    }
+
 @app.get("/api/estadisticas/medicos")
-async def obtener_estadisticas_medicos():
+async def obtener_estadisticas_medicos(
+    request: Request,
+    formato: str = FORMATO_RESPUESTA,
+    filtros: Filtros = Depends(_filtros)
+):
     """Retorna estadísticas específicas de médicos"""
     try:
-        return JSONResponse({
-            "por_especialidad": queries.total_medicos_por_especialidad().to_dict('records'),
-            "promedio_citas_mensual": queries.promedio_citas_medico(periodo='mensual').to_dict('records'),
-            "mas_solicitados": queries.medicos_mas_solicitados(limit=10).to_dict('records'),
-            "tasa_cancelacion": queries.tasa_cancelacion_por_medico().to_dict('records'),
-            "distribucion_horarios": queries.distribucion_citas_por_hora().to_dict('records'),
-            "bloqueados_vs_activos": queries.medicos_bloqueados_vs_activos()
-        })
+        return responder_json(
+            request, await _resultados_medicos(filtros), partial(_armar_medicos, formato=formato)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@app.get("/api/estadisticas/medicos/tasa_cancelacion")
+async def listar_tasa_cancelacion(
+    request: Request,
+    limit: int = LIMITE_LISTADO,
+    cursor: Optional[str] = None,
+    formato: str = FORMATO_LISTADO,
+    filtros: Filtros = Depends(_filtros)
+):
+    """
+    Lista la tasa de cancelación de los médicos con citas, de mayor a menor,
+    por páginas de `limit` (el cursor de la siguiente viene en `siguiente_cursor`).
+    Con format=ndjson envía todas las filas desde el cursor en streaming.
+    """
+    clave = _cursor_medicos(cursor)
+    if formato == "ndjson":
+        return await _ndjson(queries.iterar_tasa_cancelacion, cursor=clave, filtros=filtros)
+    try:
+        pagina = await db.run_async(queries.pagina_tasa_cancelacion, limit=limit, cursor=clave, filtros=filtros)
+        return responder_json(request, pagina, partial(_armar_pagina, formato=formato))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+async def _resultados_sedes(filtros: Filtros = SIN_FILTROS) -> dict:
+    """Lanza en paralelo las queries de estadísticas de sedes"""
+    return await db.gather({
+        "citas_por_sede": partial(queries.total_citas_por_sede, filtros=filtros),
+        "especialidades_por_sede": partial(queries.especialidades_por_sede, filtros=filtros),
+    })
+
+def _armar_sedes(r: dict, formato: str = "records") -> dict:
+    """Construye el JSON de estadísticas de sedes"""
+    return {
+        "citas_por_sede": _tabla(r["citas_por_sede"], formato),
+        "especialidades_por_sede": _tabla(r["especialidades_por_sede"], formato)
+    }
+
 @app.get("/api/estadisticas/sedes")
-async def obtener_estadisticas_sedes():
+async def obtener_estadisticas_sedes(
+    request: Request,
+    formato: str = FORMATO_RESPUESTA,
+    filtros: Filtros = Depends(_filtros)
+):
     """Retorna estadísticas específicas de sedes"""
     try:
-        return JSONResponse({
-            "citas_por_sede": queries.total_citas_por_sede().to_dict('records'),
-            "especialidades_por_sede": queries.especialidades_por_sede().to_dict('records')
-        })
+        return responder_json(
+            request, await _resultados_sedes(filtros), partial(_armar_sedes, formato=formato)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+AGREGADOS_CITAS = {
+    "por_estado": "citas_por_estado",
+    "tendencia_12_meses": "tendencia_citas_por_mes",
+    "especialidades_demandadas": "especialidades_mas_demandadas",
+    "horarios_pico": "horarios_pico",
+}
+
+async def _resultados_citas(modo: str = MODO_AGREGACION, filtros: Filtros = SIN_FILTROS) -> dict:
+    """Lanza en paralelo las queries de estadísticas de citas"""
+    r = await db.gather(_tareas_agregados_citas(AGREGADOS_CITAS, modo, filtros=filtros))
+    return _repartir_fusionadas(r, AGREGADOS_CITAS)
+
+def _armar_citas(r: dict, formato: str = "records") -> dict:
+    """Construye el JSON de estadísticas de citas"""
+    return {
+        "por_estado": _tabla(r["por_estado"], formato),
+        "tendencia_12_meses": _tabla(r["tendencia_12_meses"], formato),
+        "especialidades_demandadas": _tabla(r["especialidades_demandadas"], formato),
+        "horarios_pico": _tabla(r["horarios_pico"], formato)
+    }
+
 @app.get("/api/estadisticas/citas")
-async def obtener_estadisticas_citas():
+async def obtener_estadisticas_citas(
+    request: Request,
+    modo: str = Query(MODO_AGREGACION, pattern="^(individual|fusionado)$"),
+    formato: str = FORMATO_RESPUESTA,
+    filtros: Filtros = Depends(_filtros)
+):
     """Retorna estadísticas específicas de citas"""
     try:
-        return JSONResponse({
-            "por_estado": queries.citas_por_estado().to_dict('records'),
-            "tendencia_12_meses": queries.tendencia_citas_por_mes(meses=12).to_dict('records'),
-            "especialidades_demandadas": queries.especialidades_mas_demandadas().to_dict('records'),
-            "horarios_pico": queries.horarios_pico().to_dict('records')
-        })
+        return responder_json(
+            request, await _resultados_citas(modo, filtros), partial(_armar_citas, formato=formato)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 # ==================== ENDPOINT DE GENERACIÓN DE REPORTE ====================
 
-@app.post("/api/reporte/generar")
-async def generar_reporte_html():
-    """
-    Genera el reporte HTML completo con gráficos y tablas
-    Cumple con requisitos del profesor
+def _datos_reporte(
+    avanzar: Callable[[int, str], None] = lambda progreso, etapa: None,
+    filtros: Filtros = SIN_FILTROS
+) -> Tuple[dict, dict, dict]:
     """
-    try:
-        print("📊 Iniciando generación de reporte...")
+    Obtiene los datos del reporte y prepara sus gráficos, tablas y resumen (bloqueante)
+    
+    Args:
+        avanzar: Función que recibe el progreso (0-50) y la etapa actual
+        filtros: Alcance de las estadísticas del reporte
         
-        # 1. Obtener datos
-        print("  - Obteniendo datos de la base de datos...")
-        especialidades_df = queries.especialidades_mas_demandadas()
-        tendencia_df = queries.tendencia_citas_por_mes(meses=12)
-        medicos_top_df = queries.medicos_mas_solicitados(limit=10)
-        horarios_df = queries.distribucion_citas_por_hora()
+    Returns:
+        (tareas de gráficos para renderizar_en_paralelo, tablas, resumen)
+    """
+    # 1. Obtener datos
+    avanzar(5, "Obteniendo datos de la base de datos")
+    with tramo("reporte.consultas"):
+        if MODO_AGREGACION == "fusionado":
+            fusionadas = queries.estadisticas_citas_fusionadas(meses=12, filtros=filtros)
+            especialidades_df = fusionadas['especialidades_mas_demandadas']
+            tendencia_df = fusionadas['tendencia_citas_por_mes']
+            horarios_df = fusionadas['distribucion_citas_por_hora']
+            sedes_df = fusionadas['total_citas_por_sede']
+            especialidades_sedes_df = fusionadas['especialidades_por_sede']
+            citas_estado = fusionadas['citas_por_estado']
+        else:
+            especialidades_df = queries.especialidades_mas_demandadas(filtros=filtros)
+            tendencia_df = queries.tendencia_citas_por_mes(meses=12, filtros=filtros)
+            horarios_df = queries.distribucion_citas_por_hora(filtros=filtros)
+            sedes_df = queries.total_citas_por_sede(filtros=filtros)
+            especialidades_sedes_df = queries.especialidades_por_sede(filtros=filtros)
+            citas_estado = queries.citas_por_estado(filtros=filtros)
+        medicos_top_df = queries.medicos_mas_solicitados(limit=10, filtros=filtros)
         tipo_doc_df = queries.distribucion_tipo_documento()
-        sedes_df = queries.total_citas_por_sede()
-        especialidades_sedes_df = queries.especialidades_por_sede()
-        
+    
         # Tabla principal de médicos con métricas completas
-        medicos_metricas_df = queries.tasa_cancelacion_por_medico()
-        
-        # 2. Generar gráficos
-        print("  - Generando gráficos...")
-        graficos = {}
-        
-        if not especialidades_df.empty:
-            graficos['Citas por Especialidad'] = visualizador.graficar_citas_por_especialidad(
-                especialidades_df, "citas_especialidad.png"
-            )
-        
-        if not tendencia_df.empty:
-            graficos['Evolución Temporal de Citas'] = visualizador.graficar_citas_temporales(
-                tendencia_df, "citas_temporales.png"
-            )
-        
-        if not medicos_top_df.empty:
-            graficos['Top 10 Médicos Más Solicitados'] = visualizador.graficar_medicos_top(
-                medicos_top_df, "top_medicos.png", top_n=10
-            )
-        
-        if not horarios_df.empty:
-            graficos['Distribución de Citas por Hora'] = visualizador.graficar_distribucion_horarios(
-                horarios_df, "distribucion_horarios.png"
-            )
-        
-        if not tipo_doc_df.empty:
-            graficos['Distribución de Pacientes por Tipo de Documento'] = visualizador.graficar_pacientes_por_tipo_doc(
-                tipo_doc_df, "tipo_documento.png"
-            )
-        
-        if not sedes_df.empty:
-            graficos['Comparativa de Sedes'] = visualizador.graficar_comparativa_sedes(
-                sedes_df, "comparativa_sedes.png"
-            )
-        
-        if not especialidades_sedes_df.empty:
-            graficos['Heatmap de Especialidades por Sede'] = visualizador.graficar_heatmap_especialidades_sedes(
-                especialidades_sedes_df, "heatmap_especialidades.png"
-            )
-        
-        # 3. Preparar tablas
-        print("  - Preparando tablas...")
-        tablas = {
-            "Médicos - Métricas Completas": medicos_metricas_df
-        }
-        
-        # 4. Estadísticas resumen
-        print("  - Calculando resumen ejecutivo...")
-        citas_estado = queries.citas_por_estado()
-        total_citas = citas_estado['total'].sum()
-        
+        medicos_metricas_df = queries.tasa_cancelacion_por_medico(filtros=filtros)
+    
+    # 2. Generar gráficos (en paralelo, un proceso por gráfico)
+    avanzar(40, "Preparando gráficos")
+    tareas = {}
+    
+    if not especialidades_df.empty:
+        tareas['Citas por Especialidad'] = (
+            "graficar_citas_por_especialidad", especialidades_df, {"filename": "citas_especialidad.png"}
+        )
+    
+    if not tendencia_df.empty:
+        tareas['Evolución Temporal de Citas'] = (
+            "graficar_citas_temporales", tendencia_df, {"filename": "citas_temporales.png"}
+        )
+    
+    if not medicos_top_df.empty:
+        tareas['Top 10 Médicos Más Solicitados'] = (
+            "graficar_medicos_top", medicos_top_df, {"filename": "top_medicos.png", "top_n": 10}
+        )
+    
+    if not horarios_df.empty:
+        tareas['Distribución de Citas por Hora'] = (
+            "graficar_distribucion_horarios", horarios_df, {"filename": "distribucion_horarios.png"}
+        )
+    
+    if not tipo_doc_df.empty:
+        tareas['Distribución de Pacientes por Tipo de Documento'] = (
+            "graficar_pacientes_por_tipo_doc", tipo_doc_df, {"filename": "tipo_documento.png"}
+        )
+    
+    if not sedes_df.empty:
+        tareas['Comparativa de Sedes'] = (
+            "graficar_comparativa_sedes", sedes_df, {"filename": "comparativa_sedes.png"}
+        )
+    
+    if not especialidades_sedes_df.empty:
+        tareas['Heatmap de Especialidades por Sede'] = (
+            "graficar_heatmap_especialidades_sedes", especialidades_sedes_df,
+            {"filename": "heatmap_especialidades.png"}
+        )
+    
+    # 3. Preparar tablas
+    avanzar(45, "Preparando tablas")
+    tablas = {
+        "Médicos - Métricas Completas": medicos_metricas_df
+    }
+    
+    # 4. Estadísticas resumen
+    avanzar(50, "Calculando resumen ejecutivo")
+    total_citas = citas_estado['total'].sum()
+    
+    with tramo("reporte.resumen"):
         resumen = {
             "Total Pacientes": queries.total_pacientes_registrados(),
-            "Total Médicos": queries.total_medicos_por_especialidad()['total_medicos'].sum(),
+            "Total Médicos": queries.total_medicos_por_especialidad(filtros=filtros)['total_medicos'].sum(),
             "Total Citas": int(total_citas),
-            "Promedio Citas/Paciente": f"{queries.promedio_citas_por_paciente():.2f}",
+            "Promedio Citas/Paciente": f"{queries.promedio_citas_por_paciente(filtros=filtros):.2f}",
             "Sedes Activas": len(sedes_df)
         }
+    if filtros != SIN_FILTROS:
+        resumen["Alcance"] = filtros.describir()
+    return tareas, tablas, resumen
+
+def _generar_reporte(
+    trabajo: Trabajo,
+    perfil: str = PERFIL_RENDER,
+    presupuesto_kb: Optional[int] = PRESUPUESTO_REPORTE_KB,
+    filtros: Filtros = SIN_FILTROS
+) -> dict:
+    """
+    Obtiene datos, genera gráficos y escribe el reporte HTML (bloqueante,
+    se ejecuta como trabajo de cola_reportes)
+    
+    Args:
+        trabajo: Trabajo en curso; recibe el progreso y da nombre al archivo
+        perfil: Perfil de PERFILES_RENDER, o "auto" para probarlos de mayor a menor
+            calidad hasta que el reporte quepa en `presupuesto_kb`
+        presupuesto_kb: Tamaño máximo deseado del reporte
+        filtros: Alcance de las estadísticas del reporte
         
-        # 5. Generar reporte HTML
-        print("  - Generando archivo HTML...")
+    Returns:
+        Ruta del reporte, perfil elegido y tamaño/tiempo de cada perfil probado
+    """
+    print(f"📊 Iniciando generación de reporte {trabajo.id}...")
+    with metricas.medir_etapa("reporte", "datos"):
+        tareas, tablas, resumen = _datos_reporte(trabajo.avanzar, filtros)
+    
+    # 5. Renderizar gráficos y escribir el HTML en streaming con el perfil elegido
+    presupuesto = presupuesto_kb * 1024 if presupuesto_kb else None
+    candidatos = PERFILES_AUTO if perfil == "auto" else [perfil]
+    perfiles = []
+    for i, nombre in enumerate(candidatos):
+        trabajo.avanzar(55 + 40 * i // len(candidatos), f"Generando gráficos y HTML (perfil {nombre})")
+        inicio = time.perf_counter()
+        graficos = visualizador.renderizar_en_paralelo(tareas, PERFILES_RENDER[nombre])
         reporte_path = generador.generar_reporte_completo(
             graficos=graficos,
             tablas=tablas,
             estadisticas_resumen=resumen,
-            titulo="Reporte de Estadísticas Hospitalarias"
+            titulo=TITULO_REPORTE,
+            nombre_archivo=f"reporte_{trabajo.id}.html"
         )
-        
-        print(f"✅ Reporte generado exitosamente: {reporte_path}")
-        
-        return JSONResponse({
-            "success": True,
-            "message": "Reporte generado exitosamente",
-            "file_path": reporte_path,
-            "download_url": "/api/reporte/descargar"
+        tamano = os.path.getsize(reporte_path)
+        perfiles.append({
+            "perfil": nombre,
+            **PERFILES_RENDER[nombre]._asdict(),
+            "tamano_bytes": tamano,
+            "tiempo_s": round(time.perf_counter() - inicio, 3),
         })
+        if presupuesto is None or tamano <= presupuesto:
+            break
     
-    except Exception as e:
-        print(f"❌ Error generando reporte: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error generando reporte: {str(e)}")
+    # 6. Hash del contenido (ETag) y variantes comprimidas para las descargas
+    trabajo.avanzar(95, "Comprimiendo reporte")
+    with metricas.medir_etapa("reporte", "comprimir") as medicion:
+        variantes = precomprimir_archivo(reporte_path)
+        medicion.bytes = sum(os.path.getsize(r) for r in variantes.values())
+    return {
+        "file_path": reporte_path,
+        "sha256": hash_archivo(reporte_path),
+        "variantes": variantes,
+        "tamanos_comprimidos": {c: os.path.getsize(r) for c, r in variantes.items()},
+        "perfil": perfiles[-1]["perfil"],
+        "tamano_bytes": perfiles[-1]["tamano_bytes"],
+        "dentro_presupuesto": presupuesto is None or perfiles[-1]["tamano_bytes"] <= presupuesto,
+        "perfiles": perfiles,
+        "alcance": filtros.describir() or None,
+    }
 
-@app.get("/api/reporte/descargar")
-async def descargar_reporte():
-    """Descarga el último reporte generado"""
+@app.post("/api/reporte/generar")
+async def generar_reporte_html(
+    perfil: str = Query(PERFIL_RENDER, pattern=PATRON_PERFIL),
+    presupuesto_kb: Optional[int] = Query(PRESUPUESTO_REPORTE_KB, gt=0),
+    filtros: Filtros = Depends(_filtros)
+):
+    """
+    Encola la generación del reporte HTML completo con gráficos y tablas
+    y retorna de inmediato el id del trabajo
+    Cumple con requisitos del profesor
+    """
     try:
-        reporte_path = os.path.join("output", "reporte.html")
-        if not os.path.exists(reporte_path):
-            raise HTTPException(status_code=404, detail="Reporte no encontrado. Genera uno primero.")
-        
+        if perfilando():
+            # Perfilado: el reporte se genera dentro de la petición para que entre en el perfil
+            trabajo = await db.run_async(cola_reportes.ejecutar, _generar_reporte, perfil, presupuesto_kb, filtros)
+        else:
+            trabajo = cola_reportes.encolar(_generar_reporte, perfil, presupuesto_kb, filtros)
+    except ColaLlena as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    return JSONResponse({
+        "success": True,
+        "message": "Reporte en cola de generación",
+        "job_id": trabajo.id,
+        "estado": trabajo.estado,
+        "status_url": f"/api/reporte/{trabajo.id}",
+        "download_url": f"/api/reporte/descargar?job_id={trabajo.id}"
+    }, status_code=202)
+
+@app.get("/api/reporte/descargar")
+async def descargar_reporte(request: Request, job_id: Optional[str] = None):
+    """
+    Descarga el reporte de un trabajo (por defecto, el último completado).
+    Responde 304 si el ETag coincide con If-None-Match, sirve la variante
+    gzip/brotli precomprimida según Accept-Encoding y admite Range
+    """
+    trabajo = cola_reportes.servir(job_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Reporte no encontrado. Genera uno primero.")
+    if trabajo.estado != COMPLETADO:
+        raise HTTPException(status_code=409, detail=f"El reporte aún no está listo (estado: {trabajo.estado})")
+    if not trabajo.artefacto or not os.path.exists(trabajo.artefacto):
+        raise HTTPException(status_code=404, detail="El archivo del reporte ya no existe")
+    
+    etag = f'"{trabajo.resultado["sha256"][:32]}"'
+    variantes = {c: r for c, r in trabajo.resultado.get("variantes", {}).items() if os.path.exists(r)}
+    encabezados = {
+        "Vary": "Accept-Encoding",
+        "Accept-Ranges": "bytes",
+        # Con job_id el contenido nunca cambia; sin él, el "último reporte" sí
+        "Cache-Control": "private, max-age=31536000, immutable" if job_id else "private, no-cache",
+    }
+    
+    etags = [etag] + [etag_variante(etag, c) for c in variantes]
+    if coincide_etag(request.headers.get("if-none-match"), etags):
+        return Response(status_code=304, headers={**encabezados, "ETag": etag})
+    
+    nombre = f"reporte_hospital_{datetime.fromtimestamp(trabajo.terminado_en).strftime('%Y%m%d_%H%M%S')}.html"
+    tamano = os.path.getsize(trabajo.artefacto)
+    
+    # Los rangos se sirven sobre el HTML sin comprimir (If-Range debe coincidir con el ETag)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        try:
+            rango = parsear_rango(range_header, tamano)
+        except ValueError:
+            return Response(status_code=416, headers={**encabezados, "Content-Range": f"bytes */{tamano}"})
+        if rango is not None:
+            inicio, fin = rango
+            return StreamingResponse(
+                leer_rango(trabajo.artefacto, inicio, fin),
+                status_code=206,
+                media_type="text/html",
+                headers={
+                    **encabezados,
+                    "ETag": etag,
+                    "Content-Range": f"bytes {inicio}-{fin}/{tamano}",
+                    "Content-Length": str(fin - inicio + 1),
+                    "Content-Disposition": f'attachment; filename="{nombre}"',
+                }
+            )
+    
+    codificacion = elegir_codificacion(request.headers.get("accept-encoding"), list(variantes))
+    if codificacion is not None:
         return FileResponse(
-            reporte_path,
+            variantes[codificacion],
             media_type="text/html",
-            filename=f"reporte_hospital_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
+            filename=nombre,
+            headers={**encabezados, "ETag": etag_variante(etag, codificacion), "Content-Encoding": codificacion}
         )
+    return FileResponse(
+        trabajo.artefacto,
+        media_type="text/html",
+        filename=nombre,
+        headers={**encabezados, "ETag": etag}
+    )
+
+@app.get("/api/reporte/streaming")
+async def reporte_streaming(
+    perfil: str = Query(PERFIL_STREAMING, pattern=PATRON_PERFIL_FIJO),
+    filtros: Filtros = Depends(_filtros)
+):
+    """
+    Genera el reporte y lo envía en streaming mientras se renderiza el template,
+    sin escribir archivo ni pasar por la cola de trabajos
+    """
+    try:
+        with metricas.medir_etapa("reporte", "datos"):
+            tareas, tablas, resumen = await db.run_async(_datos_reporte, filtros=filtros)
+        graficos = await db.run_async(visualizador.renderizar_en_paralelo, tareas, PERFILES_RENDER[perfil])
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+        print(f"❌ Error generando reporte: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error generando reporte: {str(e)}")
+    
+    return StreamingResponse(
+        generador.generar_html_por_partes(graficos, tablas, resumen, TITULO_REPORTE),
+        media_type="text/html"
+    )
+
+@app.get("/api/reporte/{job_id}")
+async def estado_reporte(job_id: str):
+    """
+    Estado, progreso y resultado de un trabajo de generación de reporte; al
+    terminar, el Server-Timing incluye las etapas del trabajo (prefijo "trabajo")
+    """
+    trabajo = cola_reportes.obtener(job_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    encabezados = {}
+    if trabajo.terminado and trabajo.traza is not None:
+        encabezados["Server-Timing"] = trabajo.traza.server_timing(total="trabajo")
+    estado = trabajo.a_dict()
+    if trabajo.estado == COMPLETADO:
+        estado["resultado"]["download_url"] = f"/api/reporte/descargar?job_id={trabajo.id}"
+    return JSONResponse(estado, headers=encabezados)
+
+# ==================== ROLLUPS ====================
+
+@app.get("/api/rollups/estado")
+async def estado_rollups():
+    """Retorna si los rollups de citas están instalados y frescos"""
+    return JSONResponse(rollups.estado())
+
+@app.post("/api/rollups/refrescar", dependencies=[Depends(_verificar_admin)])
+async def refrescar_rollups():
+    """Fuerza un refresco incremental de los rollups de citas"""
+    try:
+        cortes = await db.run_async(rollups.refrescar)
+        return JSONResponse({"cortes_recalculados": cortes, **rollups.estado()})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error refrescando rollups: {str(e)}")
+
+# ==================== ÍNDICES ====================
+
+@app.get("/api/indices/estado", dependencies=[Depends(_verificar_admin)])
+async def estado_indices():
+    """Retorna los índices que requieren las consultas y cuáles faltan"""
+    try:
+        return JSONResponse(await db.run_async(indices.estado))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error leyendo índices: {str(e)}")
+
+# ==================== CACHÉ ====================
+
+@app.get("/api/cache/estadisticas")
+async def estadisticas_cache():
+    """Retorna los contadores de la caché de queries y de la caché de gráficos"""
+    return JSONResponse({
+        "consultas": cache_estadisticas.estadisticas(),
+        "graficos": cache_graficos.estadisticas()
+    })
+
+@app.delete("/api/cache", dependencies=[Depends(_verificar_admin)])
+async def limpiar_cache(metodo: Optional[str] = None):
+    """Invalida la caché completa o solo las entradas de un método de EstadisticasQueries"""
+    eliminadas = cache_estadisticas.invalidar(metodo)
+    return JSONResponse({"eliminadas": eliminadas})
+
+# ==================== MÉTRICAS ====================
+
+@app.get("/api/metrics")
+async def exponer_metricas():
+    """Latencia, filas, bytes y errores por consulta y por etapa, en formato de texto de Prometheus"""
+    return Response(metricas.exponer(), media_type="text/plain; version=0.0.4")
+
+# ==================== ADMINISTRACIÓN ====================
+
+@app.get("/api/admin/consultas_lentas", dependencies=[Depends(_verificar_admin)])
+async def listar_consultas_lentas(
+    orden: str = Query("peores", pattern="^(peores|recientes|fallidas)$"),
+    limite: int = Query(50, ge=1)
+):
+    """
+    Consultas que superaron el umbral de lentitud, con su SQL, parámetros, duración,
+    filas y el EXPLAIN capturado en el momento (o las últimas lecturas fallidas)
+    """
+    registro = db.consultas_lentas
+    entradas = {"peores": registro.peores, "recientes": registro.recientes, "fallidas": registro.fallidas}[orden]()
+    return JSONResponse(jsonable_encoder({**registro.estado(), "orden": orden, "consultas": entradas[:limite]}))
+
+@app.delete("/api/admin/consultas_lentas", dependencies=[Depends(_verificar_admin)])
+async def limpiar_consultas_lentas():
+    """Vacía el registro de consultas lentas"""
+    db.consultas_lentas.limpiar()
+    return JSONResponse(db.consultas_lentas.estado())
 
 @app.get("/api/health")
 async def health_check():
     """Verifica el estado de la API y la conexión a la base de datos"""
     try:
-        # Test de conexión
-        result = db.execute_query("SELECT 1 as test")
-        if result.empty:
+        # Conexión e hilo propios: no espera detrás de las queries del dashboard
+        if not await db.verificar_conexion_async():
             return JSONResponse({"status": "unhealthy", "database": "disconnected"}, status_code=503)
         
         return JSONResponse({
@@ -314,6 +885,10 @@ async def health_check():
             "database": "connected",
             "timestamp": datetime.now().isoformat()
         })
+    except asyncio.TimeoutError:
+        return JSONResponse(
+            {"status": "unhealthy", "error": f"la base no respondió en {db.espera_salud:g} s"}, status_code=503
+        )
     except Exception as e:
         return JSONResponse({"status": "unhealthy", "error": str(e)}, status_code=503)
 
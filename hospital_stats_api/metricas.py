@@ -0,0 +1,259 @@
+"""
+metricas.py - Métricas de las consultas de EstadisticasQueries y de las etapas de
+gráficos y reportes (latencia, filas, bytes y errores), expuestas en el formato
+de texto de Prometheus
+
+Las lecturas de DatabaseConnection se etiquetan con el nombre de la consulta en
+curso, que fija `nombrar_consulta` (el decorador de caché lo hace por cada método
+de EstadisticasQueries). Al ser una contextvar llega a los hilos de run_async.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from trazas import tramo
+
+# Límites de los histogramas de latencia (segundos)
+BUCKETS_SEGUNDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Etiqueta de las lecturas hechas fuera de una consulta con nombre (health, rollups, ...)
+SIN_NOMBRE = "directa"
+
+consulta_actual: ContextVar[Optional[str]] = ContextVar("consulta_actual", default=None)
+
+
+@contextmanager
+def nombrar_consulta(nombre: str) -> Iterator[None]:
+    """Etiqueta con `nombre` las lecturas de la base hechas dentro del bloque"""
+    token = consulta_actual.set(nombre)
+    try:
+        yield
+    finally:
+        consulta_actual.reset(token)
+
+
+def _escapar(valor: str) -> str:
+    """Escapa un valor de etiqueta según el formato de texto de Prometheus"""
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres: Sequence[str], valores: Sequence[str], extra: str = "") -> str:
+    """{nombre="valor",...} con una etiqueta adicional ya formateada (le="...")"""
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _numero(valor: float) -> str:
+    """Número en el formato de Prometheus (enteros sin decimales)"""
+    if valor == float("inf"):
+        return "+Inf"
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+class Contador:
+    """Contador monotónico con etiquetas"""
+
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str]):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, valores: Sequence[str], cantidad: float = 1) -> None:
+        """Suma `cantidad` a la serie con esos valores de etiqueta"""
+        clave = tuple(valores)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def valor(self, valores: Sequence[str]) -> float:
+        """Valor actual de la serie con esos valores de etiqueta (0 si no existe)"""
+        with self._lock:
+            return self._valores.get(tuple(valores), 0)
+
+    def lineas(self) -> List[str]:
+        """Líneas de exposición de todas las series"""
+        with self._lock:
+            series = sorted(self._valores.items())
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, v)} {_numero(c)}" for v, c in series]
+
+
+class Histograma:
+    """Histograma acumulado con etiquetas (buckets, suma y conteo por serie)"""
+
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str],
+                 buckets: Sequence[float] = BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        # serie -> [conteos por bucket (sin acumular)..., suma, conteo]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valores: Sequence[str], valor: float) -> None:
+        """Registra una observación en la serie con esos valores de etiqueta"""
+        clave = tuple(valores)
+        indice = next((i for i, limite in enumerate(self.buckets) if valor <= limite), len(self.buckets))
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            serie[indice] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def resumen(self) -> Dict[Tuple[str, ...], Tuple[int, float]]:
+        """Conteo y suma de cada serie"""
+        with self._lock:
+            return {clave: (int(serie[-1]), serie[-2]) for clave, serie in self._series.items()}
+
+    def lineas(self) -> List[str]:
+        """Líneas de exposición: _bucket acumulados, _sum y _count de cada serie"""
+        with self._lock:
+            series = sorted((v, list(s)) for v, s in self._series.items())
+        lineas = []
+        for valores, serie in series:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float("inf"),), serie):
+                acumulado += conteo
+                le = f'le="{_numero(limite)}"'
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {_numero(serie[-2])}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {serie[-1]}")
+        return lineas
+
+
+class Medicion:
+    """Resultado de un bloque medido por medir_etapa: el bloque anota los bytes producidos"""
+
+    __slots__ = ("bytes",)
+
+    def __init__(self):
+        self.bytes = 0
+
+
+class MetricasEstadisticas:
+    """Registro de las métricas de consultas y etapas de la API"""
+
+    def __init__(self, activa: bool = True, buckets: Sequence[float] = BUCKETS_SEGUNDOS):
+        """
+        Inicializa las métricas
+
+        Args:
+            activa: Si es False, no se registra nada (las mediciones no cuestan)
+            buckets: Límites en segundos de los histogramas de latencia
+        """
+        self.activa = activa
+        self.consulta_segundos = Histograma(
+            "hospital_consulta_segundos", "Latencia de las lecturas de la base por consulta",
+            ("consulta", "lectura"), buckets
+        )
+        self.consulta_filas = Contador(
+            "hospital_consulta_filas_total", "Filas retornadas por consulta", ("consulta",)
+        )
+        self.consulta_bytes = Contador(
+            "hospital_consulta_bytes_total", "Bytes (estimados en memoria) retornados por consulta", ("consulta",)
+        )
+        self.consulta_errores = Contador(
+            "hospital_consulta_errores_total", "Lecturas de la base que fallaron por consulta", ("consulta",)
+        )
+        self.etapa_segundos = Histograma(
+            "hospital_etapa_segundos", "Duración de las etapas de gráficos y reportes",
+            ("componente", "etapa"), buckets
+        )
+        self.etapa_bytes = Contador(
+            "hospital_etapa_bytes_total", "Bytes producidos por etapa (imágenes, HTML, variantes comprimidas)",
+            ("componente", "etapa")
+        )
+        self.etapa_errores = Contador(
+            "hospital_etapa_errores_total", "Etapas de gráficos y reportes que fallaron", ("componente", "etapa")
+        )
+        self._metricas = [
+            self.consulta_segundos, self.consulta_filas, self.consulta_bytes, self.consulta_errores,
+            self.etapa_segundos, self.etapa_bytes, self.etapa_errores,
+        ]
+
+    def registrar_consulta(self, lectura: str, segundos: float, filas: int = 0,
+                           bytes_: int = 0, error: bool = False,
+                           consulta: Optional[str] = None) -> None:
+        """
+        Registra una lectura de la base
+
+        Args:
+            lectura: Método de DatabaseConnection (execute_query, fetch_scalar, ...)
+            segundos: Duración de la lectura
+            filas: Filas retornadas
+            bytes_: Tamaño estimado del resultado
+            error: Si la lectura falló
+            consulta: Nombre de la consulta (default: la fijada con nombrar_consulta)
+        """
+        if not self.activa:
+            return
+        consulta = consulta or consulta_actual.get() or SIN_NOMBRE
+        self.consulta_segundos.observar((consulta, lectura), segundos)
+        self.consulta_filas.incrementar((consulta,), filas)
+        self.consulta_bytes.incrementar((consulta,), bytes_)
+        if error:
+            self.consulta_errores.incrementar((consulta,))
+
+    def registrar_etapa(self, componente: str, etapa: str, segundos: Optional[float],
+                        bytes_: int = 0, error: bool = False) -> None:
+        """
+        Registra una etapa de gráficos o de reporte
+
+        Args:
+            componente: "visualizacion" o "reporte"
+            etapa: Nombre de la etapa (método graficar_*, html, comprimir, ...)
+            segundos: Duración de la etapa (None si no se conoce, p. ej. si falló en otro proceso)
+            bytes_: Bytes producidos
+            error: Si la etapa falló
+        """
+        if not self.activa:
+            return
+        if segundos is not None:
+            self.etapa_segundos.observar((componente, etapa), segundos)
+        self.etapa_bytes.incrementar((componente, etapa), bytes_)
+        if error:
+            self.etapa_errores.incrementar((componente, etapa))
+
+    @contextmanager
+    def medir_etapa(self, componente: str, etapa: str) -> Iterator[Medicion]:
+        """
+        Mide la duración de un bloque como etapa; el bloque puede anotar en la
+        Medicion los bytes producidos. Una excepción cuenta como error y se propaga.
+        El bloque queda además como tramo "componente.etapa" de la traza en curso.
+        """
+        medicion = Medicion()
+        inicio = time.perf_counter()
+        error = False
+        try:
+            with tramo(f"{componente}.{etapa}"):
+                yield medicion
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.registrar_etapa(componente, etapa, time.perf_counter() - inicio, medicion.bytes, error)
+
+    def exponer(self) -> str:
+        """Todas las métricas en el formato de texto de Prometheus (versión 0.0.4)"""
+        lineas = []
+        for metrica in self._metricas:
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            lineas.extend(metrica.lineas())
+        return "\n".join(lineas) + "\n"
+
+
+# Instancia global para usar en toda la aplicación
+metricas = MetricasEstadisticas(activa=os.getenv("STATS_METRICAS", "1") != "0")
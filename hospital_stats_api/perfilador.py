@@ -0,0 +1,423 @@
+"""
+perfilador.py - Perfilado bajo demanda de los endpoints de estadísticas y reportes
+
+Con `?profile=1` (y el encabezado X-Admin-Token) la petición se ejecuta bajo un
+perfilador y la respuesta es el perfil en lugar de los datos:
+
+- `profile_format=colapsado` (default): muestreo de pilas con sys._current_frames,
+  en el formato de pilas colapsadas de flamegraph.pl / speedscope
+- `profile_format=pstats`: cProfile determinista, volcado binario para pstats/snakeviz
+
+Se perfilan el hilo del event loop y los hilos de run_async que trabajan para la
+petición. Mientras se perfila, cada gráfico se perfila dentro de su proceso del pool
+(perfilar_llamada) y su perfil se incorpora al de la petición; el reporte se genera
+en línea, para que aparezca en el perfil.
+
+El event loop es compartido: lo que corra en él durante el perfil entra en el
+perfil. Por eso una petición perfilada espera a que terminen las que están en curso
+y, mientras dura, las nuevas esperan a que termine (MiddlewarePerfilador pasa todas
+las peticiones por una CompuertaExclusiva).
+"""
+import asyncio
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, List, Optional, Set, Tuple
+from urllib.parse import parse_qs
+
+COLAPSADO = "colapsado"
+PSTATS = "pstats"
+FORMATOS = (COLAPSADO, PSTATS)
+
+
+def _etiqueta(codigo) -> str:
+    """Nombre de un marco en el perfil: función calificada y archivo:línea de su definición"""
+    nombre = getattr(codigo, "co_qualname", codigo.co_name)
+    return f"{nombre} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})".replace(";", ",")
+
+
+class Perfil:
+    """Perfil de una petición: muestras de pilas o perfiles cProfile de cada hilo participante"""
+
+    def __init__(self, formato: str = COLAPSADO, intervalo: float = 0.005):
+        """
+        Inicializa el perfil
+
+        Args:
+            formato: COLAPSADO (muestreo) o PSTATS (cProfile)
+            intervalo: Segundos entre muestras en el modo de muestreo
+        """
+        self.formato = formato
+        self.intervalo = intervalo
+        self.muestras: Counter = Counter()
+        self.n_muestras = 0
+        self.segundos = 0.0
+        self._hilos: Set[int] = set()
+        self._perfiles: List[Any] = []  # cProfile.Profile o _EstadisticasExternas
+        self._principal: Optional[cProfile.Profile] = None
+        self._muestreador: Optional[threading.Thread] = None
+        self._detener = threading.Event()
+        self._lock = threading.Lock()
+        self._inicio = 0.0
+
+    def iniciar(self) -> None:
+        """Empieza a perfilar el hilo actual (el del event loop)"""
+        self._inicio = time.perf_counter()
+        self._hilos.add(threading.get_ident())
+        if self.formato == PSTATS:
+            self._principal = cProfile.Profile()
+            self._principal.enable()
+        else:
+            self._muestreador = threading.Thread(target=self._muestrear, name="perfilador", daemon=True)
+            self._muestreador.start()
+
+    def detener(self) -> None:
+        """Deja de perfilar"""
+        if self._principal is not None:
+            self._principal.disable()
+            self._perfiles.append(self._principal)
+        if self._muestreador is not None:
+            self._detener.set()
+            self._muestreador.join()
+        self._hilos.discard(threading.get_ident())
+        self.segundos = time.perf_counter() - self._inicio
+
+    def ejecutar_en_hilo(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Ejecuta `func` en el hilo actual como parte del perfil"""
+        ident = threading.get_ident()
+        with self._lock:
+            self._hilos.add(ident)
+        perfil = cProfile.Profile() if self.formato == PSTATS else None
+        try:
+            if perfil is None:
+                return func(*args, **kwargs)
+            return perfil.runcall(func, *args, **kwargs)
+        finally:
+            with self._lock:
+                self._hilos.discard(ident)
+                if perfil is not None:
+                    self._perfiles.append(perfil)
+
+    def _muestrear(self) -> None:
+        """Hilo del muestreador: cada `intervalo` anota la pila de cada hilo participante"""
+        nombres = {}
+        while not self._detener.wait(self.intervalo):
+            marcos = sys._current_frames()
+            # Con el lock: incorporar() también escribe en self.muestras
+            with self._lock:
+                for ident in self._hilos:
+                    marco = marcos.get(ident)
+                    if marco is None:
+                        continue
+                    if ident not in nombres:
+                        hilo = next((h for h in threading.enumerate() if h.ident == ident), None)
+                        # db-query_0, db-query_1, ... se agrupan como db-query
+                        nombres[ident] = re.sub(r"_\d+$", "", hilo.name) if hilo else str(ident)
+                    pila = []
+                    while marco is not None:
+                        pila.append(_etiqueta(marco.f_code))
+                        marco = marco.f_back
+                    pila.append(nombres[ident])
+                    self.muestras[";".join(reversed(pila))] += 1
+            self.n_muestras += 1
+
+    def datos(self) -> dict:
+        """
+        Resultado del perfil en forma serializable (para enviarlo desde otro proceso)
+
+        Returns:
+            Pila colapsada -> muestras (COLAPSADO) o el diccionario de pstats (PSTATS)
+        """
+        if self.formato == PSTATS:
+            return pstats.Stats(*self._perfiles).stats
+        return dict(self.muestras)
+
+    def incorporar(self, datos: dict, hilo: str) -> None:
+        """
+        Suma al perfil el de otro proceso (ver perfilar_llamada)
+
+        Args:
+            datos: Resultado de Perfil.datos() en el otro proceso
+            hilo: Nombre con que aparecen sus pilas en el modo de muestreo
+        """
+        with self._lock:
+            if self.formato == PSTATS:
+                self._perfiles.append(_EstadisticasExternas(datos))
+            else:
+                for pila, n in datos.items():
+                    # El primer elemento de la pila es el nombre del hilo del otro proceso
+                    self.muestras[f"{hilo};{pila.partition(';')[2]}"] += n
+
+    def exportar(self) -> Tuple[bytes, str, str]:
+        """
+        Contenido del perfil
+
+        Returns:
+            (contenido, tipo MIME, extensión del archivo)
+        """
+        if self.formato == PSTATS:
+            estadisticas = pstats.Stats(*self._perfiles)
+            with tempfile.NamedTemporaryFile(suffix=".pstats", delete=False) as f:
+                ruta = f.name
+            try:
+                estadisticas.dump_stats(ruta)
+                with open(ruta, "rb") as f:
+                    return f.read(), "application/octet-stream", "pstats"
+            finally:
+                os.remove(ruta)
+        lineas = [f"{pila} {n}" for pila, n in self.muestras.most_common()]
+        return ("\n".join(lineas) + "\n").encode(), "text/plain", "txt"
+
+
+class _EstadisticasExternas:
+    """Estadísticas pstats de otro proceso, con la interfaz que pstats.Stats espera de un perfil"""
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+def perfilar_llamada(formato: str, intervalo: float, func: Callable[..., Any],
+                     *args, **kwargs) -> Tuple[Any, dict]:
+    """
+    Ejecuta `func` bajo un perfil propio; pensada para correr en un proceso del pool,
+    donde el perfil de la petición no llega
+
+    Args:
+        formato: COLAPSADO o PSTATS (el del perfil de la petición)
+        intervalo: Segundos entre muestras en el modo de muestreo
+
+    Returns:
+        (resultado de func, Perfil.datos() para Perfil.incorporar en el servidor)
+    """
+    perfil = Perfil(formato, intervalo)
+    perfil.iniciar()
+    try:
+        resultado = func(*args, **kwargs)
+    finally:
+        perfil.detener()
+    return resultado, perfil.datos()
+
+
+perfil_actual: ContextVar[Optional[Perfil]] = ContextVar("perfil_actual", default=None)
+
+
+def perfilando() -> bool:
+    """Si la petición en curso se está perfilando"""
+    return perfil_actual.get() is not None
+
+
+def en_hilo(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Ejecuta `func`; si la petición se está perfilando, el hilo actual entra en el perfil"""
+    perfil = perfil_actual.get()
+    if perfil is None:
+        return func(*args, **kwargs)
+    return perfil.ejecutar_en_hilo(func, *args, **kwargs)
+
+
+class CompuertaOcupada(Exception):
+    """Las peticiones en curso no terminaron a tiempo para tomar la compuerta en exclusiva"""
+
+
+class CompuertaExclusiva:
+    """
+    Deja pasar peticiones en paralelo salvo mientras una petición perfilada la
+    tiene en exclusiva: esa espera a que se vacíe y las nuevas esperan a que termine
+    """
+
+    def __init__(self):
+        self.en_curso = 0
+        self._exclusiva = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._cambio: Optional[asyncio.Condition] = None
+
+    def _condicion(self) -> asyncio.Condition:
+        """Condición del event loop actual (la instancia global puede usarse desde varios loops)"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._cambio = loop, asyncio.Condition()
+        return self._cambio
+
+    @asynccontextmanager
+    async def compartida(self) -> AsyncIterator[None]:
+        cambio = self._condicion()
+        async with cambio:
+            await cambio.wait_for(lambda: not self._exclusiva)
+            self.en_curso += 1
+        try:
+            yield
+        finally:
+            async with cambio:
+                self.en_curso -= 1
+                cambio.notify_all()
+
+    @asynccontextmanager
+    async def exclusiva(self, espera: float) -> AsyncIterator[None]:
+        """
+        Toma la compuerta en exclusiva
+
+        Raises:
+            CompuertaOcupada: Si en `espera` segundos no terminaron las peticiones en curso
+        """
+        cambio = self._condicion()
+        async with cambio:
+            self._exclusiva = True
+            try:
+                await asyncio.wait_for(cambio.wait_for(lambda: self.en_curso == 0), espera)
+            except BaseException as e:
+                self._exclusiva = False
+                cambio.notify_all()
+                if isinstance(e, asyncio.TimeoutError):
+                    raise CompuertaOcupada(f"Hay {self.en_curso} peticiones en curso") from e
+                raise
+        try:
+            yield
+        finally:
+            async with cambio:
+                self._exclusiva = False
+                cambio.notify_all()
+
+
+class Perfilador:
+    """Configuración del modo de perfilado de la API"""
+
+    def __init__(self, token: Optional[str] = None, intervalo_ms: float = 5.0,
+                 prefijos: Tuple[str, ...] = ("/api/estadisticas", "/api/reporte"),
+                 espera: float = 30.0):
+        """
+        Inicializa el perfilador
+
+        Args:
+            token: Token de administración exigido en X-Admin-Token (sin token, el
+                perfilado queda deshabilitado)
+            intervalo_ms: Milisegundos entre muestras del modo colapsado
+            prefijos: Rutas que admiten ?profile=1
+            espera: Segundos que una petición perfilada espera a que terminen las
+                demás antes de responder 503
+        """
+        self.token = token
+        self.intervalo_ms = intervalo_ms
+        self.prefijos = prefijos
+        self.espera = espera
+        self.compuerta = CompuertaExclusiva()
+        # Un perfil a la vez: cProfile no admite dos perfiladores en el mismo hilo
+        self._ocupado = threading.Lock()
+
+    def autorizado(self, token: Optional[str]) -> bool:
+        return bool(self.token) and hmac.compare_digest((token or "").encode(), self.token.encode())
+
+    def reservar(self) -> bool:
+        """Toma el perfilador si está libre"""
+        return self._ocupado.acquire(blocking=False)
+
+    def liberar(self) -> None:
+        self._ocupado.release()
+
+
+class MiddlewarePerfilador:
+    """
+    Middleware ASGI que ejecuta bajo el perfilador las peticiones con ?profile=1,
+    solas en el event loop; el resto pasa por la compuerta en modo compartido
+    """
+
+    def __init__(self, app, perfilador: Perfilador):
+        self.app = app
+        self.perfilador = perfilador
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        parametros = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        if (not scope["path"].startswith(self.perfilador.prefijos)
+                or parametros.get("profile", ["0"])[-1] not in ("1", "true")):
+            async with self.perfilador.compuerta.compartida():
+                await self.app(scope, receive, send)
+            return
+
+        encabezados = dict(scope["headers"])
+        if not self.perfilador.token:
+            await _responder(send, 403, {"detail": "Perfilador deshabilitado (definir STATS_ADMIN_TOKEN)"})
+            return
+        if not self.perfilador.autorizado(encabezados.get(b"x-admin-token", b"").decode("latin-1")):
+            await _responder(send, 401, {"detail": "Token de administración inválido"})
+            return
+        formato = parametros.get("profile_format", [COLAPSADO])[-1]
+        if formato not in FORMATOS:
+            await _responder(send, 400, {"detail": f"profile_format debe ser uno de {', '.join(FORMATOS)}"})
+            return
+        if not self.perfilador.reservar():
+            await _responder(send, 409, {"detail": "Ya hay una petición perfilándose"})
+            return
+        try:
+            async with self.perfilador.compuerta.exclusiva(self.perfilador.espera):
+                await self._perfilar(scope, receive, send, formato)
+        except CompuertaOcupada as e:
+            await _responder(send, 503, {"detail": f"{e}; el perfil necesita el event loop para sí solo"})
+        finally:
+            self.perfilador.liberar()
+
+    async def _perfilar(self, scope, receive, send, formato: str) -> None:
+        """Ejecuta la petición bajo un Perfil y responde el perfil"""
+        estado = {"codigo": 500}
+
+        async def descartar(mensaje):
+            # La respuesta original se consume completa (también en streaming) y se descarta
+            if mensaje["type"] == "http.response.start":
+                estado["codigo"] = mensaje["status"]
+
+        perfil = Perfil(formato, self.perfilador.intervalo_ms / 1000)
+        token = perfil_actual.set(perfil)
+        perfil.iniciar()
+        try:
+            await self.app(scope, receive, descartar)
+        finally:
+            perfil.detener()
+            perfil_actual.reset(token)
+
+        contenido, tipo, extension = perfil.exportar()
+        nombre = re.sub(r"[^0-9A-Za-z]+", "_", scope["path"]).strip("_")
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", tipo.encode()),
+                (b"content-length", str(len(contenido)).encode()),
+                (b"content-disposition", f'attachment; filename="perfil_{nombre}.{extension}"'.encode()),
+                (b"x-perfil-estado-original", str(estado["codigo"]).encode()),
+                (b"x-perfil-segundos", f"{perfil.segundos:.3f}".encode()),
+                (b"x-perfil-muestras", str(perfil.n_muestras).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": contenido})
+
+
+async def _responder(send, codigo: int, contenido: dict) -> None:
+    """Respuesta JSON directa desde el middleware"""
+    cuerpo = json.dumps(contenido, ensure_ascii=False).encode()
+    await send({
+        "type": "http.response.start",
+        "status": codigo,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(cuerpo)).encode())],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
+
+
+# Instancia global para usar en toda la aplicación
+perfilador = Perfilador(
+    token=os.getenv("STATS_ADMIN_TOKEN"),
+    intervalo_ms=float(os.getenv("STATS_PERFIL_INTERVALO_MS", "5")),
+    espera=float(os.getenv("STATS_PERFIL_ESPERA", "30"))
+)
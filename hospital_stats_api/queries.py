@@ -2,59 +2,183 @@
 queries.py - Consultas SQL para obtener estadísticas del sistema hospitalario
 """
 from database import db
+from cache import cache_estadisticas
+from metricas import nombrar_consulta
+from rollups import rollups
 import pandas as pd
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+# Segundos de vida en caché según lo rápido que cambia cada tipo de dato
+TTL_CATALOGO = 600   # usuarios y médicos registrados
+TTL_CITAS = 120      # agregados sobre appointments
+TTL_BLOQUEOS = 30    # bloqueos activos
+
+class Filtros(NamedTuple):
+    """
+    Alcance de las estadísticas: rango de fechas de las citas y sede o
+    especialidad del médico. Cada query lo traduce a predicados WHERE/ON sobre
+    columnas indexadas (appointments.fecha, appointments.professional_identificacion,
+    medicos.sede_id/especialidad y appointments_rollup.dia/sede_id/especialidad),
+    nunca a un filtrado posterior en pandas. Es hashable, así forma parte de la
+    clave de caché.
+    """
+    desde: Optional[date] = None
+    hasta: Optional[date] = None  # inclusive
+    sede_id: Optional[int] = None
+    especialidad: Optional[str] = None
+    
+    @property
+    def params(self) -> dict:
+        """Parámetros :f_* de los predicados (solo los de filtros activos)"""
+        params = {}
+        if self.desde is not None:
+            params['f_desde'] = self.desde
+        if self.hasta is not None:
+            # Límite exclusivo: sirve igual si fecha es DATE o DATETIME
+            params['f_hasta'] = self.hasta + timedelta(days=1)
+        if self.sede_id is not None:
+            params['f_sede_id'] = self.sede_id
+        if self.especialidad is not None:
+            params['f_especialidad'] = self.especialidad
+        return params
+    
+    def fechas(self, columna: str) -> List[str]:
+        """Predicados de rango sobre una columna de fecha"""
+        condiciones = []
+        if self.desde is not None:
+            condiciones.append(f"{columna} >= :f_desde")
+        if self.hasta is not None:
+            condiciones.append(f"{columna} < :f_hasta")
+        return condiciones
+    
+    def sede(self, columna: str) -> List[str]:
+        """Predicado de igualdad sobre una columna de sede"""
+        return [f"{columna} = :f_sede_id"] if self.sede_id is not None else []
+    
+    def de_especialidad(self, columna: str) -> List[str]:
+        """Predicado de igualdad sobre una columna de especialidad"""
+        return [f"{columna} = :f_especialidad"] if self.especialidad is not None else []
+    
+    def medicos(self, alias: str = "m") -> List[str]:
+        """Predicados sobre la tabla medicos (sede y especialidad)"""
+        return self.sede(f"{alias}.sede_id") + self.de_especialidad(f"{alias}.especialidad")
+    
+    def citas(self, alias: str = "a", medico: Optional[str] = None) -> List[str]:
+        """
+        Predicados sobre appointments
+        
+        Args:
+            alias: Alias de appointments en la query
+            medico: Alias de medicos si la query ya la une; si no, la sede y la
+                especialidad se resuelven con un semi-join sobre
+                professional_identificacion
+        """
+        condiciones = self.fechas(f"{alias}.fecha")
+        if medico:
+            condiciones += self.medicos(medico)
+        elif self.sede_id is not None or self.especialidad is not None:
+            condiciones.append(
+                f"{alias}.professional_identificacion IN ("
+                f"SELECT identificacion FROM medicos WHERE {' AND '.join(self.medicos('medicos'))})"
+            )
+        return condiciones
+    
+    def rollup(self, alias: Optional[str] = None) -> List[str]:
+        """Predicados sobre appointments_rollup (ya tiene sede y especialidad)"""
+        prefijo = f"{alias}." if alias else ""
+        return (self.fechas(f"{prefijo}dia") + self.sede(f"{prefijo}sede_id")
+                + self.de_especialidad(f"{prefijo}especialidad"))
+    
+    def describir(self) -> str:
+        """Descripción legible del alcance (vacía si no hay filtros)"""
+        partes = []
+        if self.desde is not None:
+            partes.append(f"desde {self.desde.isoformat()}")
+        if self.hasta is not None:
+            partes.append(f"hasta {self.hasta.isoformat()}")
+        if self.sede_id is not None:
+            partes.append(f"sede {self.sede_id}")
+        if self.especialidad is not None:
+            partes.append(f"especialidad {self.especialidad}")
+        return ", ".join(partes)
+
+SIN_FILTROS = Filtros()
+
+def _donde(condiciones: List[str]) -> str:
+    """Cláusula WHERE con las condiciones (vacía si no hay ninguna)"""
+    return "WHERE " + " AND ".join(condiciones) if condiciones else ""
+
+def _y(condiciones: List[str]) -> str:
+    """Condiciones para añadir a un WHERE/ON/HAVING existente"""
+    return "".join(f" AND {c}" for c in condiciones)
 
 class EstadisticasQueries:
     
     # ==================== ESTADÍSTICAS DE PACIENTES ====================
     
     @staticmethod
+    @cache_estadisticas.cacheado(ttl=TTL_CATALOGO)
     def total_pacientes_registrados() -> int:
         """Retorna el total de pacientes registrados"""
         query = "SELECT COUNT(*) as total FROM users"
-        df = db.execute_query(query)
-        return int(df['total'].iloc[0]) if not df.empty else 0
+        return int(db.fetch_scalar(query, default=0))
     
     @staticmethod
-    def pacientes_activos(meses: int = 6) -> pd.DataFrame:
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def pacientes_activos(meses: int = 6, filtros: Filtros = SIN_FILTROS) -> pd.DataFrame:
         """
         Retorna pacientes con citas en los últimos X meses
         
         Args:
             meses: Número de meses hacia atrás (default: 6)
+            filtros: Alcance de las citas contadas
         """
-        query = """
-        SELECT DISTINCT 
-            u.user_id,
-            u.nombre,
-            u.apellido,
-            u.tipo_documento,
-            COUNT(a.id) as total_citas
-        FROM users u
-        INNER JOIN appointments a ON u.user_id = a.user_id
-        WHERE a.fecha >= DATE_SUB(CURDATE(), INTERVAL :meses MONTH)
-        GROUP BY u.user_id, u.nombre, u.apellido, u.tipo_documento
-        ORDER BY total_citas DESC
+        query = EstadisticasQueries._sql_pacientes_activos(False, False, filtros)
+        return db.execute_query(query, {'meses': meses, **filtros.params})
+    
+    @staticmethod
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def total_pacientes_activos(meses: int = 6, filtros: Filtros = SIN_FILTROS) -> int:
+        """
+        Retorna cuántos pacientes tienen citas en los últimos X meses
+        
+        Variante de solo conteo de `pacientes_activos`: el COUNT(DISTINCT) se
+        resuelve en la base y no se trae ni se agrupa ninguna fila por paciente.
+        
+        Args:
+            meses: Número de meses hacia atrás (default: 6)
+            filtros: Alcance de las citas contadas
         """
-        return db.execute_query(query, {'meses': meses})
+        query = f"""
+        SELECT COUNT(DISTINCT a.user_id) as total
+        FROM appointments a
+        WHERE a.fecha >= DATE_SUB(CURDATE(), INTERVAL :meses MONTH){_y(filtros.citas('a'))}
+        """
+        return int(db.fetch_scalar(query, {'meses': meses, **filtros.params}, default=0))
     
     @staticmethod
-    def promedio_citas_por_paciente() -> float:
-        """Calcula el promedio de citas por paciente"""
-        query = """
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def promedio_citas_por_paciente(filtros: Filtros = SIN_FILTROS) -> float:
+        """
+        Calcula el promedio de citas por paciente
+        
+        Args:
+            filtros: Alcance de las citas contadas
+        """
+        query = f"""
         SELECT AVG(citas_count) as promedio
         FROM (
-            SELECT user_id, COUNT(*) as citas_count
-            FROM appointments
-            GROUP BY user_id
+            SELECT a.user_id, COUNT(*) as citas_count
+            FROM appointments a
+            {_donde(filtros.citas('a'))}
+            GROUP BY a.user_id
         ) as subquery
         """
-        df = db.execute_query(query)
-        return float(df['promedio'].iloc[0]) if not df.empty else 0.0
+        return float(db.fetch_scalar(query, filtros.params, default=0.0))
     
     @staticmethod
+    @cache_estadisticas.cacheado(ttl=TTL_CATALOGO)
     def distribucion_tipo_documento() -> pd.DataFrame:
         """Retorna la distribución de pacientes por tipo de documento"""
         query = """
@@ -68,6 +192,7 @@ class EstadisticasQueries:
         return db.execute_query(query)
     
     @staticmethod
+    @cache_estadisticas.cacheado(ttl=TTL_BLOQUEOS)
     def pacientes_bloqueados_vs_activos() -> dict:
         """Retorna estadísticas de pacientes bloqueados vs activos"""
         query = """
@@ -85,24 +210,25 @@ class EstadisticasQueries:
             AND ub.user_type = 'paciente'
         GROUP BY estado
         """
-        df = db.execute_query(query)
         result = {'activos': 0, 'bloqueados': 0}
-        for _, row in df.iterrows():
-            if row['estado'] == 'Bloqueados':
-                result['bloqueados'] = int(row['cantidad'])
+        for estado, cantidad in db.fetch_rows(query):
+            if estado == 'Bloqueados':
+                result['bloqueados'] = int(cantidad)
             else:
-                result['activos'] = int(row['cantidad'])
+                result['activos'] = int(cantidad)
         return result
     
     @staticmethod
-    def top_pacientes_mas_citas(limit: int = 10) -> pd.DataFrame:
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def top_pacientes_mas_citas(limit: int = 10, filtros: Filtros = SIN_FILTROS) -> pd.DataFrame:
         """
         Retorna el top N de pacientes con más citas
         
         Args:
             limit: Número de pacientes a retornar (default: 10)
+            filtros: Alcance de las citas contadas
         """
-        query = """
+        query = f"""
         SELECT 
             u.user_id,
             u.nombre,
@@ -113,34 +239,44 @@ class EstadisticasQueries:
             SUM(CASE WHEN a.estado = 'cancelada' THEN 1 ELSE 0 END) as citas_canceladas
         FROM users u
         INNER JOIN appointments a ON u.user_id = a.user_id
+        {_donde(filtros.citas('a'))}
         GROUP BY u.user_id, u.nombre, u.apellido, u.tipo_documento
         ORDER BY total_citas DESC
         LIMIT :limit
         """
-        return db.execute_query(query, {'limit': limit})
+        return db.execute_query(query, {'limit': limit, **filtros.params})
     
     # ==================== ESTADÍSTICAS DE MÉDICOS ====================
     
     @staticmethod
-    def total_medicos_por_especialidad() -> pd.DataFrame:
-        """Retorna el total de médicos agrupados por especialidad"""
-        query = """
+    @cache_estadisticas.cacheado(ttl=TTL_CATALOGO)
+    def total_medicos_por_especialidad(filtros: Filtros = SIN_FILTROS) -> pd.DataFrame:
+        """
+        Retorna el total de médicos agrupados por especialidad
+        
+        Args:
+            filtros: Sede y especialidad de los médicos (las fechas no aplican)
+        """
+        query = f"""
         SELECT 
-            especialidad,
+            m.especialidad,
             COUNT(*) as total_medicos
-        FROM medicos
-        GROUP BY especialidad
+        FROM medicos m
+        {_donde(filtros.medicos('m'))}
+        GROUP BY m.especialidad
         ORDER BY total_medicos DESC
         """
-        return db.execute_query(query)
+        return db.execute_query(query, filtros.params)
     
     @staticmethod
-    def promedio_citas_medico(periodo: str = 'mensual') -> pd.DataFrame:
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def promedio_citas_medico(periodo: str = 'mensual', filtros: Filtros = SIN_FILTROS) -> pd.DataFrame:
         """
         Retorna el promedio de citas atendidas por médico
         
         Args:
             periodo: 'mensual' o 'anual'
+            filtros: Alcance de médicos y citas (el rango se combina con el periodo)
         """
         if periodo == 'mensual':
             intervalo = 1
@@ -159,21 +295,24 @@ class EstadisticasQueries:
         FROM medicos m
         LEFT JOIN appointments a 
             ON m.identificacion = a.professional_identificacion
-            AND a.fecha >= DATE_SUB(CURDATE(), INTERVAL :intervalo {tipo})
+            AND a.fecha >= DATE_SUB(CURDATE(), INTERVAL :intervalo {tipo}){_y(filtros.fechas('a.fecha'))}
+        {_donde(filtros.medicos('m'))}
         GROUP BY m.identificacion, m.nombre, m.apellido, m.especialidad
         ORDER BY promedio_citas DESC
         """
-        return db.execute_query(query, {'intervalo': intervalo})
+        return db.execute_query(query, {'intervalo': intervalo, **filtros.params})
     
     @staticmethod
-    def medicos_mas_solicitados(limit: int = 10) -> pd.DataFrame:
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def medicos_mas_solicitados(limit: int = 10, filtros: Filtros = SIN_FILTROS) -> pd.DataFrame:
         """
         Retorna los médicos más solicitados por número de citas
         
         Args:
             limit: Número de médicos a retornar (default: 10)
+            filtros: Alcance de médicos y citas
         """
-        query = """
+        query = f"""
         SELECT 
             m.identificacion,
             m.nombre,
@@ -185,53 +324,68 @@ class EstadisticasQueries:
             SUM(CASE WHEN a.estado = 'cancelada' THEN 1 ELSE 0 END) as citas_canceladas
         FROM medicos m
         LEFT JOIN sedes s ON m.sede_id = s.id
-        LEFT JOIN appointments a ON m.identificacion = a.professional_identificacion
+        LEFT JOIN appointments a ON m.identificacion = a.professional_identificacion{_y(filtros.fechas('a.fecha'))}
+        {_donde(filtros.medicos('m'))}
         GROUP BY m.identificacion, m.nombre, m.apellido, m.especialidad, s.name
         ORDER BY total_citas DESC
         LIMIT :limit
         """
-        return db.execute_query(query, {'limit': limit})
+        return db.execute_query(query, {'limit': limit, **filtros.params})
     
     @staticmethod
-    def tasa_cancelacion_por_medico() -> pd.DataFrame:
-        """Calcula la tasa de cancelación por médico"""
-        query = """
-        SELECT 
-            m.identificacion,
-            m.nombre,
-            m.apellido,
-            m.especialidad,
-            COUNT(a.id) as total_citas,
-            SUM(CASE WHEN a.estado = 'cancelada' THEN 1 ELSE 0 END) as citas_canceladas,
-            ROUND(
-                (SUM(CASE WHEN a.estado = 'cancelada' THEN 1 ELSE 0 END) * 100.0) / COUNT(a.id), 
-                2
-            ) as tasa_cancelacion
-        FROM medicos m
-        LEFT JOIN appointments a ON m.identificacion = a.professional_identificacion
-        GROUP BY m.identificacion, m.nombre, m.apellido, m.especialidad
-        HAVING COUNT(a.id) > 0
-        ORDER BY tasa_cancelacion DESC
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def tasa_cancelacion_por_medico(filtros: Filtros = SIN_FILTROS) -> pd.DataFrame:
         """
-        return db.execute_query(query)
+        Calcula la tasa de cancelación por médico
+        
+        Args:
+            filtros: Alcance de médicos y citas
+        """
+        query = EstadisticasQueries._sql_tasa_cancelacion(False, False, filtros)
+        return db.execute_query(query, filtros.params)
     
     @staticmethod
-    def distribucion_citas_por_hora() -> pd.DataFrame:
-        """Retorna la distribución de citas por hora del día"""
-        query = """
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def distribucion_citas_por_hora(filtros: Filtros = SIN_FILTROS) -> pd.DataFrame:
+        """
+        Retorna la distribución de citas por hora del día
+        
+        Args:
+            filtros: Alcance de las citas contadas
+        """
+        if rollups.frescos():
+            query = f"""
+            SELECT 
+                hora,
+                CAST(SUM(total) AS SIGNED) as total_citas
+            FROM appointments_rollup
+            {_donde(filtros.rollup())}
+            GROUP BY hora
+            ORDER BY hora
+            """
+            return db.execute_query(query, filtros.params)
+        
+        query = f"""
         SELECT 
-            hora,
+            a.hora,
             COUNT(*) as total_citas
-        FROM appointments
-        GROUP BY hora
-        ORDER BY hora
+        FROM appointments a
+        {_donde(filtros.citas('a'))}
+        GROUP BY a.hora
+        ORDER BY a.hora
         """
-        return db.execute_query(query)
+        return db.execute_query(query, filtros.params)
     
     @staticmethod
-    def medicos_bloqueados_vs_activos() -> dict:
-        """Retorna estadísticas de médicos bloqueados vs activos"""
-        query = """
+    @cache_estadisticas.cacheado(ttl=TTL_BLOQUEOS)
+    def medicos_bloqueados_vs_activos(filtros: Filtros = SIN_FILTROS) -> dict:
+        """
+        Retorna estadísticas de médicos bloqueados vs activos
+        
+        Args:
+            filtros: Sede y especialidad de los médicos (las fechas no aplican)
+        """
+        query = f"""
         SELECT 
             CASE 
                 WHEN ub.id IS NOT NULL AND ub.is_active = TRUE 
@@ -244,23 +398,48 @@ class EstadisticasQueries:
         LEFT JOIN user_blocks ub 
             ON m.identificacion = ub.user_identifier 
             AND ub.user_type = 'medico'
+        {_donde(filtros.medicos('m'))}
         GROUP BY estado
         """
-        df = db.execute_query(query)
         result = {'activos': 0, 'bloqueados': 0}
-        for _, row in df.iterrows():
-            if row['estado'] == 'Bloqueados':
-                result['bloqueados'] = int(row['cantidad'])
+        for estado, cantidad in db.fetch_rows(query, filtros.params):
+            if estado == 'Bloqueados':
+                result['bloqueados'] = int(cantidad)
             else:
-                result['activos'] = int(row['cantidad'])
+                result['activos'] = int(cantidad)
         return result
     
     # ==================== ESTADÍSTICAS DE SEDES ====================
     
     @staticmethod
-    def total_citas_por_sede() -> pd.DataFrame:
-        """Retorna el total de citas por sede"""
-        query = """
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def total_citas_por_sede(filtros: Filtros = SIN_FILTROS) -> pd.DataFrame:
+        """
+        Retorna el total de citas por sede
+        
+        Args:
+            filtros: Alcance de sedes y citas (las sedes sin citas en el alcance salen con 0)
+        """
+        if rollups.frescos():
+            query = f"""
+            SELECT 
+                s.id,
+                s.name as sede_nombre,
+                s.address as direccion,
+                CAST(COALESCE(SUM(r.total), 0) AS SIGNED) as total_citas,
+                CAST(COALESCE(SUM(CASE WHEN r.estado = 'atendida' THEN r.total ELSE 0 END), 0) AS SIGNED) as citas_atendidas,
+                CAST(COALESCE(SUM(CASE WHEN r.estado = 'cancelada' THEN r.total ELSE 0 END), 0) AS SIGNED) as citas_canceladas,
+                CAST(COALESCE(SUM(CASE WHEN r.estado = 'pendiente' THEN r.total ELSE 0 END), 0) AS SIGNED) as citas_pendientes
+            FROM sedes s
+            LEFT JOIN appointments_rollup r
+                ON s.id = r.sede_id{_y(filtros.fechas('r.dia') + filtros.de_especialidad('r.especialidad'))}
+            {_donde(filtros.sede('s.id'))}
+            GROUP BY s.id, s.name, s.address
+            ORDER BY total_citas DESC
+            """
+            return db.execute_query(query, filtros.params)
+        
+        query = f"""
         SELECT 
             s.id,
             s.name as sede_nombre,
@@ -270,91 +449,481 @@ class EstadisticasQueries:
             SUM(CASE WHEN a.estado = 'cancelada' THEN 1 ELSE 0 END) as citas_canceladas,
             SUM(CASE WHEN a.estado = 'pendiente' THEN 1 ELSE 0 END) as citas_pendientes
         FROM sedes s
-        LEFT JOIN medicos m ON s.id = m.sede_id
-        LEFT JOIN appointments a ON m.identificacion = a.professional_identificacion
+        LEFT JOIN medicos m ON s.id = m.sede_id{_y(filtros.de_especialidad('m.especialidad'))}
+        LEFT JOIN appointments a
+            ON m.identificacion = a.professional_identificacion{_y(filtros.fechas('a.fecha'))}
+        {_donde(filtros.sede('s.id'))}
         GROUP BY s.id, s.name, s.address
         ORDER BY total_citas DESC
         """
-        return db.execute_query(query)
+        return db.execute_query(query, filtros.params)
     
     @staticmethod
-    def especialidades_por_sede() -> pd.DataFrame:
-        """Retorna las especialidades más demandadas por sede"""
-        query = """
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def especialidades_por_sede(filtros: Filtros = SIN_FILTROS) -> pd.DataFrame:
+        """
+        Retorna las especialidades más demandadas por sede
+        
+        Args:
+            filtros: Alcance de sedes, médicos y citas
+        """
+        if rollups.frescos():
+            query = f"""
+            SELECT 
+                s.name as sede_nombre,
+                r.especialidad,
+                CAST(SUM(r.total) AS SIGNED) as total_citas
+            FROM sedes s
+            INNER JOIN appointments_rollup r ON s.id = r.sede_id
+            {_donde(filtros.rollup('r'))}
+            GROUP BY s.name, r.especialidad
+            HAVING total_citas > 0
+            ORDER BY s.name, total_citas DESC
+            """
+            return db.execute_query(query, filtros.params)
+        
+        query = f"""
         SELECT 
             s.name as sede_nombre,
             m.especialidad,
             COUNT(a.id) as total_citas
         FROM sedes s
         LEFT JOIN medicos m ON s.id = m.sede_id
-        LEFT JOIN appointments a ON m.identificacion = a.professional_identificacion
+        LEFT JOIN appointments a
+            ON m.identificacion = a.professional_identificacion{_y(filtros.fechas('a.fecha'))}
+        {_donde(filtros.sede('s.id') + filtros.de_especialidad('m.especialidad'))}
         GROUP BY s.name, m.especialidad
         HAVING total_citas > 0
         ORDER BY s.name, total_citas DESC
         """
-        return db.execute_query(query)
+        return db.execute_query(query, filtros.params)
     
     # ==================== ESTADÍSTICAS GENERALES DE CITAS ====================
     
     @staticmethod
-    def citas_por_estado() -> pd.DataFrame:
-        """Retorna el total de citas agrupadas por estado"""
-        query = """
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def citas_por_estado(filtros: Filtros = SIN_FILTROS) -> pd.DataFrame:
+        """
+        Retorna el total de citas agrupadas por estado
+        
+        Args:
+            filtros: Alcance de las citas contadas
+        """
+        if rollups.frescos():
+            query = f"""
+            SELECT 
+                estado,
+                CAST(SUM(total) AS SIGNED) as total
+            FROM appointments_rollup
+            {_donde(filtros.rollup())}
+            GROUP BY estado
+            ORDER BY total DESC
+            """
+            return db.execute_query(query, filtros.params)
+        
+        query = f"""
         SELECT 
-            estado,
+            a.estado,
             COUNT(*) as total
-        FROM appointments
-        GROUP BY estado
+        FROM appointments a
+        {_donde(filtros.citas('a'))}
+        GROUP BY a.estado
         ORDER BY total DESC
         """
-        return db.execute_query(query)
+        return db.execute_query(query, filtros.params)
     
     @staticmethod
-    def tendencia_citas_por_mes(meses: int = 12) -> pd.DataFrame:
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def tendencia_citas_por_mes(meses: int = 12, filtros: Filtros = SIN_FILTROS) -> pd.DataFrame:
         """
         Retorna la evolución de citas por mes
         
         Args:
             meses: Número de meses hacia atrás (default: 12)
+            filtros: Alcance de las citas contadas (el rango se combina con `meses`)
         """
-        query = """
+        if rollups.frescos():
+            query = f"""
+            SELECT 
+                DATE_FORMAT(dia, '%Y-%m') as mes,
+                CAST(SUM(total) AS SIGNED) as total_citas,
+                CAST(SUM(CASE WHEN estado = 'atendida' THEN total ELSE 0 END) AS SIGNED) as atendidas,
+                CAST(SUM(CASE WHEN estado = 'cancelada' THEN total ELSE 0 END) AS SIGNED) as canceladas,
+                CAST(SUM(CASE WHEN estado = 'pendiente' THEN total ELSE 0 END) AS SIGNED) as pendientes
+            FROM appointments_rollup
+            WHERE dia >= DATE_SUB(CURDATE(), INTERVAL :meses MONTH){_y(filtros.rollup())}
+            GROUP BY mes
+            ORDER BY mes
+            """
+            return db.execute_query(query, {'meses': meses, **filtros.params})
+        
+        query = f"""
         SELECT 
-            DATE_FORMAT(fecha, '%Y-%m') as mes,
+            DATE_FORMAT(a.fecha, '%Y-%m') as mes,
             COUNT(*) as total_citas,
-            SUM(CASE WHEN estado = 'atendida' THEN 1 ELSE 0 END) as atendidas,
-            SUM(CASE WHEN estado = 'cancelada' THEN 1 ELSE 0 END) as canceladas,
-            SUM(CASE WHEN estado = 'pendiente' THEN 1 ELSE 0 END) as pendientes
-        FROM appointments
-        WHERE fecha >= DATE_SUB(CURDATE(), INTERVAL :meses MONTH)
+            SUM(CASE WHEN a.estado = 'atendida' THEN 1 ELSE 0 END) as atendidas,
+            SUM(CASE WHEN a.estado = 'cancelada' THEN 1 ELSE 0 END) as canceladas,
+            SUM(CASE WHEN a.estado = 'pendiente' THEN 1 ELSE 0 END) as pendientes
+        FROM appointments a
+        WHERE a.fecha >= DATE_SUB(CURDATE(), INTERVAL :meses MONTH){_y(filtros.citas('a'))}
         GROUP BY mes
         ORDER BY mes
         """
-        return db.execute_query(query, {'meses': meses})
+        return db.execute_query(query, {'meses': meses, **filtros.params})
     
     @staticmethod
-    def especialidades_mas_demandadas() -> pd.DataFrame:
-        """Retorna las especialidades más demandadas"""
-        query = """
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def especialidades_mas_demandadas(filtros: Filtros = SIN_FILTROS) -> pd.DataFrame:
+        """
+        Retorna las especialidades más demandadas
+        
+        Args:
+            filtros: Alcance de las citas contadas
+        """
+        if rollups.frescos():
+            query = f"""
+            SELECT 
+                r.especialidad,
+                CAST(SUM(r.total) AS SIGNED) as total_citas
+            FROM appointments_rollup r
+            INNER JOIN medicos m ON r.medico_id = m.identificacion
+            {_donde(filtros.rollup('r'))}
+            GROUP BY r.especialidad
+            ORDER BY total_citas DESC
+            """
+            return db.execute_query(query, filtros.params)
+        
+        query = f"""
         SELECT 
             m.especialidad,
             COUNT(a.id) as total_citas
         FROM appointments a
         INNER JOIN medicos m ON a.professional_identificacion = m.identificacion
+        {_donde(filtros.citas('a', medico='m'))}
         GROUP BY m.especialidad
         ORDER BY total_citas DESC
         """
-        return db.execute_query(query)
+        return db.execute_query(query, filtros.params)
     
     @staticmethod
-    def horarios_pico() -> pd.DataFrame:
-        """Retorna los horarios con más citas"""
-        query = """
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def horarios_pico(filtros: Filtros = SIN_FILTROS) -> pd.DataFrame:
+        """
+        Retorna los horarios con más citas
+        
+        Args:
+            filtros: Alcance de las citas contadas (también el del total del porcentaje)
+        """
+        if rollups.frescos():
+            donde = _donde(filtros.rollup())
+            query = f"""
+            SELECT 
+                hora,
+                CAST(SUM(total) AS SIGNED) as total_citas,
+                ROUND((SUM(total) * 100.0) / (SELECT SUM(total) FROM appointments_rollup {donde}), 2) as porcentaje
+            FROM appointments_rollup
+            {donde}
+            GROUP BY hora
+            ORDER BY total_citas DESC
+            """
+            return db.execute_query(query, filtros.params)
+        
+        donde = _donde(filtros.citas('a'))
+        query = f"""
         SELECT 
-            hora,
+            a.hora,
             COUNT(*) as total_citas,
-            ROUND((COUNT(*) * 100.0) / (SELECT COUNT(*) FROM appointments), 2) as porcentaje
-        FROM appointments
-        GROUP BY hora
+            ROUND((COUNT(*) * 100.0) / (SELECT COUNT(*) FROM appointments a {donde}), 2) as porcentaje
+        FROM appointments a
+        {donde}
+        GROUP BY a.hora
         ORDER BY total_citas DESC
         """
-        return db.execute_query(query)
+        return db.execute_query(query, filtros.params)
+    
+    # ==================== LISTADOS PAGINADOS (KEYSET) ====================
+    
+    @staticmethod
+    def _sql_pacientes_activos(con_cursor: bool, con_limite: bool,
+                               filtros: Filtros = SIN_FILTROS) -> str:
+        """
+        SQL de pacientes_activos ordenado por (total_citas, user_id) descendente,
+        que es la clave del cursor; el filtro del cursor va en HAVING porque
+        total_citas es un agregado
+        """
+        having = """
+        HAVING total_citas < :cursor_total
+            OR (total_citas = :cursor_total AND u.user_id < :cursor_id)""" if con_cursor else ""
+        limite = "LIMIT :limit" if con_limite else ""
+        return f"""
+        SELECT 
+            u.user_id,
+            u.nombre,
+            u.apellido,
+            u.tipo_documento,
+            COUNT(a.id) as total_citas
+        FROM users u
+        INNER JOIN appointments a ON u.user_id = a.user_id
+        WHERE a.fecha >= DATE_SUB(CURDATE(), INTERVAL :meses MONTH){_y(filtros.citas('a'))}
+        GROUP BY u.user_id, u.nombre, u.apellido, u.tipo_documento{having}
+        ORDER BY total_citas DESC, u.user_id DESC
+        {limite}
+        """
+    
+    @staticmethod
+    def _sql_tasa_cancelacion(con_cursor: bool, con_limite: bool,
+                              filtros: Filtros = SIN_FILTROS) -> str:
+        """
+        SQL de tasa_cancelacion_por_medico ordenado por (tasa_cancelacion,
+        identificacion) descendente, que es la clave del cursor
+        """
+        cursor = """
+            AND (tasa_cancelacion < :cursor_tasa
+                OR (tasa_cancelacion = :cursor_tasa AND m.identificacion < :cursor_id))""" if con_cursor else ""
+        limite = "LIMIT :limit" if con_limite else ""
+        return f"""
+        SELECT 
+            m.identificacion,
+            m.nombre,
+            m.apellido,
+            m.especialidad,
+            COUNT(a.id) as total_citas,
+            SUM(CASE WHEN a.estado = 'cancelada' THEN 1 ELSE 0 END) as citas_canceladas,
+            ROUND(
+                (SUM(CASE WHEN a.estado = 'cancelada' THEN 1 ELSE 0 END) * 100.0) / COUNT(a.id), 
+                2
+            ) as tasa_cancelacion
+        FROM medicos m
+        LEFT JOIN appointments a ON m.identificacion = a.professional_identificacion{_y(filtros.fechas('a.fecha'))}
+        {_donde(filtros.medicos('m'))}
+        GROUP BY m.identificacion, m.nombre, m.apellido, m.especialidad
+        HAVING COUNT(a.id) > 0{cursor}
+        ORDER BY tasa_cancelacion DESC, m.identificacion DESC
+        {limite}
+        """
+    
+    @staticmethod
+    def _pagina(query: str, params: dict, limit: int, claves: Tuple[str, str]) -> Dict[str, Any]:
+        """
+        Ejecuta una query paginada pidiendo limit + 1 filas: la fila extra solo
+        indica que hay una página siguiente, cuyo cursor son las claves de la
+        última fila entregada
+        """
+        df = db.execute_query(query, {**params, 'limit': limit + 1})
+        siguiente = None
+        if len(df) > limit:
+            df = df.iloc[:limit]
+            ultima = df.iloc[-1]
+            siguiente = tuple(
+                ultima[clave].item() if hasattr(ultima[clave], 'item') else ultima[clave]
+                for clave in claves
+            )
+        return {'filas': df, 'siguiente_cursor': siguiente}
+    
+    @staticmethod
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def pagina_pacientes_activos(meses: int = 6, limit: int = 100,
+                                 cursor: Optional[Tuple[int, int]] = None,
+                                 filtros: Filtros = SIN_FILTROS) -> Dict[str, Any]:
+        """
+        Retorna una página de pacientes_activos (paginación por keyset)
+        
+        Args:
+            meses: Número de meses hacia atrás (default: 6)
+            limit: Pacientes por página (default: 100)
+            cursor: (total_citas, user_id) de la última fila de la página
+                anterior, o None para la primera página
+            filtros: Alcance de las citas contadas
+            
+        Returns:
+            {'filas': DataFrame de la página, 'siguiente_cursor': tupla o None si es la última}
+        """
+        params = {'meses': meses, **filtros.params}
+        if cursor is not None:
+            params.update(cursor_total=cursor[0], cursor_id=cursor[1])
+        query = EstadisticasQueries._sql_pacientes_activos(cursor is not None, True, filtros)
+        return EstadisticasQueries._pagina(query, params, limit, ('total_citas', 'user_id'))
+    
+    @staticmethod
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def pagina_tasa_cancelacion(limit: int = 100,
+                                cursor: Optional[Tuple[Any, str]] = None,
+                                filtros: Filtros = SIN_FILTROS) -> Dict[str, Any]:
+        """
+        Retorna una página de tasa_cancelacion_por_medico (paginación por keyset)
+        
+        Args:
+            limit: Médicos por página (default: 100)
+            cursor: (tasa_cancelacion, identificacion) de la última fila de la
+                página anterior, o None para la primera página
+            filtros: Alcance de médicos y citas
+            
+        Returns:
+            {'filas': DataFrame de la página, 'siguiente_cursor': tupla o None si es la última}
+        """
+        params = dict(filtros.params)
+        if cursor is not None:
+            params.update(cursor_tasa=cursor[0], cursor_id=cursor[1])
+        query = EstadisticasQueries._sql_tasa_cancelacion(cursor is not None, True, filtros)
+        return EstadisticasQueries._pagina(query, params, limit, ('tasa_cancelacion', 'identificacion'))
+    
+    @staticmethod
+    def iterar_pacientes_activos(meses: int = 6,
+                                 cursor: Optional[Tuple[int, int]] = None,
+                                 filtros: Filtros = SIN_FILTROS) -> Iterator[dict]:
+        """
+        Recorre pacientes_activos fila a fila con un cursor del lado del
+        servidor (sin caché), desde `cursor` hasta el final
+        """
+        params = {'meses': meses, **filtros.params}
+        if cursor is not None:
+            params.update(cursor_total=cursor[0], cursor_id=cursor[1])
+        query = EstadisticasQueries._sql_pacientes_activos(cursor is not None, False, filtros)
+        with nombrar_consulta("iterar_pacientes_activos"):
+            return db.stream_rows(query, params)
+    
+    @staticmethod
+    def iterar_tasa_cancelacion(cursor: Optional[Tuple[Any, str]] = None,
+                                filtros: Filtros = SIN_FILTROS) -> Iterator[dict]:
+        """
+        Recorre tasa_cancelacion_por_medico fila a fila con un cursor del lado
+        del servidor (sin caché), desde `cursor` hasta el final
+        """
+        params = dict(filtros.params)
+        if cursor is not None:
+            params.update(cursor_tasa=cursor[0], cursor_id=cursor[1])
+        query = EstadisticasQueries._sql_tasa_cancelacion(cursor is not None, False, filtros)
+        with nombrar_consulta("iterar_tasa_cancelacion"):
+            return db.stream_rows(query, params)
+    
+    # ==================== AGREGACIÓN FUSIONADA ====================
+    
+    @staticmethod
+    @cache_estadisticas.cacheado(ttl=TTL_CITAS)
+    def estadisticas_citas_fusionadas(meses: int = 12,
+                                      filtros: Filtros = SIN_FILTROS) -> Dict[str, pd.DataFrame]:
+        """
+        Calcula en un solo recorrido de appointments (o del rollup, si está fresco)
+        las estadísticas de citas que de otro modo requieren 7 queries:
+        citas_por_estado, distribucion_citas_por_hora, horarios_pico,
+        tendencia_citas_por_mes, especialidades_mas_demandadas,
+        total_citas_por_sede y especialidades_por_sede
+        
+        Args:
+            meses: Meses hacia atrás para la tendencia mensual (default: 12)
+            filtros: Alcance de las citas (y de las sedes listadas)
+            
+        Returns:
+            Diccionario nombre de la estadística -> DataFrame con las mismas
+            columnas que el método individual correspondiente
+        """
+        if rollups.frescos():
+            query = f"""
+            SELECT 
+                DATE_FORMAT(r.dia, '%Y-%m') as mes,
+                r.dia >= DATE_SUB(CURDATE(), INTERVAL :meses MONTH) as en_ventana,
+                r.hora,
+                r.estado,
+                r.especialidad,
+                r.sede_id,
+                m.identificacion IS NOT NULL as con_medico,
+                CAST(SUM(r.total) AS SIGNED) as total
+            FROM appointments_rollup r
+            LEFT JOIN medicos m ON r.medico_id = m.identificacion
+            {_donde(filtros.rollup('r'))}
+            GROUP BY mes, en_ventana, r.hora, r.estado, r.especialidad, r.sede_id, con_medico
+            """
+        else:
+            query = f"""
+            SELECT 
+                DATE_FORMAT(a.fecha, '%Y-%m') as mes,
+                a.fecha >= DATE_SUB(CURDATE(), INTERVAL :meses MONTH) as en_ventana,
+                a.hora,
+                a.estado,
+                m.especialidad,
+                m.sede_id,
+                m.identificacion IS NOT NULL as con_medico,
+                COUNT(*) as total
+            FROM appointments a
+            LEFT JOIN medicos m ON a.professional_identificacion = m.identificacion
+            {_donde(filtros.citas('a', medico='m'))}
+            GROUP BY mes, en_ventana, a.hora, a.estado, m.especialidad, m.sede_id, con_medico
+            """
+        base = db.execute_query(query, {'meses': meses, **filtros.params})
+        sedes = db.execute_query(
+            f"SELECT s.id, s.name as sede_nombre, s.address as direccion FROM sedes s {_donde(filtros.sede('s.id'))}",
+            filtros.params
+        )
+        return EstadisticasQueries._dividir_agregado(base, sedes)
+    
+    @staticmethod
+    def _dividir_agregado(base: pd.DataFrame, sedes: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """Reparte el agregado fusionado en los DataFrames de cada estadística"""
+        if base.empty:
+            base = pd.DataFrame(columns=[
+                'mes', 'en_ventana', 'hora', 'estado', 'especialidad', 'sede_id', 'con_medico', 'total'
+            ])
+        base['total'] = base['total'].astype('int64')
+        
+        def _por_estado(df: pd.DataFrame, claves: list) -> pd.DataFrame:
+            """Suma el total y los conteos atendida/cancelada/pendiente por `claves`"""
+            estados = ['atendida', 'cancelada', 'pendiente']
+            if df.empty:
+                return pd.DataFrame(columns=claves + ['total_citas'] + estados)
+            tabla = df.pivot_table(index=claves, columns='estado', values='total',
+                                   aggfunc='sum', fill_value=0)
+            tabla = tabla.reindex(columns=estados, fill_value=0)
+            tabla.columns.name = None
+            tabla.insert(0, 'total_citas', df.groupby(claves)['total'].sum())
+            return tabla.reset_index()
+        
+        citas_estado = (base.groupby('estado', as_index=False)['total'].sum()
+                        .sort_values('total', ascending=False, kind='stable'))
+        
+        por_hora = base.groupby('hora', as_index=False)['total'].sum().rename(columns={'total': 'total_citas'})
+        distribucion_horas = por_hora.sort_values('hora', kind='stable')
+        total_general = por_hora['total_citas'].sum()
+        horarios_pico = por_hora.assign(
+            porcentaje=(por_hora['total_citas'] * 100.0 / total_general).round(2) if total_general else 0.0
+        ).sort_values('total_citas', ascending=False, kind='stable')
+        
+        ventana = base[base['en_ventana'].astype(bool)]
+        tendencia = _por_estado(ventana, ['mes']).rename(columns={
+            'atendida': 'atendidas', 'cancelada': 'canceladas', 'pendiente': 'pendientes'
+        })[['mes', 'total_citas', 'atendidas', 'canceladas', 'pendientes']].sort_values('mes')
+        
+        con_medico = base[base['con_medico'].astype(bool)]
+        especialidades = (con_medico.groupby('especialidad', as_index=False, dropna=False)['total'].sum()
+                          .rename(columns={'total': 'total_citas'})
+                          .sort_values('total_citas', ascending=False, kind='stable'))
+        
+        por_sede = _por_estado(base[base['sede_id'].notna()], ['sede_id']).rename(columns={
+            'sede_id': 'id', 'atendida': 'citas_atendidas',
+            'cancelada': 'citas_canceladas', 'pendiente': 'citas_pendientes'
+        })
+        citas_sedes = sedes.merge(por_sede, on='id', how='left')
+        columnas_conteo = ['total_citas', 'citas_atendidas', 'citas_canceladas', 'citas_pendientes']
+        citas_sedes[columnas_conteo] = citas_sedes[columnas_conteo].fillna(0).astype('int64')
+        citas_sedes = citas_sedes[['id', 'sede_nombre', 'direccion'] + columnas_conteo] \
+            .sort_values('total_citas', ascending=False, kind='stable')
+        
+        especialidades_sedes = (base[base['sede_id'].notna()]
+                                .merge(sedes[['id', 'sede_nombre']], left_on='sede_id', right_on='id')
+                                .groupby(['sede_nombre', 'especialidad'], as_index=False, dropna=False)['total'].sum()
+                                .rename(columns={'total': 'total_citas'}))
+        especialidades_sedes = especialidades_sedes[especialidades_sedes['total_citas'] > 0] \
+            .sort_values(['sede_nombre', 'total_citas'], ascending=[True, False], kind='stable')
+        
+        # Los NULL de especialidad se devuelven como None, igual que las queries individuales
+        for df in (especialidades, especialidades_sedes):
+            df['especialidad'] = df['especialidad'].astype(object).where(df['especialidad'].notna(), None)
+        
+        return {
+            'citas_por_estado': citas_estado.reset_index(drop=True),
+            'distribucion_citas_por_hora': distribucion_horas.reset_index(drop=True),
+            'horarios_pico': horarios_pico.reset_index(drop=True),
+            'tendencia_citas_por_mes': tendencia.reset_index(drop=True),
+            'especialidades_mas_demandadas': especialidades.reset_index(drop=True),
+            'total_citas_por_sede': citas_sedes.reset_index(drop=True),
+            'especialidades_por_sede': especialidades_sedes.reset_index(drop=True),
+        }
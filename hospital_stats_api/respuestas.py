@@ -0,0 +1,412 @@
+"""
+respuestas.py - Utilidades HTTP para las respuestas de la API: ETags y peticiones
+condicionales, negociación de compresión (gzip/brotli), descargas por rangos y
+respuestas JSON de estadísticas, cursores de paginación y NDJSON
+"""
+import base64
+import binascii
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import brotli
+except ImportError:  # sin brotli solo se ofrece gzip
+    brotli = None
+
+try:
+    import orjson
+except ImportError:  # sin orjson se serializa con json de la biblioteca estándar
+    orjson = None
+
+TAMANO_BLOQUE = 64 * 1024
+
+# Extensión de las variantes precomprimidas de un archivo
+EXTENSIONES = {"br": ".br", "gzip": ".gz"}
+
+
+def codificaciones_disponibles() -> List[str]:
+    """Codificaciones soportadas, en orden de preferencia del servidor"""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def comprimir(contenido: bytes, codificacion: str, rapido: bool = False) -> bytes:
+    """
+    Comprime un contenido con la codificación indicada
+
+    Args:
+        contenido: Bytes a comprimir
+        codificacion: "br" o "gzip"
+        rapido: Usar un nivel de compresión moderado (respuestas dinámicas)
+            en lugar del máximo (artefactos que se comprimen una sola vez)
+
+    Returns:
+        Bytes comprimidos
+    """
+    if codificacion == "br":
+        return brotli.compress(contenido, quality=5 if rapido else 11)
+    if codificacion == "gzip":
+        return gzip.compress(contenido, compresslevel=6 if rapido else 9, mtime=0)
+    raise ValueError(f"Codificación no soportada: {codificacion}")
+
+
+def elegir_codificacion(accept_encoding: Optional[str], disponibles: Iterable[str]) -> Optional[str]:
+    """
+    Elige la codificación a usar según el encabezado Accept-Encoding
+
+    Args:
+        accept_encoding: Valor del encabezado (puede ser None)
+        disponibles: Codificaciones que el servidor puede ofrecer, por preferencia
+
+    Returns:
+        La codificación aceptada con mayor q (a igual q, la primera de `disponibles`),
+        o None para enviar el contenido sin comprimir
+    """
+    if not accept_encoding:
+        return None
+    pesos: Dict[str, float] = {}
+    for parte in accept_encoding.split(","):
+        token, _, parametros = parte.strip().partition(";")
+        q = 1.0
+        coincidencia = re.search(r"q=([0-9.]+)", parametros)
+        if coincidencia:
+            try:
+                q = float(coincidencia.group(1))
+            except ValueError:
+                q = 0.0
+        pesos[token.strip().lower()] = q
+
+    mejor, mejor_q = None, 0.0
+    for codificacion in disponibles:
+        q = pesos.get(codificacion, pesos.get("*", 0.0))
+        if q > mejor_q:
+            mejor, mejor_q = codificacion, q
+    return mejor
+
+
+def etag_de(contenido: bytes) -> str:
+    """ETag fuerte a partir del hash del contenido"""
+    return f'"{hashlib.sha256(contenido).hexdigest()[:32]}"'
+
+
+def etag_variante(etag: str, codificacion: Optional[str]) -> str:
+    """ETag de una variante comprimida (cada representación necesita el suyo)"""
+    if codificacion is None:
+        return etag
+    return f'{etag[:-1]}-{codificacion}"'
+
+
+def _actualizar_hash(h: "hashlib._Hash", valor: Any):
+    """Añade al hash un resultado de EstadisticasQueries (DataFrame, dict o escalar)"""
+    if isinstance(valor, pd.DataFrame):
+        h.update(repr(list(valor.columns)).encode())
+        h.update(repr([str(t) for t in valor.dtypes]).encode())
+        h.update(pd.util.hash_pandas_object(valor, index=True).values.tobytes())
+    elif isinstance(valor, dict):
+        for clave in sorted(valor, key=str):
+            h.update(repr(clave).encode())
+            _actualizar_hash(h, valor[clave])
+    else:
+        h.update(repr(valor).encode())
+
+
+def etag_resultados(resultados: Dict[str, Any], recurso: str = "") -> str:
+    """
+    ETag débil calculado a partir de los resultados de las queries, antes de
+    construir y serializar el JSON: si los datos no cambian el ETag tampoco
+
+    Args:
+        resultados: Diccionario clave -> resultado de la query
+        recurso: Identificador del endpoint (ETags distintos por endpoint)
+
+    Returns:
+        ETag débil (W/"...")
+    """
+    h = hashlib.sha256(recurso.encode())
+    _actualizar_hash(h, resultados)
+    return f'W/"{h.hexdigest()[:32]}"'
+
+
+def coincide_etag(if_none_match: Optional[str], etags: Iterable[str]) -> bool:
+    """
+    Comparación débil de If-None-Match contra los ETags de un recurso
+
+    Args:
+        if_none_match: Valor del encabezado (puede ser None)
+        etags: ETags de todas las variantes del recurso
+
+    Returns:
+        True si el cliente ya tiene una versión vigente (responder 304)
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    enviados = {e.strip().removeprefix("W/") for e in if_none_match.split(",")}
+    return any(etag.removeprefix("W/") in enviados for etag in etags)
+
+
+def hash_archivo(ruta: str) -> str:
+    """SHA-256 hexadecimal de un archivo, leído por bloques"""
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def precomprimir_archivo(ruta: str) -> Dict[str, str]:
+    """
+    Escribe junto a `ruta` sus variantes comprimidas (reporte.html.gz, reporte.html.br)
+    para no comprimir en cada descarga
+
+    Args:
+        ruta: Archivo a comprimir
+
+    Returns:
+        Diccionario codificación -> ruta de la variante
+    """
+    with open(ruta, "rb") as f:
+        contenido = f.read()
+    variantes = {}
+    for codificacion in codificaciones_disponibles():
+        destino = ruta + EXTENSIONES[codificacion]
+        temporal = destino + ".tmp"
+        with open(temporal, "wb") as f:
+            f.write(comprimir(contenido, codificacion))
+        os.replace(temporal, destino)
+        variantes[codificacion] = destino
+    return variantes
+
+
+def parsear_rango(range_header: Optional[str], tamano: int) -> Optional[Tuple[int, int]]:
+    """
+    Interpreta un encabezado Range de un solo intervalo
+
+    Args:
+        range_header: Valor del encabezado, p. ej. "bytes=0-1023" o "bytes=-500"
+        tamano: Tamaño total del recurso
+
+    Returns:
+        (inicio, fin) inclusivos, o None si no hay rango o no se puede servir
+        como rango único (se responde el recurso completo)
+
+    Raises:
+        ValueError: Si el rango está fuera del recurso (responder 416)
+    """
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    coincidencia = re.fullmatch(r"\s*(\d*)-(\d*)\s*", range_header[len("bytes="):])
+    if not coincidencia or coincidencia.groups() == ("", ""):
+        return None  # varios rangos o sintaxis inválida: se envía el recurso completo
+    inicio_txt, fin_txt = coincidencia.groups()
+
+    if inicio_txt == "":
+        sufijo = int(fin_txt)
+        if sufijo == 0 or tamano == 0:
+            raise ValueError("Rango no satisfacible")
+        return max(0, tamano - sufijo), tamano - 1
+
+    inicio = int(inicio_txt)
+    fin = int(fin_txt) if fin_txt else tamano - 1
+    if inicio >= tamano:
+        raise ValueError("Rango no satisfacible")
+    if fin < inicio:
+        return None
+    return inicio, min(fin, tamano - 1)
+
+
+def leer_rango(ruta: str, inicio: int, fin: int) -> Iterator[bytes]:
+    """Lee los bytes [inicio, fin] de un archivo por bloques"""
+    with open(ruta, "rb") as f:
+        f.seek(inicio)
+        restantes = fin - inicio + 1
+        while restantes > 0:
+            bloque = f.read(min(TAMANO_BLOQUE, restantes))
+            if not bloque:
+                break
+            restantes -= len(bloque)
+            yield bloque
+
+
+def _valor_json(valor: Any) -> Any:
+    """Convierte los tipos que orjson no serializa de forma nativa"""
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, np.generic):
+        return valor.item()
+    if isinstance(valor, pd.Timestamp):
+        return valor.isoformat()
+    if valor is pd.NA or valor is pd.NaT:
+        return None
+    raise TypeError(f"Tipo no serializable a JSON: {type(valor).__name__}")
+
+
+def serializar_json(contenido: Any) -> bytes:
+    """
+    Serializa una respuesta a JSON con orjson: escribe directamente los arrays
+    de NumPy (formato columnar) sin crear un objeto Python por valor, y los NaN
+    como null
+
+    Args:
+        contenido: Diccionario/lista a serializar
+
+    Returns:
+        JSON en UTF-8
+    """
+    if orjson is None:
+        return JSONResponse(contenido).body
+    return orjson.dumps(
+        contenido,
+        default=_valor_json,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    )
+
+
+def columnar(df: pd.DataFrame) -> Dict[str, list]:
+    """
+    Forma columnar de un DataFrame: los nombres de columna una sola vez y un
+    array de valores por columna, en lugar de un dict por fila
+
+    Returns:
+        {"columnas": [...], "valores": [[valores columna 1], [valores columna 2], ...]}
+    """
+    valores = []
+    for columna in df.columns:
+        datos = df[columna].to_numpy()
+        if orjson is not None and datos.dtype.kind in "biuf":
+            # orjson solo acepta arrays contiguos; las columnas numéricas van sin copiar a listas
+            valores.append(np.ascontiguousarray(datos))
+        else:
+            valores.append(df[columna].tolist())
+    return {"columnas": [str(c) for c in df.columns], "valores": valores}
+
+
+def codificar_cursor(valores: Optional[Tuple[Any, ...]]) -> Optional[str]:
+    """
+    Cursor opaco de paginación: las claves de la última fila en JSON y base64
+    URL-safe. Los Decimal se guardan como texto para no perder precisión.
+    """
+    if valores is None:
+        return None
+    crudo = json.dumps(list(valores), default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: Optional[str], n_claves: int = 2) -> Optional[list]:
+    """
+    Decodifica un cursor de `codificar_cursor`
+
+    Raises:
+        ValueError: Si el cursor está mal formado (el endpoint responde 400)
+    """
+    if not cursor:
+        return None
+    try:
+        crudo = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        valores = json.loads(crudo)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Cursor inválido")
+    if not isinstance(valores, list) or len(valores) != n_claves:
+        raise ValueError("Cursor inválido")
+    return valores
+
+
+def lineas_ndjson(filas: Iterable[dict], tamano_trozo: int = TAMANO_BLOQUE) -> Iterator[bytes]:
+    """
+    Serializa filas como NDJSON (un objeto JSON por línea), juntándolas en
+    trozos de ~tamano_trozo bytes para no hacer una escritura por fila
+
+    Args:
+        filas: Iterador de filas (p. ej. de DatabaseConnection.stream_rows)
+        tamano_trozo: Bytes mínimos de cada trozo enviado
+
+    Returns:
+        Iterador de trozos de bytes
+    """
+    trozo = bytearray()
+    for fila in filas:
+        trozo += serializar_json(fila)
+        trozo += b"\n"
+        if len(trozo) >= tamano_trozo:
+            yield bytes(trozo)
+            trozo.clear()
+    if trozo:
+        yield bytes(trozo)
+
+
+class CacheCuerpos:
+    """
+    Guarda los cuerpos JSON ya serializados (y comprimidos) por ETag, para no
+    volver a serializar ni comprimir datos que no cambiaron
+    """
+
+    def __init__(self, max_entradas: int = 64):
+        self.max_entradas = max_entradas
+        self._entradas: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave: Hashable, calcular: Callable[[], bytes]) -> bytes:
+        """Retorna el cuerpo guardado para `clave` o lo calcula y lo guarda"""
+        with self._lock:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                return self._entradas[clave]
+        cuerpo = calcular()
+        with self._lock:
+            self._entradas[clave] = cuerpo
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return cuerpo
+
+
+cache_cuerpos = CacheCuerpos(max_entradas=int(os.getenv("STATS_CACHE_CUERPOS", "64")))
+
+# Por debajo de este tamaño el JSON se envía sin comprimir
+MIN_BYTES_COMPRESION = int(os.getenv("STATS_COMPRESION_MIN_BYTES", "1024"))
+
+
+def responder_json(
+    request: Request,
+    resultados: Dict[str, Any],
+    armar: Callable[[Dict[str, Any]], Any]
+) -> Response:
+    """
+    Responde un endpoint de estadísticas con ETag, 304 y compresión negociada
+
+    Args:
+        request: Petición actual (If-None-Match, Accept-Encoding)
+        resultados: Resultados de las queries del endpoint
+        armar: Función que construye el JSON a partir de los resultados; solo se
+            llama si el cliente no tiene ya la versión vigente y no está en caché
+
+    Returns:
+        304 sin cuerpo, o el JSON (comprimido si es grande y el cliente lo acepta)
+    """
+    recurso = str(request.url.path) + "?" + str(request.url.query)
+    etag = etag_resultados(resultados, recurso)
+    encabezados = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if coincide_etag(request.headers.get("if-none-match"), [etag]):
+        return Response(status_code=304, headers=encabezados)
+
+    cuerpo = cache_cuerpos.obtener((recurso, etag, None), lambda: serializar_json(armar(resultados)))
+    codificacion = None
+    if len(cuerpo) >= MIN_BYTES_COMPRESION:
+        codificacion = elegir_codificacion(request.headers.get("accept-encoding"), codificaciones_disponibles())
+    if codificacion is not None:
+        cuerpo = cache_cuerpos.obtener(
+            (recurso, etag, codificacion), lambda: comprimir(cuerpo, codificacion, rapido=True)
+        )
+        encabezados["Content-Encoding"] = codificacion
+    return Response(cuerpo, media_type="application/json", headers=encabezados)
@@ -0,0 +1,385 @@
+"""
+rollups.py - Tablas de agregados de citas mantenidas de forma incremental
+
+La tabla `appointments_rollup` guarda el número de citas por
+día × médico × sede × especialidad × hora × estado. Unos triggers sobre
+`appointments` anotan en `appointments_rollup_cambios` cada (día, médico) tocado
+por un INSERT/UPDATE/DELETE, y otros sobre `medicos` anotan todos los cortes de un
+médico cuando cambian su sede, su especialidad o su identificación (el rollup copia
+esas columnas). El refresco solo recalcula los cortes anotados y borra exactamente
+los cambios que leyó: uno cuya transacción confirma tarde queda para el siguiente.
+
+Crear las tablas y los triggers es un paso de migración explícito (necesita permiso
+TRIGGER y agrega escrituras a cada cambio de appointments): al iniciar, la API solo
+detecta si el rollup está instalado, salvo con STATS_ROLLUPS_AL_INICIAR=1.
+
+Uso:
+    python -m rollups            # crea tablas, índices y triggers y hace la primera reconstrucción
+    python -m rollups --dry-run  # solo muestra el DDL
+"""
+import argparse
+import os
+import threading
+import time
+from typing import List, Optional
+
+from sqlalchemy import bindparam, text
+
+from database import db
+
+TABLA_ROLLUP = "appointments_rollup"
+TABLA_CAMBIOS = "appointments_rollup_cambios"
+TABLA_ESTADO = "appointments_rollup_estado"
+
+# Agregación de citas al grano del rollup; {filtro} restringe los cortes a recalcular
+_SELECT_AGREGADO = """
+SELECT
+    a.fecha as dia,
+    a.professional_identificacion as medico_id,
+    m.sede_id,
+    m.especialidad,
+    a.hora,
+    a.estado,
+    COUNT(*) as total
+FROM appointments a
+LEFT JOIN medicos m ON a.professional_identificacion = m.identificacion
+{filtro}
+GROUP BY a.fecha, a.professional_identificacion, m.sede_id, m.especialidad, a.hora, a.estado
+"""
+
+_CORTES_PENDIENTES = f"""
+SELECT DISTINCT dia, medico_id
+FROM {TABLA_CAMBIOS}
+WHERE id <= :hasta
+"""
+
+# Cambios que se borran por tanda al terminar un refresco
+_LOTE_BORRADO = 1000
+
+_DDL = [
+    # CREATE ... SELECT con WHERE 1 = 0 copia los tipos de columna de appointments/medicos
+    f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_ROLLUP}
+    {_SELECT_AGREGADO.format(filtro="WHERE 1 = 0")}
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_CAMBIOS} (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY
+    )
+    SELECT fecha as dia, professional_identificacion as medico_id
+    FROM appointments WHERE 1 = 0
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_ESTADO} (
+        nombre VARCHAR(50) PRIMARY KEY,
+        watermark BIGINT NULL,
+        actualizado_en DATETIME NULL
+    )
+    """,
+]
+
+_INDICES = {
+    "idx_rollup_dia_medico": f"CREATE INDEX idx_rollup_dia_medico ON {TABLA_ROLLUP} (dia, medico_id)",
+    "idx_rollup_sede_dia": f"CREATE INDEX idx_rollup_sede_dia ON {TABLA_ROLLUP} (sede_id, dia)",
+    "idx_rollup_especialidad_dia": f"CREATE INDEX idx_rollup_especialidad_dia ON {TABLA_ROLLUP} (especialidad, dia)",
+}
+
+_TRIGGERS = {
+    "appointments_rollup_ai": f"""
+    CREATE TRIGGER appointments_rollup_ai AFTER INSERT ON appointments FOR EACH ROW
+        INSERT INTO {TABLA_CAMBIOS} (dia, medico_id)
+        VALUES (NEW.fecha, NEW.professional_identificacion)
+    """,
+    "appointments_rollup_au": f"""
+    CREATE TRIGGER appointments_rollup_au AFTER UPDATE ON appointments FOR EACH ROW
+        INSERT INTO {TABLA_CAMBIOS} (dia, medico_id)
+        VALUES (OLD.fecha, OLD.professional_identificacion),
+               (NEW.fecha, NEW.professional_identificacion)
+    """,
+    "appointments_rollup_ad": f"""
+    CREATE TRIGGER appointments_rollup_ad AFTER DELETE ON appointments FOR EACH ROW
+        INSERT INTO {TABLA_CAMBIOS} (dia, medico_id)
+        VALUES (OLD.fecha, OLD.professional_identificacion)
+    """,
+    # Las citas de un médico que aparece, desaparece o cambia de sede/especialidad
+    # cambian de sede_id/especialidad en el rollup (la unión con medicos es LEFT JOIN)
+    "medicos_rollup_ai": f"""
+    CREATE TRIGGER medicos_rollup_ai AFTER INSERT ON medicos FOR EACH ROW
+        INSERT INTO {TABLA_CAMBIOS} (dia, medico_id)
+        SELECT DISTINCT fecha, professional_identificacion FROM appointments
+        WHERE professional_identificacion = NEW.identificacion
+    """,
+    "medicos_rollup_au": f"""
+    CREATE TRIGGER medicos_rollup_au AFTER UPDATE ON medicos FOR EACH ROW
+        INSERT INTO {TABLA_CAMBIOS} (dia, medico_id)
+        SELECT DISTINCT fecha, professional_identificacion FROM appointments
+        WHERE professional_identificacion IN (OLD.identificacion, NEW.identificacion)
+          AND NOT (OLD.identificacion <=> NEW.identificacion
+                   AND OLD.sede_id <=> NEW.sede_id
+                   AND OLD.especialidad <=> NEW.especialidad)
+    """,
+    "medicos_rollup_ad": f"""
+    CREATE TRIGGER medicos_rollup_ad AFTER DELETE ON medicos FOR EACH ROW
+        INSERT INTO {TABLA_CAMBIOS} (dia, medico_id)
+        SELECT DISTINCT fecha, professional_identificacion FROM appointments
+        WHERE professional_identificacion = OLD.identificacion
+    """,
+}
+
+
+class RollupCitas:
+    """Instala, refresca y expone la frescura de los rollups de citas"""
+
+    def __init__(self, max_edad: float = 300.0, intervalo: float = 60.0, activo: bool = True,
+                 al_iniciar: bool = False, cache_estado: float = 5.0):
+        """
+        Inicializa el gestor de rollups
+
+        Args:
+            max_edad: Segundos desde el último refresco tras los que los rollups
+                dejan de considerarse frescos y las queries vuelven a appointments
+            intervalo: Segundos entre refrescos del refresco periódico
+            activo: Si es False, las queries nunca leen de los rollups
+            al_iniciar: Si la API ejecuta instalar() al arrancar (por defecto solo
+                detecta una instalación hecha con `python -m rollups`)
+            cache_estado: Segundos durante los que se reutiliza la edad leída de la
+                tabla de estado antes de volver a consultarla
+        """
+        self.max_edad = max_edad
+        self.intervalo = intervalo
+        self.activo = activo
+        self.al_iniciar = al_iniciar
+        self.cache_estado = cache_estado
+        self.instalado = False
+        # Edad del último refresco según TABLA_ESTADO (lo haya hecho este proceso
+        # u otro) e instante monotónico de la lectura
+        self._edad: Optional[float] = None
+        self._leida_en: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def instalar(self) -> bool:
+        """
+        Crea (si no existen) las tablas, índices y triggers del rollup
+
+        Returns:
+            True si el rollup quedó instalado
+        """
+        try:
+            with db.engine.begin() as conn:
+                for ddl in _DDL:
+                    conn.execute(text(ddl))
+
+                indices = {
+                    row[0] for row in conn.execute(text(
+                        "SELECT DISTINCT index_name FROM information_schema.statistics "
+                        "WHERE table_schema = DATABASE() AND table_name = :tabla"
+                    ), {"tabla": TABLA_ROLLUP})
+                }
+                for nombre, ddl in _INDICES.items():
+                    if nombre not in indices:
+                        conn.execute(text(ddl))
+
+                triggers = _triggers_existentes(conn)
+                for nombre, ddl in _TRIGGERS.items():
+                    if nombre not in triggers:
+                        conn.execute(text(ddl))
+
+                conn.execute(text(
+                    f"INSERT IGNORE INTO {TABLA_ESTADO} (nombre, watermark) VALUES ('citas', NULL)"
+                ))
+            self.instalado = True
+            print("✅ Rollups de citas instalados")
+        except Exception as e:
+            self.instalado = False
+            print(f"⚠️ No se pudieron instalar los rollups de citas: {e}")
+        return self.instalado
+
+    def detectar(self) -> bool:
+        """
+        Comprueba, sin modificar el esquema, si las tablas y los triggers del
+        rollup existen
+
+        Returns:
+            True si el rollup está instalado
+        """
+        try:
+            with db.engine.connect() as conn:
+                tablas = {
+                    row[0].lower() for row in conn.execute(text(
+                        "SELECT table_name FROM information_schema.tables "
+                        "WHERE table_schema = DATABASE() AND table_name IN :tablas"
+                    ).bindparams(bindparam("tablas", expanding=True)),
+                        {"tablas": [TABLA_ROLLUP, TABLA_CAMBIOS, TABLA_ESTADO]})
+                }
+                triggers = _triggers_existentes(conn)
+        except Exception as e:
+            print(f"⚠️ No se pudo comprobar la instalación de los rollups de citas: {e}")
+            self.instalado = False
+            return False
+        faltan = sorted(
+            {TABLA_ROLLUP, TABLA_CAMBIOS, TABLA_ESTADO} - tablas
+            | set(_TRIGGERS) - triggers
+        )
+        self.instalado = not faltan
+        if faltan:
+            print(f"ℹ️ Rollups de citas sin instalar (faltan {', '.join(faltan)}): ejecutar python -m rollups")
+        return self.instalado
+
+    def refrescar(self) -> int:
+        """
+        Recalcula los cortes (día, médico) anotados en la tabla de cambios y borra
+        los cambios leídos. La primera vez reconstruye el rollup completo.
+
+        Returns:
+            Número de cortes recalculados (-1 en una reconstrucción completa)
+        """
+        if not self.instalado:
+            return 0
+
+        with db.engine.begin() as conn:
+            # Evita que dos procesos refresquen a la vez
+            if not conn.execute(text("SELECT GET_LOCK('appointments_rollup', 0)")).scalar():
+                return 0
+            try:
+                watermark = conn.execute(text(
+                    f"SELECT watermark FROM {TABLA_ESTADO} WHERE nombre = 'citas' FOR UPDATE"
+                )).scalar()
+                # Solo se borran los cambios leídos aquí: uno con id menor cuya
+                # transacción aún no confirmó sigue en la tabla para el próximo refresco
+                leidos: List[int] = [fila[0] for fila in conn.execute(text(
+                    f"SELECT id FROM {TABLA_CAMBIOS} ORDER BY id"
+                ))]
+                hasta = leidos[-1] if leidos else (watermark or 0)
+
+                if watermark is None:
+                    conn.execute(text(f"DELETE FROM {TABLA_ROLLUP}"))
+                    conn.execute(text(
+                        f"INSERT INTO {TABLA_ROLLUP} " + _SELECT_AGREGADO.format(filtro="")
+                    ))
+                    cortes = -1
+                else:
+                    cortes = conn.execute(text(
+                        f"SELECT COUNT(*) FROM ({_CORTES_PENDIENTES}) c"
+                    ), {"hasta": hasta}).scalar() if leidos else 0
+                    if cortes:
+                        # Recalcular un corte de más (un cambio que confirmó entre
+                        # lecturas) es inocuo: el recálculo es idempotente
+                        conn.execute(text(f"""
+                            DELETE r FROM {TABLA_ROLLUP} r
+                            INNER JOIN ({_CORTES_PENDIENTES}) c
+                                ON r.dia <=> c.dia AND r.medico_id <=> c.medico_id
+                        """), {"hasta": hasta})
+                        filtro = f"""
+                        INNER JOIN ({_CORTES_PENDIENTES}) c
+                            ON a.fecha <=> c.dia AND a.professional_identificacion <=> c.medico_id
+                        """
+                        conn.execute(text(
+                            f"INSERT INTO {TABLA_ROLLUP} " + _SELECT_AGREGADO.format(filtro=filtro)
+                        ), {"hasta": hasta})
+
+                borrar = text(f"DELETE FROM {TABLA_CAMBIOS} WHERE id IN :ids").bindparams(
+                    bindparam("ids", expanding=True)
+                )
+                for i in range(0, len(leidos), _LOTE_BORRADO):
+                    conn.execute(borrar, {"ids": leidos[i:i + _LOTE_BORRADO]})
+                conn.execute(text(
+                    f"UPDATE {TABLA_ESTADO} SET watermark = :hasta, actualizado_en = NOW() "
+                    "WHERE nombre = 'citas'"
+                ), {"hasta": hasta})
+            finally:
+                conn.execute(text("SELECT RELEASE_LOCK('appointments_rollup')"))
+
+        with self._lock:
+            self._edad, self._leida_en = 0.0, time.monotonic()
+        return cortes
+
+    def edad(self) -> Optional[float]:
+        """
+        Segundos desde el último refresco hecho por cualquier proceso, leídos de
+        TABLA_ESTADO (como mucho una consulta cada `cache_estado` segundos)
+
+        Returns:
+            La edad, o None si el rollup nunca se refrescó o no se pudo leer
+        """
+        if not self.instalado:
+            return None
+        ahora = time.monotonic()
+        with self._lock:
+            if self._leida_en is not None and ahora - self._leida_en < self.cache_estado:
+                return None if self._edad is None else self._edad + (ahora - self._leida_en)
+        try:
+            with db.engine.connect() as conn:
+                # La edad la calcula la base: no depende del reloj de cada servidor
+                edad = conn.execute(text(
+                    f"SELECT TIMESTAMPDIFF(SECOND, actualizado_en, NOW()) FROM {TABLA_ESTADO} "
+                    "WHERE nombre = 'citas'"
+                )).scalar()
+        except Exception as e:
+            print(f"⚠️ No se pudo leer el estado de los rollups: {e}")
+            edad = None
+        with self._lock:
+            self._edad = None if edad is None else float(edad)
+            self._leida_en = ahora
+        return self._edad
+
+    def frescos(self) -> bool:
+        """Indica si las queries pueden leer de los rollups en lugar de appointments"""
+        if not (self.activo and self.instalado):
+            return False
+        edad = self.edad()
+        return edad is not None and edad <= self.max_edad
+
+    def estado(self) -> dict:
+        """Retorna el estado del rollup para diagnóstico"""
+        edad = self.edad()
+        return {
+            "activo": self.activo,
+            "instalado": self.instalado,
+            "frescos": self.activo and edad is not None and edad <= self.max_edad,
+            "edad_segundos": round(edad, 1) if edad is not None else None,
+            "max_edad": self.max_edad,
+        }
+
+
+def _triggers_existentes(conn) -> set:
+    """Nombres de los triggers de la base actual"""
+    return {
+        row[0].lower() for row in conn.execute(text(
+            "SELECT trigger_name FROM information_schema.triggers "
+            "WHERE trigger_schema = DATABASE()"
+        ))
+    }
+
+
+# Instancia global para usar en toda la aplicación
+rollups = RollupCitas(
+    max_edad=float(os.getenv("STATS_ROLLUP_MAX_EDAD", "300")),
+    intervalo=float(os.getenv("STATS_ROLLUP_INTERVALO", "60")),
+    activo=os.getenv("STATS_ROLLUPS", "1") != "0",
+    al_iniciar=os.getenv("STATS_ROLLUPS_AL_INICIAR", "0") == "1",
+    cache_estado=float(os.getenv("STATS_ROLLUP_CACHE_ESTADO", "5"))
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crea las tablas y triggers de los rollups de citas")
+    parser.add_argument("--dry-run", action="store_true", help="Solo muestra el DDL")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        for ddl in [*_DDL, *_INDICES.values(), *_TRIGGERS.values()]:
+            print(" ".join(ddl.split()) + ";")
+        return
+    if not db.connect():
+        raise SystemExit(1)
+    try:
+        if not rollups.instalar():
+            raise SystemExit(1)
+        cortes = rollups.refrescar()
+        print(f"🔄 Rollups de citas refrescados ({'completo' if cortes < 0 else f'{cortes} cortes'})")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Pruebas de la agregación fusionada y de los rollups de citas: los siete agregados
+deben dar lo mismo por cualquier camino (queries individuales o fusionada, sobre
+appointments o sobre el rollup)
+
+Las que ejecutan SQL necesitan MySQL (DATE_FORMAT, INTERVAL, triggers): se corren
+con STATS_TEST_DB_URL apuntando a una base vacía de pruebas, p. ej.
+    STATS_TEST_DB_URL=mysql+pymysql://root:@localhost/hospital_test python -m pytest tests
+"""
+import os
+from datetime import date, time, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from queries import EstadisticasQueries
+
+HOY = date.today()
+
+SEDES = [
+    {"id": 1, "name": "Sede Norte", "address": "Calle 1"},
+    {"id": 2, "name": "Sede Sur", "address": "Calle 2"},
+    {"id": 3, "name": "Sede Vacía", "address": "Calle 3"},
+]
+MEDICOS = [
+    {"identificacion": "1", "nombre": "Ana", "apellido": "Díaz", "especialidad": "Cardiología", "sede_id": 1},
+    {"identificacion": "2", "nombre": "Luis", "apellido": "Rojas", "especialidad": "Pediatría", "sede_id": 2},
+    # Médico sin especialidad: sus citas cuentan como "con médico"
+    {"identificacion": "3", "nombre": "Eva", "apellido": "Mora", "especialidad": None, "sede_id": 1},
+    {"identificacion": "4", "nombre": "Juan", "apellido": "Paz", "especialidad": "Cardiología", "sede_id": None},
+]
+# (médico, días atrás, hora, estado); el médico "9" no existe en medicos
+CITAS = [
+    ("1", 5, 9, "atendida"), ("1", 5, 9, "cancelada"), ("1", 40, 10, "atendida"),
+    ("1", 500, 10, "atendida"),
+    ("2", 5, 9, "pendiente"), ("2", 70, 14, "atendida"), ("2", 70, 14, "cancelada"),
+    ("3", 5, 10, "atendida"), ("3", 100, 15, "cancelada"),
+    ("4", 20, 9, "atendida"),
+    ("9", 5, 9, "atendida"), ("9", 400, 16, "pendiente"),
+]
+AGREGADOS = [
+    "citas_por_estado", "distribucion_citas_por_hora", "horarios_pico", "tendencia_citas_por_mes",
+    "especialidades_mas_demandadas", "total_citas_por_sede", "especialidades_por_sede",
+]
+
+
+def _citas() -> pd.DataFrame:
+    return pd.DataFrame([
+        {"id": i + 1, "user_id": i % 3 + 1, "professional_identificacion": medico,
+         "fecha": HOY - timedelta(days=dias), "hora": time(hora), "estado": estado}
+        for i, (medico, dias, hora, estado) in enumerate(CITAS)
+    ])
+
+
+def _valor(v):
+    if isinstance(v, (Decimal, float, np.floating)):
+        return None if pd.isna(v) else round(float(v), 2)
+    if isinstance(v, np.integer):
+        return int(v)
+    if v is None or v is pd.NA:
+        return None
+    return v
+
+
+def _normalizar(df: pd.DataFrame) -> list:
+    """Filas como diccionarios de valores de Python, sin depender del orden de los empates"""
+    return sorted(
+        ({k: _valor(v) for k, v in fila.items()} for fila in df.to_dict("records")),
+        key=repr
+    )
+
+
+# ==================== _dividir_agregado (sin base de datos) ====================
+
+def _base_viva(citas: pd.DataFrame, meses: int = 12) -> pd.DataFrame:
+    """El resultado de la query fusionada sobre appointments, calculado con pandas"""
+    medicos = pd.DataFrame(MEDICOS).rename(columns={"identificacion": "medico"})
+    df = citas.merge(medicos, left_on="professional_identificacion", right_on="medico", how="left")
+    limite = pd.Timestamp(HOY) - pd.DateOffset(months=meses)
+    df = df.assign(
+        mes=pd.to_datetime(df["fecha"]).dt.strftime("%Y-%m"),
+        en_ventana=(pd.to_datetime(df["fecha"]) >= limite).astype(int),
+        con_medico=df["medico"].notna().astype(int),
+    )
+    claves = ["mes", "en_ventana", "hora", "estado", "especialidad", "sede_id", "con_medico"]
+    return df.groupby(claves, dropna=False).size().rename("total").reset_index()
+
+
+def test_dividir_agregado_cuenta_medicos_sin_especialidad_y_no_los_desconocidos():
+    r = EstadisticasQueries._dividir_agregado(_base_viva(_citas()), pd.DataFrame(SEDES).rename(
+        columns={"name": "sede_nombre", "address": "direccion"}))
+
+    especialidades = {f["especialidad"]: f["total_citas"] for f in _normalizar(r["especialidades_mas_demandadas"])}
+    assert especialidades == {"Cardiología": 5, "Pediatría": 3, None: 2}
+
+    assert sum(r["citas_por_estado"]["total"]) == len(CITAS)
+    # La cita de hace 500 días y la del médico desconocido de hace 400 quedan fuera de la ventana
+    assert sum(r["tendencia_citas_por_mes"]["total_citas"]) == len(CITAS) - 2
+    assert sum(r["horarios_pico"]["porcentaje"]) == pytest.approx(100, abs=0.05)
+
+
+def test_dividir_agregado_incluye_sedes_sin_citas():
+    r = EstadisticasQueries._dividir_agregado(_base_viva(_citas()), pd.DataFrame(SEDES).rename(
+        columns={"name": "sede_nombre", "address": "direccion"}))
+
+    sedes = {f["sede_nombre"]: f for f in _normalizar(r["total_citas_por_sede"])}
+    assert sedes["Sede Vacía"]["total_citas"] == 0
+    assert sedes["Sede Norte"] == {
+        "id": 1, "sede_nombre": "Sede Norte", "direccion": "Calle 1",
+        "total_citas": 6, "citas_atendidas": 4, "citas_canceladas": 2, "citas_pendientes": 0,
+    }
+    por_sede = {(f["sede_nombre"], f["especialidad"]): f["total_citas"]
+                for f in _normalizar(r["especialidades_por_sede"])}
+    assert por_sede == {("Sede Norte", "Cardiología"): 4, ("Sede Norte", None): 2, ("Sede Sur", "Pediatría"): 3}
+
+
+def test_dividir_agregado_vacio():
+    r = EstadisticasQueries._dividir_agregado(pd.DataFrame(), pd.DataFrame(SEDES).rename(
+        columns={"name": "sede_nombre", "address": "direccion"}))
+    assert all(r[nombre].empty for nombre in AGREGADOS if nombre != "total_citas_por_sede")
+    assert list(r["total_citas_por_sede"]["total_citas"]) == [0, 0, 0]
+
+
+# ==================== Rollup y fusionada contra las queries individuales (MySQL) ====================
+
+URL_PRUEBAS = os.getenv("STATS_TEST_DB_URL")
+con_mysql = pytest.mark.skipif(
+    not (URL_PRUEBAS or "").startswith("mysql"), reason="requiere STATS_TEST_DB_URL con una base MySQL"
+)
+
+
+@pytest.fixture
+def base_mysql():
+    from benchmarks.datos_sinteticos import appointments, medicos, metadata, sedes
+    from cache import cache_estadisticas
+    from database import db
+    from rollups import TABLA_CAMBIOS, TABLA_ESTADO, TABLA_ROLLUP, rollups
+
+    original = (db.connection_string, cache_estadisticas.activa, rollups.activo, rollups.cache_estado)
+    db.connection_string = URL_PRUEBAS
+    assert db.connect()
+    cache_estadisticas.activa = False
+    rollups.cache_estado = 0
+    with db.engine.begin() as conn:
+        for tabla in (TABLA_ROLLUP, TABLA_CAMBIOS, TABLA_ESTADO):
+            conn.exec_driver_sql(f"DROP TABLE IF EXISTS {tabla}")
+    metadata.drop_all(db.engine)
+    metadata.create_all(db.engine)
+    with db.engine.begin() as conn:
+        conn.execute(sedes.insert(), SEDES)
+        conn.execute(medicos.insert(), MEDICOS)
+        conn.execute(appointments.insert(), _citas().to_dict("records"))
+    try:
+        yield db
+    finally:
+        with db.engine.begin() as conn:
+            for tabla in (TABLA_ROLLUP, TABLA_CAMBIOS, TABLA_ESTADO):
+                conn.exec_driver_sql(f"DROP TABLE IF EXISTS {tabla}")
+        metadata.drop_all(db.engine)
+        db.close()
+        db.connection_string, cache_estadisticas.activa, rollups.activo, rollups.cache_estado = original
+        rollups.instalado = False
+
+
+def _individuales() -> dict:
+    return {
+        nombre: _normalizar(getattr(EstadisticasQueries, nombre)())
+        for nombre in AGREGADOS
+    }
+
+
+def _fusionados() -> dict:
+    r = EstadisticasQueries.estadisticas_citas_fusionadas(meses=12)
+    return {nombre: _normalizar(r[nombre]) for nombre in AGREGADOS}
+
+
+def _caminos() -> dict:
+    """Los siete agregados por los cuatro caminos"""
+    from rollups import rollups
+
+    rollups.activo = False
+    resultados = {"individual": _individuales(), "fusionada": _fusionados()}
+    rollups.activo = True
+    assert rollups.frescos()
+    resultados["rollup_individual"] = _individuales()
+    resultados["rollup_fusionada"] = _fusionados()
+    return resultados
+
+
+@con_mysql
+def test_todos_los_caminos_dan_lo_mismo(base_mysql):
+    from rollups import rollups
+
+    assert rollups.instalar()
+    assert rollups.refrescar() == -1
+
+    caminos = _caminos()
+    for camino, resultado in caminos.items():
+        for nombre in AGREGADOS:
+            assert resultado[nombre] == caminos["individual"][nombre], (camino, nombre)
+
+
+@con_mysql
+def test_refresco_incremental_sigue_a_citas_y_medicos(base_mysql):
+    from rollups import rollups
+
+    assert rollups.instalar()
+    rollups.refrescar()
+    with base_mysql.engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO appointments (id, user_id, professional_identificacion, fecha, hora, estado) "
+            "VALUES (100, 1, '2', CURDATE(), '11:00:00', 'atendida')"
+        )
+        conn.exec_driver_sql("UPDATE appointments SET estado = 'cancelada' WHERE id = 1")
+        conn.exec_driver_sql("DELETE FROM appointments WHERE id = 3")
+        # Cambiar la especialidad y la sede de un médico reubica todas sus citas del rollup
+        conn.exec_driver_sql("UPDATE medicos SET especialidad = 'Neurología', sede_id = 2 WHERE identificacion = '3'")
+        # El médico desconocido aparece: sus citas pasan a contar como "con médico"
+        conn.exec_driver_sql(
+            "INSERT INTO medicos (identificacion, nombre, apellido, especialidad, sede_id) "
+            "VALUES ('9', 'Rosa', 'Gil', 'Pediatría', 3)"
+        )
+    assert rollups.refrescar() > 0
+
+    caminos = _caminos()
+    for camino, resultado in caminos.items():
+        for nombre in AGREGADOS:
+            assert resultado[nombre] == caminos["individual"][nombre], (camino, nombre)
+    with base_mysql.engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM appointments_rollup_cambios").scalar() == 0
+
+
+@con_mysql
+def test_frescura_compartida_entre_procesos(base_mysql):
+    from rollups import RollupCitas, rollups
+
+    assert rollups.instalar()
+    # Otro proceso (otra instancia) que no refresca: ve el refresco del primero
+    otro = RollupCitas(max_edad=300, cache_estado=0)
+    assert otro.detectar()
+    assert not otro.frescos()
+    rollups.refrescar()
+    assert otro.frescos()
@@ -0,0 +1,56 @@
+"""
+Pruebas de la caché de resultados ante lecturas fallidas de la base
+"""
+import pytest
+
+from cache import CacheResultados
+from database import DatabaseConnection, LecturaFallida
+
+
+@pytest.fixture
+def base(tmp_path):
+    conexion = DatabaseConnection(max_workers=1)
+    conexion.connection_string = f"sqlite:///{tmp_path / 'hospital.db'}"
+    assert conexion.connect()
+    yield conexion
+    conexion.close()
+
+
+def test_lectura_fallida_no_se_cachea(base):
+    cache = CacheResultados(ttl_default=600)
+    llamadas = []
+
+    @cache.cacheado()
+    def total_pacientes() -> int:
+        llamadas.append(1)
+        return int(base.fetch_scalar("SELECT COUNT(*) FROM users", default=0))
+
+    # La tabla no existe: el lector retorna el default, pero la caché no debe guardarlo
+    with pytest.raises(LecturaFallida):
+        total_pacientes()
+    assert cache.estadisticas()["entradas"] == 0
+
+    with base.engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE users (id INTEGER PRIMARY KEY)")
+        conn.exec_driver_sql("INSERT INTO users (id) VALUES (1), (2)")
+
+    assert total_pacientes() == 2
+    assert total_pacientes() == 2
+    assert len(llamadas) == 2
+    assert cache.estadisticas()["entradas"] == 1
+
+
+def test_lectura_fallida_en_run_async_tambien_se_detecta(base):
+    import asyncio
+
+    cache = CacheResultados()
+
+    @cache.cacheado()
+    def filas():
+        async def leer():
+            return await base.run_async(base.fetch_rows, "SELECT * FROM no_existe")
+        return asyncio.run(leer())
+
+    with pytest.raises(LecturaFallida):
+        filas()
+    assert cache.estadisticas()["entradas"] == 0
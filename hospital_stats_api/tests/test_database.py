@@ -0,0 +1,91 @@
+"""
+Pruebas de las lecturas en streaming y del health check de DatabaseConnection
+"""
+import asyncio
+import threading
+
+import pytest
+
+from database import DatabaseConnection, StreamsAgotados
+
+
+@pytest.fixture
+def base(tmp_path):
+    conexion = DatabaseConnection(max_workers=1, max_streams=1)
+    conexion.connection_string = f"sqlite:///{tmp_path / 'hospital.db'}"
+    assert conexion.connect()
+    with conexion.engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE users (id INTEGER PRIMARY KEY)")
+        conn.exec_driver_sql(
+            "INSERT INTO users (id) WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 50) "
+            "SELECT i FROM n"
+        )
+    yield conexion
+    conexion.close()
+
+
+def test_resultado_chico_suelta_la_conexion_antes_de_consumirse(base):
+    primeras = base.stream_rows("SELECT id FROM users ORDER BY id", tamano_lote=100)
+    # Ya se leyó todo: el único cupo está libre aunque el iterador no se consumió
+    segundas = base.stream_rows("SELECT id FROM users ORDER BY id", tamano_lote=100)
+    assert [f["id"] for f in primeras] == list(range(1, 51))
+    assert len(list(segundas)) == 50
+
+
+def test_resultado_grande_retiene_el_cupo_hasta_agotarse(base):
+    filas = base.stream_rows("SELECT id FROM users ORDER BY id", tamano_lote=10)
+    with pytest.raises(StreamsAgotados):
+        base.stream_rows("SELECT id FROM users", tamano_lote=10)
+
+    assert [f["id"] for f in filas] == list(range(1, 51))
+    assert len(list(base.stream_rows("SELECT id FROM users", tamano_lote=10))) == 50
+
+
+def test_cerrar_el_iterador_libera_el_cupo(base):
+    filas = base.stream_rows("SELECT id FROM users ORDER BY id", tamano_lote=10)
+    assert next(filas)["id"] == 1
+    filas.close()
+    assert len(list(base.stream_rows("SELECT id FROM users", tamano_lote=10))) == 50
+
+
+def test_error_de_la_query_se_propaga_al_llamar(base):
+    with pytest.raises(Exception):
+        base.stream_rows("SELECT * FROM no_existe")
+    # El cupo no quedó tomado por la lectura fallida
+    assert len(list(base.stream_rows("SELECT id FROM users", tamano_lote=100))) == 50
+
+
+def test_health_check_no_espera_al_pool_de_queries(base):
+    async def escenario():
+        liberar = threading.Event()
+        # Única query del pool bloqueada: cualquier otra lectura por run_async esperaría
+        ocupada = asyncio.ensure_future(base.run_async(liberar.wait))
+        await asyncio.sleep(0.05)
+        try:
+            return await asyncio.wait_for(base.verificar_conexion_async(), 2)
+        finally:
+            liberar.set()
+            await ocupada
+
+    assert asyncio.run(escenario()) is True
+
+
+def test_health_check_se_rinde_si_la_base_no_responde(base):
+    base.espera_salud = 0.05
+    liberar = threading.Event()
+    original = base.verificar_conexion
+    base.verificar_conexion = lambda: liberar.wait() and original()
+
+    async def escenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await base.verificar_conexion_async()
+        # El segundo chequeo comparte el que sigue colgado en lugar de apilar otro
+        colgado = base._salud_en_curso
+        with pytest.raises(asyncio.TimeoutError):
+            await base.verificar_conexion_async()
+        assert base._salud_en_curso is colgado
+        liberar.set()
+        base.espera_salud = 2
+        assert await base.verificar_conexion_async() is True
+
+    asyncio.run(escenario())
@@ -0,0 +1,87 @@
+"""
+Pruebas de la compuerta que aísla las peticiones perfiladas en el event loop y de
+la incorporación de perfiles tomados en otro proceso
+"""
+import asyncio
+import pickle
+import time
+
+import pytest
+
+from perfilador import COLAPSADO, PSTATS, CompuertaExclusiva, CompuertaOcupada, Perfil, perfilar_llamada
+
+
+def test_exclusiva_espera_a_las_en_curso_y_frena_a_las_nuevas():
+    async def escenario():
+        compuerta = CompuertaExclusiva()
+        orden = []
+
+        async def peticion(nombre, segundos):
+            async with compuerta.compartida():
+                orden.append(f"+{nombre}")
+                await asyncio.sleep(segundos)
+                orden.append(f"-{nombre}")
+
+        async def perfilada():
+            async with compuerta.exclusiva(espera=1):
+                orden.append("+perfil")
+                await asyncio.sleep(0.05)
+                orden.append("-perfil")
+
+        en_curso = asyncio.create_task(peticion("a", 0.1))
+        await asyncio.sleep(0.01)
+        perfil = asyncio.create_task(perfilada())
+        await asyncio.sleep(0.01)
+        nueva = asyncio.create_task(peticion("b", 0.01))
+        await asyncio.gather(en_curso, perfil, nueva)
+        return orden
+
+    assert asyncio.run(escenario()) == ["+a", "-a", "+perfil", "-perfil", "+b", "-b"]
+
+
+def test_exclusiva_se_rinde_y_libera_la_compuerta():
+    async def escenario():
+        compuerta = CompuertaExclusiva()
+
+        async def lenta():
+            async with compuerta.compartida():
+                await asyncio.sleep(0.3)
+
+        tarea = asyncio.create_task(lenta())
+        await asyncio.sleep(0.01)
+        with pytest.raises(CompuertaOcupada):
+            async with compuerta.exclusiva(espera=0.05):
+                pass
+        # Tras rendirse, las demás peticiones vuelven a pasar sin esperar
+        async with compuerta.compartida():
+            pass
+        await tarea
+
+    asyncio.run(escenario())
+
+
+def _trabajo_del_grafico(segundos):
+    fin = time.perf_counter() + segundos
+    while time.perf_counter() < fin:
+        pass
+    return "imagen"
+
+
+def test_perfil_de_otro_proceso_se_incorpora_al_de_la_peticion():
+    for formato in (COLAPSADO, PSTATS):
+        resultado, datos = perfilar_llamada(formato, 0.001, _trabajo_del_grafico, 0.05)
+        # Viaja por el pool de procesos: tiene que sobrevivir a pickle
+        datos = pickle.loads(pickle.dumps(datos))
+        assert resultado == "imagen"
+
+        perfil = Perfil(formato, 0.001)
+        perfil.iniciar()
+        perfil.detener()
+        perfil.incorporar(datos, "grafico-proceso")
+        contenido, _, _ = perfil.exportar()
+
+        if formato == COLAPSADO:
+            pilas = [l for l in contenido.decode().splitlines() if "_trabajo_del_grafico" in l]
+            assert pilas and all(l.startswith("grafico-proceso;") for l in pilas)
+        else:
+            assert b"_trabajo_del_grafico" in contenido
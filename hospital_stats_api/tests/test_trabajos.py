@@ -0,0 +1,35 @@
+"""
+Pruebas de la cola de trabajos de reportes
+"""
+from trabajos import COMPLETADO, ColaTrabajos
+
+
+def _reporte(trabajo, directorio):
+    ruta = directorio / f"reporte_{trabajo.id}.html"
+    ruta.write_text("<html></html>")
+    gz = directorio / f"reporte_{trabajo.id}.html.gz"
+    gz.write_bytes(b"gz")
+    return {"file_path": str(ruta), "variantes": {"gzip": str(gz)}, "tamano_bytes": 13}
+
+
+def test_a_dict_no_expone_rutas_del_servidor(tmp_path):
+    cola = ColaTrabajos()
+    trabajo = cola.ejecutar(_reporte, tmp_path)
+    assert trabajo.estado == COMPLETADO
+    assert trabajo.a_dict()["resultado"] == {"tamano_bytes": 13}
+
+
+def test_purga_conserva_el_artefacto_que_se_esta_sirviendo(tmp_path):
+    cola = ColaTrabajos(retencion=1, gracia=60)
+    servido = cola.ejecutar(_reporte, tmp_path)
+    assert cola.servir(servido.id) is servido
+
+    cola.ejecutar(_reporte, tmp_path)
+    assert cola.obtener(servido.id) is servido
+    assert (tmp_path / f"reporte_{servido.id}.html").exists()
+
+    # Pasada la gracia, la siguiente purga lo olvida y borra su archivo y variantes
+    servido.ultimo_acceso -= 61
+    cola.ejecutar(_reporte, tmp_path)
+    assert cola.obtener(servido.id) is None
+    assert not list(tmp_path.glob(f"reporte_{servido.id}.*"))
@@ -0,0 +1,249 @@
+"""
+trabajos.py - Cola de trabajos en segundo plano para la generación de reportes
+
+Cada trabajo corre en un pool de hilos acotado, separado del pool de queries de
+database.py, y guarda su estado, progreso y resultado para consultarlos por id.
+"""
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from trazas import Traza, trazador, trazar
+
+EN_COLA = "en_cola"
+EN_PROCESO = "en_proceso"
+COMPLETADO = "completado"
+ERROR = "error"
+
+# Claves del resultado con rutas del servidor: no salen en a_dict()
+_CLAVES_PRIVADAS = ("file_path", "variantes")
+
+
+class ColaLlena(Exception):
+    """Se alcanzó el máximo de trabajos pendientes"""
+
+
+class Trabajo:
+    """Estado de un trabajo en segundo plano"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.estado = EN_COLA
+        self.progreso = 0
+        self.etapa = "En cola"
+        self.creado_en = time.time()
+        self.iniciado_en: Optional[float] = None
+        self.terminado_en: Optional[float] = None
+        self.resultado: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.artefacto: Optional[str] = None
+        self.ultimo_acceso: Optional[float] = None
+        self.traza: Optional[Traza] = None
+
+    def avanzar(self, progreso: int, etapa: str):
+        """
+        Actualiza el progreso del trabajo (lo llama la función que se ejecuta)
+
+        Args:
+            progreso: Porcentaje completado (0-100)
+            etapa: Descripción de la etapa actual
+        """
+        self.progreso = max(0, min(100, int(progreso)))
+        self.etapa = etapa
+        print(f"  - [{self.id[:8]}] {etapa}")
+
+    @property
+    def terminado(self) -> bool:
+        return self.estado in (COMPLETADO, ERROR)
+
+    def a_dict(self) -> dict:
+        """Representación JSON del estado del trabajo (el resultado, sin rutas del servidor)"""
+        fin = self.terminado_en or time.time()
+        resultado = None
+        if self.resultado is not None:
+            resultado = {k: v for k, v in self.resultado.items() if k not in _CLAVES_PRIVADAS}
+        return {
+            "job_id": self.id,
+            "estado": self.estado,
+            "progreso": self.progreso,
+            "etapa": self.etapa,
+            "creado_en": self.creado_en,
+            "duracion_s": round(fin - self.iniciado_en, 3) if self.iniciado_en else None,
+            "resultado": resultado,
+            "error": self.error,
+        }
+
+
+class ColaTrabajos:
+    """Ejecuta trabajos pesados en segundo plano con un número acotado de hilos"""
+
+    def __init__(self, max_workers: int = 2, max_pendientes: int = 20, retencion: int = 50,
+                 gracia: float = 300.0):
+        """
+        Inicializa la cola
+
+        Args:
+            max_workers: Trabajos ejecutándose a la vez
+            max_pendientes: Trabajos en cola o en proceso admitidos; por encima se rechazan
+            retencion: Trabajos terminados que se conservan (los más antiguos se
+                olvidan y se borra su artefacto)
+            gracia: Segundos tras la última descarga durante los que un trabajo
+                no se purga aunque supere la retención
+        """
+        self.max_workers = max_workers
+        self.max_pendientes = max_pendientes
+        self.retencion = retencion
+        self.gracia = gracia
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._trabajos: "OrderedDict[str, Trabajo]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _obtener_executor(self) -> ThreadPoolExecutor:
+        """Crea (si no existe) el pool de hilos de los trabajos"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="reporte"
+            )
+        return self._executor
+
+    def encolar(self, funcion: Callable[..., Dict[str, Any]], *args, **kwargs) -> Trabajo:
+        """
+        Encola `funcion(trabajo, *args, **kwargs)` y retorna sin esperar
+
+        La función recibe el Trabajo como primer argumento para informar su
+        progreso con `trabajo.avanzar()` y nombrar su artefacto con `trabajo.id`.
+        Debe retornar un dict; si incluye "file_path", se toma como artefacto, y
+        las rutas de "variantes" (p. ej. copias comprimidas) se borran con él.
+
+        Raises:
+            ColaLlena: Si ya hay max_pendientes trabajos sin terminar
+        """
+        with self._lock:
+            pendientes = sum(1 for t in self._trabajos.values() if not t.terminado)
+            if pendientes >= self.max_pendientes:
+                raise ColaLlena(f"Hay {pendientes} trabajos pendientes; intenta más tarde")
+            trabajo = Trabajo()
+            self._trabajos[trabajo.id] = trabajo
+            self._purgar()
+
+        contexto = contextvars.copy_context()
+        self._obtener_executor().submit(contexto.run, self._ejecutar, trabajo, funcion, args, kwargs)
+        return trabajo
+
+    def ejecutar(self, funcion: Callable[..., Dict[str, Any]], *args, **kwargs) -> Trabajo:
+        """
+        Como encolar, pero ejecuta el trabajo en el hilo actual y retorna al
+        terminar (p. ej. para perfilarlo); no cuenta para max_pendientes
+        """
+        trabajo = Trabajo()
+        with self._lock:
+            self._trabajos[trabajo.id] = trabajo
+            self._purgar()
+        self._ejecutar(trabajo, funcion, args, kwargs)
+        return trabajo
+
+    def _ejecutar(self, trabajo: Trabajo, funcion: Callable, args: tuple, kwargs: dict):
+        """Corre un trabajo en un hilo del pool, con su propia traza, y registra su resultado"""
+        if not trazador.activo:
+            self._correr(trabajo, funcion, args, kwargs)
+            return
+        # La petición que lo encoló ya respondió: el trabajo no suma a su traza
+        with trazar(f"trabajo {funcion.__name__} {trabajo.id[:8]}") as traza:
+            trabajo.traza = traza
+            self._correr(trabajo, funcion, args, kwargs)
+        try:
+            trazador.guardar(traza)
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar la traza del trabajo {trabajo.id}: {e}")
+
+    def _correr(self, trabajo: Trabajo, funcion: Callable, args: tuple, kwargs: dict):
+        """Ejecuta la función del trabajo y actualiza su estado"""
+        trabajo.estado = EN_PROCESO
+        trabajo.iniciado_en = time.time()
+        try:
+            resultado = funcion(trabajo, *args, **kwargs)
+            trabajo.resultado = resultado
+            trabajo.artefacto = (resultado or {}).get("file_path")
+            trabajo.progreso = 100
+            trabajo.etapa = "Completado"
+            trabajo.terminado_en = time.time()
+            trabajo.estado = COMPLETADO
+        except Exception as e:
+            print(f"❌ Error en el trabajo {trabajo.id}: {e}")
+            trabajo.error = str(e)
+            trabajo.terminado_en = time.time()
+            trabajo.estado = ERROR
+
+    def _purgar(self):
+        """Olvida los trabajos terminados más antiguos por encima de la retención (con lock)"""
+        terminados = [t for t in self._trabajos.values() if t.terminado]
+        ahora = time.time()
+        for trabajo in terminados[:max(0, len(terminados) - self.retencion)]:
+            # Un artefacto recién pedido puede estar a punto de abrirse (o de recibir
+            # el siguiente Range): se conserva hasta la próxima purga tras la gracia
+            if trabajo.ultimo_acceso is not None and ahora - trabajo.ultimo_acceso < self.gracia:
+                continue
+            del self._trabajos[trabajo.id]
+            rutas = list((trabajo.resultado or {}).get("variantes", {}).values())
+            if trabajo.artefacto:
+                rutas.append(trabajo.artefacto)
+            for ruta in rutas:
+                try:
+                    os.remove(ruta)
+                except FileNotFoundError:
+                    pass
+
+    def obtener(self, trabajo_id: str) -> Optional[Trabajo]:
+        """Retorna el trabajo con ese id, o None si no existe o ya se olvidó"""
+        with self._lock:
+            return self._trabajos.get(trabajo_id)
+
+    def ultimo_completado(self) -> Optional[Trabajo]:
+        """Retorna el trabajo completado más reciente"""
+        with self._lock:
+            return self._ultimo_completado()
+
+    def _ultimo_completado(self) -> Optional[Trabajo]:
+        completados = [t for t in self._trabajos.values() if t.estado == COMPLETADO]
+        return max(completados, key=lambda t: t.terminado_en, default=None)
+
+    def servir(self, trabajo_id: Optional[str] = None) -> Optional[Trabajo]:
+        """
+        Retorna el trabajo cuyo artefacto se va a descargar (por defecto, el último
+        completado) y lo marca como en uso: su artefacto no se purga durante `gracia`
+        segundos
+        """
+        with self._lock:
+            trabajo = self._trabajos.get(trabajo_id) if trabajo_id else self._ultimo_completado()
+            if trabajo is not None:
+                trabajo.ultimo_acceso = time.time()
+        return trabajo
+
+    def estadisticas(self) -> dict:
+        """Cuenta los trabajos por estado"""
+        with self._lock:
+            conteo = {EN_COLA: 0, EN_PROCESO: 0, COMPLETADO: 0, ERROR: 0}
+            for trabajo in self._trabajos.values():
+                conteo[trabajo.estado] += 1
+        return {"max_workers": self.max_workers, "max_pendientes": self.max_pendientes, **conteo}
+
+    def cerrar(self):
+        """Detiene el pool; los trabajos en cola se cancelan"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Instancia global para los reportes
+cola_reportes = ColaTrabajos(
+    max_workers=int(os.getenv("STATS_REPORTE_WORKERS", "2")),
+    max_pendientes=int(os.getenv("STATS_REPORTE_MAX_PENDIENTES", "20")),
+    retencion=int(os.getenv("STATS_REPORTE_RETENCION", "50")),
+    gracia=float(os.getenv("STATS_REPORTE_GRACIA", "300"))
+)
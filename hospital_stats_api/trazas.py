@@ -0,0 +1,262 @@
+"""
+trazas.py - Trazas por petición con tramos anidados (consultas, gráficos, base64,
+template), emitidas como encabezado Server-Timing y, opcionalmente, como archivo
+JSON en el formato de trazas de Chrome (chrome://tracing, ui.perfetto.dev)
+
+La traza en curso vive en una contextvar: llega a los hilos de run_async y a los
+trabajos de cola_reportes, que abren su propia traza. Sin traza activa, `tramo`
+y `registrar_tramo` no hacen nada.
+"""
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Caracteres no permitidos en el nombre de una métrica de Server-Timing (token HTTP)
+_NO_TOKEN = re.compile(r"[^!#$%&'*+\-.^_`|~0-9A-Za-z]")
+
+
+class Tramo:
+    """Intervalo con nombre dentro de una traza"""
+
+    __slots__ = ("id", "padre", "nombre", "inicio", "fin", "hilo", "atributos")
+
+    def __init__(self, id: int, padre: Optional[int], nombre: str, inicio: float, atributos: dict):
+        self.id = id
+        self.padre = padre
+        self.nombre = nombre
+        self.inicio = inicio
+        self.fin: Optional[float] = None
+        self.hilo = threading.current_thread().name
+        self.atributos = atributos
+
+    @property
+    def segundos(self) -> float:
+        return (self.fin or time.perf_counter()) - self.inicio
+
+
+class Traza:
+    """Tramos de una petición o de un trabajo; admite tramos de varios hilos a la vez"""
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self.inicio = time.perf_counter()
+        self.inicio_epoch = time.time()
+        self.fin: Optional[float] = None
+        self._tramos: List[Tramo] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def abrir(self, nombre: str, padre: Optional[int], atributos: dict,
+              inicio: Optional[float] = None) -> Tramo:
+        """Crea un tramo (lo cierra quien lo abrió, asignando `fin`)"""
+        tramo = Tramo(next(self._ids), padre, nombre, inicio or time.perf_counter(), atributos)
+        with self._lock:
+            self._tramos.append(tramo)
+        return tramo
+
+    def desde_epoch(self, instante: float) -> float:
+        """Convierte un time.time() (p. ej. de otro proceso) al reloj de la traza"""
+        return self.inicio + (instante - self.inicio_epoch)
+
+    def terminar(self) -> None:
+        self.fin = self.fin or time.perf_counter()
+
+    @property
+    def segundos(self) -> float:
+        return (self.fin or time.perf_counter()) - self.inicio
+
+    def tramos(self) -> List[Tramo]:
+        with self._lock:
+            return list(self._tramos)
+
+    def resumen(self) -> Dict[str, Tuple[int, float]]:
+        """Número de tramos y segundos sumados por nombre, en orden de aparición"""
+        resumen: Dict[str, Tuple[int, float]] = {}
+        for tramo in self.tramos():
+            if tramo.fin is not None:
+                n, segundos = resumen.get(tramo.nombre, (0, 0.0))
+                resumen[tramo.nombre] = (n + 1, segundos + tramo.segundos)
+        return resumen
+
+    def server_timing(self, total: str = "total", max_entradas: int = 40) -> str:
+        """
+        Valor del encabezado Server-Timing: un total y una entrada por nombre de
+        tramo con sus milisegundos sumados (los tramos en paralelo pueden sumar
+        más que el total) y el número de repeticiones en la descripción
+
+        Args:
+            total: Nombre de la entrada con la duración de la traza hasta ahora
+            max_entradas: Entradas por nombre que se emiten (las de más duración)
+        """
+        resumen = list(self.resumen().items())
+        if len(resumen) > max_entradas:
+            mayores = sorted(resumen, key=lambda e: e[1][1], reverse=True)[:max_entradas]
+            resumen = [e for e in resumen if e in mayores]
+        entradas = [f"{total};dur={self.segundos * 1000:.1f}"]
+        for nombre, (n, segundos) in resumen:
+            entrada = f"{_NO_TOKEN.sub('_', nombre)};dur={segundos * 1000:.1f}"
+            if n > 1:
+                entrada += f';desc="{n}x"'
+            entradas.append(entrada)
+        return ", ".join(entradas)
+
+    def a_chrome(self) -> dict:
+        """Traza en el formato JSON de eventos de Chrome (un evento completo por tramo)"""
+        hilos: Dict[str, int] = {}
+        eventos = []
+        for tramo in self.tramos():
+            if tramo.fin is None:
+                continue
+            tid = hilos.setdefault(tramo.hilo, len(hilos) + 1)
+            eventos.append({
+                "name": tramo.nombre,
+                "cat": tramo.nombre.split(".", 1)[0],
+                "ph": "X",
+                "ts": round((tramo.inicio - self.inicio) * 1e6, 1),
+                "dur": round(tramo.segundos * 1e6, 1),
+                "pid": 1,
+                "tid": tid,
+                "args": {"id": tramo.id, "padre": tramo.padre, **tramo.atributos},
+            })
+        eventos.extend(
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": hilo}}
+            for hilo, tid in hilos.items()
+        )
+        return {
+            "traceEvents": eventos,
+            "displayTimeUnit": "ms",
+            "otherData": {"traza": self.nombre, "inicio": self.inicio_epoch, "duracion_ms": round(self.segundos * 1000, 3)},
+        }
+
+
+traza_actual: ContextVar[Optional[Traza]] = ContextVar("traza_actual", default=None)
+_tramo_actual: ContextVar[Optional[int]] = ContextVar("tramo_actual", default=None)
+
+
+@contextmanager
+def tramo(nombre: str, **atributos) -> Iterator[Optional[Tramo]]:
+    """Mide el bloque como tramo de la traza en curso; los tramos abiertos dentro quedan como hijos"""
+    traza = traza_actual.get()
+    if traza is None:
+        yield None
+        return
+    actual = traza.abrir(nombre, _tramo_actual.get(), atributos)
+    token = _tramo_actual.set(actual.id)
+    try:
+        yield actual
+    except BaseException as e:
+        actual.atributos["error"] = type(e).__name__
+        raise
+    finally:
+        _tramo_actual.reset(token)
+        actual.fin = time.perf_counter()
+
+
+def registrar_tramo(nombre: str, segundos: float, inicio: Optional[float] = None,
+                    inicio_epoch: Optional[float] = None, **atributos) -> None:
+    """
+    Registra un tramo ya terminado en la traza en curso
+
+    Args:
+        nombre: Nombre del tramo
+        segundos: Duración
+        inicio: Instante de inicio en perf_counter (default: ahora - segundos)
+        inicio_epoch: Instante de inicio en time.time(), para tramos medidos en otro proceso
+        **atributos: Datos adicionales del tramo
+    """
+    traza = traza_actual.get()
+    if traza is None:
+        return
+    if inicio_epoch is not None:
+        inicio = traza.desde_epoch(inicio_epoch)
+    fin = time.perf_counter() if inicio is None else inicio + segundos
+    traza.abrir(nombre, _tramo_actual.get(), atributos, fin - segundos).fin = fin
+
+
+@contextmanager
+def trazar(nombre: str) -> Iterator[Traza]:
+    """Abre una traza nueva para el bloque (reemplaza la del contexto, si la hay)"""
+    traza = Traza(nombre)
+    token = traza_actual.set(traza)
+    tramo_token = _tramo_actual.set(None)
+    try:
+        yield traza
+    finally:
+        _tramo_actual.reset(tramo_token)
+        traza_actual.reset(token)
+        traza.terminar()
+
+
+class Trazador:
+    """Configuración de las trazas de la API y escritura de los archivos de traza"""
+
+    def __init__(self, activo: bool = True, directorio: Optional[str] = None,
+                 prefijos: Tuple[str, ...] = ("/api/estadisticas", "/api/reporte")):
+        """
+        Inicializa el trazador
+
+        Args:
+            activo: Si es False, ni el middleware ni los trabajos abren trazas
+            directorio: Donde escribir un JSON por traza (None: no se escriben)
+            prefijos: Rutas cuyas peticiones se trazan
+        """
+        self.activo = activo
+        self.directorio = directorio
+        self.prefijos = prefijos
+
+    def guardar(self, traza: Traza) -> Optional[str]:
+        """Escribe la traza en `directorio` (si está configurado) y retorna la ruta"""
+        if not self.directorio:
+            return None
+        os.makedirs(self.directorio, exist_ok=True)
+        nombre = _NO_TOKEN.sub("_", traza.nombre.replace(" ", "_").replace("/", "_")).strip("_")
+        ruta = os.path.join(self.directorio, f"{int(traza.inicio_epoch * 1000)}_{nombre}.json")
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(traza.a_chrome(), f, ensure_ascii=False, default=str)
+        return ruta
+
+
+class MiddlewareTrazas:
+    """
+    Middleware ASGI que abre una traza por petición trazada y agrega su
+    Server-Timing al iniciar la respuesta. En las respuestas en streaming el
+    encabezado cubre hasta el primer byte; el archivo de traza, la petición completa.
+    """
+
+    def __init__(self, app, trazador: Trazador):
+        self.app = app
+        self.trazador = trazador
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not self.trazador.activo
+                or not scope["path"].startswith(self.trazador.prefijos)):
+            await self.app(scope, receive, send)
+            return
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                encabezados = list(mensaje.get("headers", []))
+                encabezados.append((b"server-timing", traza.server_timing().encode("latin-1")))
+                mensaje = {**mensaje, "headers": encabezados}
+            await send(mensaje)
+
+        with trazar(f"{scope['method']} {scope['path']}") as traza:
+            await self.app(scope, receive, enviar)
+        if self.trazador.directorio and traza.tramos():
+            try:
+                self.trazador.guardar(traza)
+            except OSError as e:
+                print(f"⚠️ No se pudo guardar la traza: {e}")
+
+
+# Instancia global para usar en toda la aplicación
+trazador = Trazador(
+    activo=os.getenv("STATS_TRAZAS", "1") != "0",
+    directorio=os.getenv("STATS_TRAZAS_DIR") or None
+)
@@ -7,29 +7,284 @@ matplotlib.use('Agg')  # Backend no interactivo para generar imágenes
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
-from typing import Optional
+from typing import Optional, Dict, NamedTuple, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import io
+import multiprocessing
 import os
+import time
+
+from cache_graficos import CacheGraficos
+from metricas import metricas
+from trazas import registrar_tramo
+from perfilador import perfil_actual, perfilar_llamada
 
 # Configuración de estilo
 sns.set_style("whitegrid")
 plt.rcParams['figure.figsize'] = (12, 6)
 plt.rcParams['font.size'] = 10
 
+# Tarea de gráfico para renderizar_en_paralelo: (método graficar_*, DataFrame, kwargs)
+TareaGrafico = Tuple[str, pd.DataFrame, dict]
+
+# Formatos de imagen soportados -> extensión del archivo
+FORMATOS = {
+    "png": "png",
+    "png_optimizado": "png",  # paleta de 256 colores + compresión máxima
+    "svg": "svg",
+    "webp": "webp",
+}
+
+class OpcionesRender(NamedTuple):
+    """Parámetros de codificación de las imágenes de los gráficos"""
+    formato: str = "png"
+    dpi: int = 300
+    escala: float = 1.0  # factor sobre el tamaño de figura de cada gráfico
+    calidad: int = 80    # solo WebP
+
+# Perfiles de renderizado, de mayor a menor calidad (y tamaño)
+PERFILES_RENDER = {
+    "alta": OpcionesRender(formato="png", dpi=300),
+    "web": OpcionesRender(formato="webp", dpi=150, calidad=85),
+    "estandar": OpcionesRender(formato="png_optimizado", dpi=150),
+    "ligero": OpcionesRender(formato="webp", dpi=100, escala=0.8, calidad=70),
+    "vectorial": OpcionesRender(formato="svg"),
+}
+
+# Orden en que el modo automático prueba los perfiles hasta cumplir el presupuesto
+# (el SVG queda fuera: su tamaño depende del número de elementos, no de la resolución)
+PERFILES_AUTO = ["alta", "web", "estandar", "ligero"]
+
+def _renderizar_tarea(config: dict, metodo: str, df: pd.DataFrame,
+                      kwargs: dict) -> Tuple[Union[str, bytes], float, float]:
+    """
+    Tarea que corre en un proceso del pool: dibuja un gráfico de forma aislada
+    (cada proceso tiene su propio estado de pyplot) y retorna su imagen junto con
+    el instante de inicio (time.time(), comparable entre procesos) y los segundos
+    de dibujo (las métricas y trazas del proceso hijo no llegan al servidor)
+    """
+    visualizador = VisualizadorEstadisticas(**config)
+    inicio_epoch = time.time()
+    inicio = time.perf_counter()
+    imagen = getattr(visualizador, metodo)(df, **kwargs)
+    return imagen, inicio_epoch, time.perf_counter() - inicio
+
 class VisualizadorEstadisticas:
     """Clase para generar visualizaciones de estadísticas hospitalarias"""
     
-    def __init__(self, output_dir: str = "output"):
+    def __init__(
+        self,
+        output_dir: str = "output",
+        max_procesos: Optional[int] = None,
+        cache: Optional[CacheGraficos] = None,
+        en_memoria: bool = False,
+        copia_en_disco: bool = False,
+        opciones: OpcionesRender = OpcionesRender()
+    ):
         """
         Inicializa el visualizador
         
         Args:
             output_dir: Directorio donde se guardarán las imágenes
+            max_procesos: Procesos para renderizar en paralelo
+                (default: variable STATS_RENDER_PROCESOS o número de CPUs)
+            cache: Caché de imágenes por contenido; si se indica, renderizar_en_paralelo
+                no vuelve a dibujar gráficos cuyos datos y opciones no cambiaron
+            en_memoria: Si es True, los graficar_* retornan los bytes de la imagen
+                en lugar de la ruta de un archivo
+            copia_en_disco: En modo en memoria, guardar también el archivo en output_dir
+            opciones: Formato, DPI y escala por defecto de las imágenes
         """
+        if opciones.formato not in FORMATOS:
+            raise ValueError(f"Formato de imagen no soportado: {opciones.formato}")
         self.output_dir = output_dir
+        self.cache = cache
+        self.en_memoria = en_memoria
+        self.copia_en_disco = copia_en_disco
+        self.opciones = opciones
+        self.max_procesos = max_procesos or int(os.getenv("STATS_RENDER_PROCESOS", "0")) or os.cpu_count() or 1
+        self._pool: Optional[ProcessPoolExecutor] = None
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
     
-    def graficar_citas_por_especialidad(self, df: pd.DataFrame, filename: str = "citas_especialidad.png") -> str:
+    def _obtener_pool(self) -> ProcessPoolExecutor:
+        """Crea (si no existe) el pool de procesos de renderizado"""
+        if self._pool is None:
+            # 'spawn' evita heredar por fork los hilos y locks del servidor
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_procesos,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+    
+    def _config_tarea(self, opciones: OpcionesRender) -> dict:
+        """Parámetros para reconstruir este visualizador dentro de un proceso del pool"""
+        return {
+            "output_dir": self.output_dir,
+            "en_memoria": self.en_memoria,
+            "copia_en_disco": self.copia_en_disco,
+            "opciones": opciones,
+        }
+    
+    def _ruta_salida(self, filename: str, opciones: OpcionesRender) -> str:
+        """Ruta del archivo de salida con la extensión del formato elegido"""
+        base, _ = os.path.splitext(filename)
+        return os.path.join(self.output_dir, f"{base}.{FORMATOS[opciones.formato]}")
+    
+    def _codificar_figura(self, opciones: OpcionesRender) -> bytes:
+        """
+        Codifica la figura actual de pyplot según las opciones de renderizado
+        
+        Args:
+            opciones: Formato, DPI y escala de la imagen
+            
+        Returns:
+            Bytes de la imagen
+        """
+        figura = plt.gcf()
+        if opciones.escala != 1.0:
+            figura.set_size_inches(figura.get_size_inches() * opciones.escala)
+        
+        buffer = io.BytesIO()
+        if opciones.formato == "svg":
+            plt.savefig(buffer, format='svg', bbox_inches='tight')
+        elif opciones.formato == "webp":
+            plt.savefig(buffer, format='webp', dpi=opciones.dpi, bbox_inches='tight',
+                        pil_kwargs={"quality": opciones.calidad, "method": 6})
+        elif opciones.formato == "png_optimizado":
+            plt.savefig(buffer, format='png', dpi=opciones.dpi, bbox_inches='tight')
+            # Los gráficos usan pocos colores: la paleta de 256 apenas se nota y reduce el PNG a la mitad o menos
+            imagen = Image.open(io.BytesIO(buffer.getvalue())).convert("RGB")
+            buffer = io.BytesIO()
+            imagen.quantize(colors=256).save(buffer, format="PNG", optimize=True)
+        else:
+            plt.savefig(buffer, format='png', dpi=opciones.dpi, bbox_inches='tight')
+        return buffer.getvalue()
+    
+    def _exportar_figura(self, filename: str) -> Union[str, bytes]:
+        """
+        Exporta la figura actual de pyplot y la cierra
+        
+        Args:
+            filename: Nombre del archivo de salida (la extensión se ajusta al formato)
+            
+        Returns:
+            Ruta del archivo generado, o los bytes de la imagen en modo en memoria
+        """
+        try:
+            contenido = self._codificar_figura(self.opciones)
+        finally:
+            plt.close()
+        
+        if self.en_memoria and not self.copia_en_disco:
+            return contenido
+        filepath = self._ruta_salida(filename, self.opciones)
+        with open(filepath, 'wb') as f:
+            f.write(contenido)
+        return contenido if self.en_memoria else filepath
+    
+    def renderizar_en_paralelo(
+        self,
+        tareas: Dict[str, TareaGrafico],
+        opciones: Optional[OpcionesRender] = None
+    ) -> Dict[str, Union[str, bytes]]:
+        """
+        Renderiza varios gráficos a la vez, cada uno como tarea independiente
+        en el pool de procesos (pyplot no es seguro entre hilos)
+        
+        Args:
+            tareas: Diccionario nombre -> (método graficar_*, DataFrame, kwargs)
+            opciones: Opciones de renderizado de esta llamada (default: las del visualizador)
+            
+        Returns:
+            Diccionario nombre -> imagen generada (o cacheada), en el mismo orden que `tareas`
+        """
+        with metricas.medir_etapa("visualizacion", "renderizar_en_paralelo") as medicion:
+            imagenes = self._renderizar_en_paralelo(tareas, opciones)
+            medicion.bytes = sum(
+                len(imagen) if isinstance(imagen, bytes) else os.path.getsize(imagen)
+                for imagen in imagenes.values()
+            )
+            return imagenes
+    
+    def _renderizar_en_paralelo(
+        self,
+        tareas: Dict[str, TareaGrafico],
+        opciones: Optional[OpcionesRender]
+    ) -> Dict[str, Union[str, bytes]]:
+        """Cuerpo de renderizar_en_paralelo; registra la duración y el tamaño de cada gráfico"""
+        opciones = opciones or self.opciones
+        if opciones.formato not in FORMATOS:
+            raise ValueError(f"Formato de imagen no soportado: {opciones.formato}")
+        extension = FORMATOS[opciones.formato]
+        
+        # Perfilado: cada gráfico se perfila en su proceso y el perfil vuelve con la imagen
+        perfil = perfil_actual.get()
+        imagenes = {}
+        pendientes = {}
+        for nombre, (metodo, df, kwargs) in tareas.items():
+            clave = None
+            if self.cache is not None:
+                parametros = {k: v for k, v in kwargs.items() if k != "filename"}
+                parametros.update(opciones._asdict())
+                clave = self.cache.clave(getattr(VisualizadorEstadisticas, metodo), df, parametros)
+                contenido = self.cache.obtener(clave, extension)
+                if contenido is not None:
+                    # Acierto: se reutiliza la imagen cacheada sin volver a dibujar
+                    imagenes[nombre] = self._entregar_cacheada(contenido, kwargs["filename"], opciones)
+                    continue
+            if perfil is not None:
+                futuro = self._obtener_pool().submit(
+                    perfilar_llamada, perfil.formato, perfil.intervalo,
+                    _renderizar_tarea, self._config_tarea(opciones), metodo, df, kwargs
+                )
+            else:
+                futuro = self._obtener_pool().submit(
+                    _renderizar_tarea, self._config_tarea(opciones), metodo, df, kwargs
+                )
+            pendientes[nombre] = (metodo, clave, futuro)
+        
+        for nombre, (metodo, clave, futuro) in pendientes.items():
+            try:
+                resultado = futuro.result()
+                if perfil is not None:
+                    resultado, datos = resultado
+                    perfil.incorporar(datos, "grafico-proceso")
+                imagen, inicio_epoch, segundos = resultado
+            except Exception:
+                metricas.registrar_etapa("visualizacion", metodo, None, error=True)
+                raise
+            tamano = len(imagen) if isinstance(imagen, bytes) else os.path.getsize(imagen)
+            metricas.registrar_etapa("visualizacion", metodo, segundos, tamano)
+            registrar_tramo(f"grafico.{metodo}", segundos, inicio_epoch=inicio_epoch, grafico=nombre, bytes=tamano)
+            if clave is not None:
+                if isinstance(imagen, bytes):
+                    self.cache.guardar(clave, imagen, extension)
+                else:
+                    with open(imagen, "rb") as f:
+                        self.cache.guardar(clave, f.read(), extension)
+            imagenes[nombre] = imagen
+        
+        return {nombre: imagenes[nombre] for nombre in tareas}
+    
+    def _entregar_cacheada(self, contenido: bytes, filename: str,
+                           opciones: OpcionesRender) -> Union[str, bytes]:
+        """Entrega una imagen cacheada con la misma forma que la retornaría graficar_*"""
+        if self.en_memoria and not self.copia_en_disco:
+            return contenido
+        filepath = self._ruta_salida(filename, opciones)
+        with open(filepath, "wb") as f:
+            f.write(contenido)
+        return contenido if self.en_memoria else filepath
+    
+    def cerrar(self):
+        """Detiene el pool de procesos de renderizado"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+    
+    def graficar_citas_por_especialidad(self, df: pd.DataFrame, filename: str = "citas_especialidad.png") -> Union[str, bytes]:
         """
         Genera un gráfico de barras mostrando las especialidades más demandadas
         
@@ -38,7 +293,7 @@ class VisualizadorEstadisticas:
             filename: Nombre del archivo de salida
             
         Returns:
-            Ruta completa del archivo generado
+            Ruta completa del archivo generado (o bytes de la imagen en modo en memoria)
         """
         plt.figure(figsize=(12, 6))
         
@@ -60,13 +315,9 @@ class VisualizadorEstadisticas:
                  fontsize=14, fontweight='bold', pad=20)
         plt.tight_layout()
         
-        filepath = os.path.join(self.output_dir, filename)
-        plt.savefig(filepath, dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        return filepath
+        return self._exportar_figura(filename)
     
-    def graficar_citas_temporales(self, df: pd.DataFrame, filename: str = "citas_temporales.png") -> str:
+    def graficar_citas_temporales(self, df: pd.DataFrame, filename: str = "citas_temporales.png") -> Union[str, bytes]:
         """
         Genera un gráfico de líneas mostrando la evolución temporal de citas
         
@@ -75,7 +326,7 @@ class VisualizadorEstadisticas:
             filename: Nombre del archivo de salida
             
         Returns:
-            Ruta completa del archivo generado
+            Ruta completa del archivo generado (o bytes de la imagen en modo en memoria)
         """
         plt.figure(figsize=(14, 7))
         
@@ -102,13 +353,9 @@ class VisualizadorEstadisticas:
         plt.xticks(rotation=45)
         plt.tight_layout()
         
-        filepath = os.path.join(self.output_dir, filename)
-        plt.savefig(filepath, dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        return filepath
+        return self._exportar_figura(filename)
     
-    def graficar_medicos_top(self, df: pd.DataFrame, filename: str = "top_medicos.png", top_n: int = 10) -> str:
+    def graficar_medicos_top(self, df: pd.DataFrame, filename: str = "top_medicos.png", top_n: int = 10) -> Union[str, bytes]:
         """
         Genera un gráfico de barras horizontales con los médicos más solicitados
         
@@ -118,7 +365,7 @@ class VisualizadorEstadisticas:
             top_n: Número de médicos a mostrar (default: 10)
             
         Returns:
-            Ruta completa del archivo generado
+            Ruta completa del archivo generado (o bytes de la imagen en modo en memoria)
         """
         plt.figure(figsize=(12, 8))
         
@@ -146,13 +393,9 @@ class VisualizadorEstadisticas:
                  fontsize=14, fontweight='bold', pad=20)
         plt.tight_layout()
         
-        filepath = os.path.join(self.output_dir, filename)
-        plt.savefig(filepath, dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        return filepath
+        return self._exportar_figura(filename)
     
-    def graficar_distribucion_horarios(self, df: pd.DataFrame, filename: str = "distribucion_horarios.png") -> str:
+    def graficar_distribucion_horarios(self, df: pd.DataFrame, filename: str = "distribucion_horarios.png") -> Union[str, bytes]:
         """
         Genera un gráfico de barras mostrando la distribución de citas por hora del día
         
@@ -161,7 +404,7 @@ class VisualizadorEstadisticas:
             filename: Nombre del archivo de salida
             
         Returns:
-            Ruta completa del archivo generado
+            Ruta completa del archivo generado (o bytes de la imagen en modo en memoria)
         """
         plt.figure(figsize=(14, 6))
         
@@ -194,13 +437,9 @@ class VisualizadorEstadisticas:
         plt.grid(True, axis='y', alpha=0.3)
         plt.tight_layout()
         
-        filepath = os.path.join(self.output_dir, filename)
-        plt.savefig(filepath, dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        return filepath
+        return self._exportar_figura(filename)
     
-    def graficar_pacientes_por_tipo_doc(self, df: pd.DataFrame, filename: str = "tipo_documento.png") -> str:
+    def graficar_pacientes_por_tipo_doc(self, df: pd.DataFrame, filename: str = "tipo_documento.png") -> Union[str, bytes]:
         """
         Genera un gráfico circular (pie chart) mostrando la distribución de pacientes por tipo de documento
         
@@ -209,7 +448,7 @@ class VisualizadorEstadisticas:
             filename: Nombre del archivo de salida
             
         Returns:
-            Ruta completa del archivo generado
+            Ruta completa del archivo generado (o bytes de la imagen en modo en memoria)
         """
         plt.figure(figsize=(10, 8))
         
@@ -242,13 +481,9 @@ class VisualizadorEstadisticas:
         plt.axis('equal')
         plt.tight_layout()
         
-        filepath = os.path.join(self.output_dir, filename)
-        plt.savefig(filepath, dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        return filepath
+        return self._exportar_figura(filename)
     
-    def graficar_comparativa_sedes(self, df: pd.DataFrame, filename: str = "comparativa_sedes.png") -> str:
+    def graficar_comparativa_sedes(self, df: pd.DataFrame, filename: str = "comparativa_sedes.png") -> Union[str, bytes]:
         """
         Genera un gráfico de barras agrupadas comparando las sedes
         
@@ -257,7 +492,7 @@ class VisualizadorEstadisticas:
             filename: Nombre del archivo de salida
             
         Returns:
-            Ruta completa del archivo generado
+            Ruta completa del archivo generado (o bytes de la imagen en modo en memoria)
         """
         plt.figure(figsize=(14, 7))
         
@@ -282,13 +517,9 @@ class VisualizadorEstadisticas:
         plt.grid(True, axis='y', alpha=0.3)
         plt.tight_layout()
         
-        filepath = os.path.join(self.output_dir, filename)
-        plt.savefig(filepath, dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        return filepath
+        return self._exportar_figura(filename)
     
-    def graficar_heatmap_especialidades_sedes(self, df: pd.DataFrame, filename: str = "heatmap_especialidades.png") -> str:
+    def graficar_heatmap_especialidades_sedes(self, df: pd.DataFrame, filename: str = "heatmap_especialidades.png") -> Union[str, bytes]:
         """
         Genera un heatmap mostrando las especialidades más demandadas por sede
         
@@ -297,7 +528,7 @@ class VisualizadorEstadisticas:
             filename: Nombre del archivo de salida
             
         Returns:
-            Ruta completa del archivo generado
+            Ruta completa del archivo generado (o bytes de la imagen en modo en memoria)
         """
         # Crear pivot table para el heatmap
         pivot_df = df.pivot_table(
@@ -325,11 +556,7 @@ class VisualizadorEstadisticas:
                  fontsize=14, fontweight='bold', pad=20)
         plt.tight_layout()
         
-        filepath = os.path.join(self.output_dir, filename)
-        plt.savefig(filepath, dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        return filepath
+        return self._exportar_figura(filename)
 
 # Funciones independientes para cumplir requisito del profesor
 # (al menos 2 funciones fuera de la clase)
@@ -192,13 +192,12 @@ function DashboardAdmin() {
     
     setStatsLoading(true);
     try {
-      const result = await api.generarReporte();
-      alert('✅ ' + result.message);
+      const { job_id } = await api.generarReporte();
+      await api.esperarReporte(job_id);
+      alert('✅ Reporte generado exitosamente');
       
       // Abrir el reporte en nueva pestaña
-      setTimeout(() => {
-        api.descargarReporte();
-      }, 500);
+      api.descargarReporte(job_id);
     } catch (error) {
       console.error('Error generando reporte:', error);
       alert('❌ Error generando reporte: ' + error.message);
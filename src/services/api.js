@@ -161,7 +161,7 @@ const api = {
     return res.json()
   },
 
-  // Generar reporte HTML
+  // Encolar la generación del reporte HTML (retorna el job_id)
   generarReporte: async () => {
     const res = await fetch('http://localhost:8000/api/reporte/generar', {
       method: 'POST'
@@ -170,9 +170,27 @@ const api = {
     return res.json()
   },
 
+  // Estado y progreso de un trabajo de reporte
+  estadoReporte: async (jobId) => {
+    const res = await fetch(`http://localhost:8000/api/reporte/${jobId}`)
+    if (!res.ok) throw new Error('Error consultando el estado del reporte')
+    return res.json()
+  },
+
+  // Consultar el estado cada `intervalo` ms hasta que el reporte termine
+  esperarReporte: async (jobId, intervalo = 1000) => {
+    while (true) {
+      const estado = await api.estadoReporte(jobId)
+      if (estado.estado === 'completado') return estado
+      if (estado.estado === 'error') throw new Error(estado.error || 'Error generando reporte')
+      await new Promise(resolve => setTimeout(resolve, intervalo))
+    }
+  },
+
   // Descargar reporte HTML
-  descargarReporte: () => {
-    window.open('http://localhost:8000/api/reporte/descargar', '_blank')
+  descargarReporte: (jobId) => {
+    const query = jobId ? `?job_id=${jobId}` : ''
+    window.open(`http://localhost:8000/api/reporte/descargar${query}`, '_blank')
   },
 
   // Verificar estado de la API de estadísticas